@@ -0,0 +1,209 @@
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+import uuid
+from collections.abc import Callable, Sequence
+from dataclasses import asdict, dataclass
+from datetime import date, timedelta
+from pathlib import Path
+from typing import TypeVar
+
+from patterns_book.adapters.repository import AbstractRepository
+from patterns_book.adapters.unit_of_work import AbstractUnitOfWork
+from patterns_book.domain import model
+from patterns_book.service import models, services
+
+S = TypeVar("S")
+
+REPEAT = 3
+BASELINE_PATH = Path(__file__).parent / "baselines" / "domain.json"
+
+
+@dataclass
+class Result:
+    name: str
+    ops_per_second: float
+    peak_memory_kib: float
+
+
+class InMemoryProductRepository(AbstractRepository[model.Product]):
+    def __init__(self) -> None:
+        self._products: dict[str, model.Product] = {}
+        self.seen = set()
+
+    def add(self, product: model.Product) -> None:
+        self._products[product.sku] = product
+
+    def get(self, sku: str) -> model.Product | None:
+        return self._products.get(sku)
+
+    def list(self) -> Sequence[model.Product]:
+        return list(self._products.values())
+
+
+class InMemoryUnitOfWork(AbstractUnitOfWork):
+    def __init__(self) -> None:
+        self.products = InMemoryProductRepository()
+
+    def commit(self) -> None:
+        pass
+
+    def rollback(self) -> None:
+        pass
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the allocation domain model and services")
+    parser.add_argument("--batches", type=int, nargs="+", default=[1, 100, 1_000, 10_000])
+    parser.add_argument("--allocated-lines", type=int, default=100_000)
+    parser.add_argument("--operations", type=int, default=1_000)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    results = []
+    for batches_count in args.batches:
+        results.append(_bench_product_allocate(batches_count, args.operations))
+        results.append(_bench_batch_ordering(batches_count))
+        results.append(_bench_services_allocate(batches_count, args.operations))
+    results.append(_bench_available_quantity(args.allocated_lines, args.operations))
+    results.append(_bench_services_add_batch(args.operations))
+
+    baseline = _load_baseline(args.baseline)
+    regressions = _report(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps({r.name: asdict(r) for r in results}, indent=2) + "\n")
+        print(f"Baseline saved to {args.baseline}")  # noqa: T201
+    elif regressions:
+        sys.exit(1)
+
+
+def _bench_product_allocate(batches_count: int, operations: int) -> Result:
+    sku = _sku()
+
+    def setup() -> model.Product:
+        return model.Product(sku, _make_batches(sku, batches_count, qty=max(1, operations // batches_count)))
+
+    def run(product: model.Product) -> None:
+        for _ in range(operations):
+            product.allocate(model.OrderLine(str(uuid.uuid4()), sku, 1))
+
+    return _measure(f"product_allocate[batches={batches_count}]", operations, setup, run)
+
+
+def _bench_batch_ordering(batches_count: int) -> Result:
+    sku = _sku()
+    iterations = max(1, 100_000 // batches_count)
+
+    def setup() -> list[model.Batch]:
+        return _make_batches(sku, batches_count, qty=1)
+
+    def run(batches: list[model.Batch]) -> None:
+        for _ in range(iterations):
+            sorted(batches)
+
+    return _measure(f"batch_ordering[batches={batches_count}]", iterations, setup, run)
+
+
+def _bench_services_allocate(batches_count: int, operations: int) -> Result:
+    sku = _sku()
+
+    def setup() -> InMemoryUnitOfWork:
+        uow = InMemoryUnitOfWork()
+        uow.products.add(model.Product(sku, _make_batches(sku, batches_count, qty=max(1, operations // batches_count))))
+        return uow
+
+    def run(uow: InMemoryUnitOfWork) -> None:
+        for _ in range(operations):
+            services.allocate(models.OrderLine(orderid=str(uuid.uuid4()), sku=sku, qty=1), uow)
+
+    return _measure(f"services_allocate[batches={batches_count}]", operations, setup, run)
+
+
+def _bench_available_quantity(allocated_lines: int, operations: int) -> Result:
+    sku = _sku()
+
+    def setup() -> model.Batch:
+        batch = model.Batch(_sku(), sku, allocated_lines)
+        for _ in range(allocated_lines):
+            batch.allocate(model.OrderLine(str(uuid.uuid4()), sku, 1))
+        return batch
+
+    def run(batch: model.Batch) -> None:
+        for _ in range(operations):
+            _ = batch.available_quantity
+
+    return _measure(f"available_quantity[lines={allocated_lines}]", operations, setup, run)
+
+
+def _bench_services_add_batch(operations: int) -> Result:
+    sku = _sku()
+
+    def setup() -> InMemoryUnitOfWork:
+        return InMemoryUnitOfWork()
+
+    def run(uow: InMemoryUnitOfWork) -> None:
+        for _ in range(operations):
+            services.add_batch(models.Batch(reference=_sku(), sku=sku, qty=10, eta=None), uow)
+
+    return _measure(f"services_add_batch[batches={operations}]", operations, setup, run)
+
+
+def _measure(name: str, operations: int, setup: Callable[[], S], run: Callable[[S], None]) -> Result:
+    elapsed = float("inf")
+    for _ in range(REPEAT):
+        state = setup()
+        started = time.perf_counter()
+        run(state)
+        elapsed = min(elapsed, time.perf_counter() - started)
+
+    state = setup()
+    tracemalloc.start()
+    run(state)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return Result(name, operations / elapsed, peak / 1024)
+
+
+def _report(results: list[Result], baseline: dict[str, Result], tolerance: float) -> list[str]:
+    regressions = []
+    print(f"{'benchmark':<45} {'ops/s':>14} {'peak KiB':>10} {'vs baseline':>12}")  # noqa: T201
+    for result in results:
+        comparison = ""
+        if previous := baseline.get(result.name):
+            ratio = result.ops_per_second / previous.ops_per_second
+            comparison = f"{ratio:.2f}x"
+            if ratio < 1 - tolerance:
+                comparison += " !"
+                regressions.append(result.name)
+        print(  # noqa: T201
+            f"{result.name:<45} {result.ops_per_second:>14,.0f} {result.peak_memory_kib:>10,.0f} {comparison:>12}"
+        )
+    if regressions:
+        print(f"Regressions beyond {tolerance:.0%}: {', '.join(regressions)}")  # noqa: T201
+    return regressions
+
+
+def _load_baseline(path: Path) -> dict[str, Result]:
+    if not path.exists():
+        return {}
+    return {name: Result(**result) for name, result in json.loads(path.read_text()).items()}
+
+
+def _make_batches(sku: str, count: int, qty: int) -> list[model.Batch]:
+    today = date.today()  # noqa: DTZ011
+    return [model.Batch(_sku(), sku, qty, None if i % 10 == 0 else today + timedelta(days=i)) for i in range(count)]
+
+
+def _sku() -> str:
+    return str(uuid.uuid4())
+
+
+if __name__ == "__main__":
+    main()
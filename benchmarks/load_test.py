@@ -0,0 +1,184 @@
+import argparse
+import itertools
+import json
+import random
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Protocol
+
+from flask import Flask
+from sqlalchemy import create_engine, text
+
+from patterns_book.main import create_app_with_settings
+from patterns_book.service import metrics
+from patterns_book.settings import Settings, get_settings
+
+
+class Transport(Protocol):
+    def post(self, path: str, payload: dict[str, Any]) -> tuple[int, dict[str, Any]]: ...
+
+
+class HttpTransport:
+    def __init__(self, base_url: str) -> None:
+        self._base_url = base_url.rstrip("/")
+
+    def post(self, path: str, payload: dict[str, Any]) -> tuple[int, dict[str, Any]]:
+        request = urllib.request.Request(  # noqa: S310
+            f"{self._base_url}{path}",
+            data=json.dumps(payload).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request) as response:  # noqa: S310
+                return response.status, json.loads(response.read() or b"{}")
+        except urllib.error.HTTPError as e:
+            body = e.read()
+            return e.code, json.loads(body) if body.startswith(b"{") else {}
+
+
+class InProcessTransport:
+    def __init__(self, app: Flask) -> None:
+        self._app = app
+        self._local = threading.local()
+
+    def post(self, path: str, payload: dict[str, Any]) -> tuple[int, dict[str, Any]]:
+        if not hasattr(self._local, "client"):
+            self._local.client = self._app.test_client()
+        response = self._local.client.post(path, json=payload)
+        return response.status_code, response.json or {}
+
+
+@dataclass
+class Stats:
+    latencies: list[float] = field(default_factory=list)
+    statuses: Counter[int] = field(default_factory=Counter)
+    allocated: Counter[str] = field(default_factory=Counter)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def record(self, latency: float, status: int, sku: str | None = None) -> None:
+        with self.lock:
+            self.latencies.append(latency)
+            self.statuses[status] += 1
+            if sku is not None:
+                self.allocated[sku] += 1
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Drive the allocation API and report latency and conflict rates")
+    parser.add_argument("--base-url", help="running service to target, the app is served in-process when omitted")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=2_000, help="allocation requests to send")
+    parser.add_argument("--skus", type=int, default=100, help="SKU cardinality")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent of SKU popularity, 0 for uniform")
+    parser.add_argument("--batches-per-sku", type=int, default=3)
+    parser.add_argument("--batch-qty", type=int, default=1_000)
+    parser.add_argument("--line-qty", type=int, default=1)
+    args = parser.parse_args()
+
+    settings = get_settings()
+    transport: Transport
+    if args.base_url:
+        transport = HttpTransport(args.base_url)
+    else:
+        transport = InProcessTransport(create_app_with_settings(settings))
+
+    skus = [f"load-{uuid.uuid4()}" for _ in range(args.skus)]
+    batch_stats = _add_batches(transport, skus, args)
+    allocation_stats, elapsed = _allocate(transport, skus, args)
+
+    _print_endpoint("POST /api/v1/batches", batch_stats, elapsed=None)
+    _print_endpoint("POST /api/v1/allocation", allocation_stats, elapsed)
+    if not args.base_url:
+        print(  # noqa: T201
+            f"in-process conflicts: {metrics.concurrency_conflicts.value}, retries: {metrics.concurrency_retries.value}"
+        )
+    _check_stock(settings, skus, allocation_stats, args)
+
+
+def _add_batches(transport: Transport, skus: list[str], args: argparse.Namespace) -> Stats:
+    stats = Stats()
+
+    def add_batch(sku: str) -> None:
+        payload = {"reference": str(uuid.uuid4()), "sku": sku, "qty": args.batch_qty, "eta": None}
+        started = time.perf_counter()
+        status, _ = transport.post("/api/v1/batches", payload)
+        stats.record(time.perf_counter() - started, status)
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(add_batch, itertools.chain.from_iterable([skus] * args.batches_per_sku)))
+    return stats
+
+
+def _allocate(transport: Transport, skus: list[str], args: argparse.Namespace) -> tuple[Stats, float]:
+    stats = Stats()
+    weights = [1 / rank**args.zipf for rank in range(1, len(skus) + 1)]
+    targets = random.choices(skus, weights=weights, k=args.requests)  # noqa: S311
+
+    def allocate(sku: str) -> None:
+        payload = {"orderid": str(uuid.uuid4()), "sku": sku, "qty": args.line_qty}
+        started = time.perf_counter()
+        status, body = transport.post("/api/v1/allocation", payload)
+        stats.record(time.perf_counter() - started, status, sku if body.get("batchref") else None)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(allocate, targets))
+    return stats, time.perf_counter() - started
+
+
+def _print_endpoint(name: str, stats: Stats, elapsed: float | None) -> None:
+    total = len(stats.latencies)
+    p50, p95, p99 = _percentiles(stats.latencies)
+    print(name)  # noqa: T201
+    if elapsed is not None:
+        print(f"  throughput: {total / elapsed:,.1f} req/s")  # noqa: T201
+    print(f"  latency ms: p50={p50 * 1000:.1f} p95={p95 * 1000:.1f} p99={p99 * 1000:.1f}")  # noqa: T201
+    print(f"  statuses: {dict(sorted(stats.statuses.items()))}")  # noqa: T201
+    print(f"  conflict rate: {stats.statuses[409] / total:.2%}, server errors: {_server_errors(stats) / total:.2%}")  # noqa: T201
+
+
+def _check_stock(settings: Settings, skus: list[str], stats: Stats, args: argparse.Namespace) -> None:
+    engine = create_engine(settings.postgres_dsn, connect_args={"options": f"-csearch_path={settings.postgres_schema}"})
+    with engine.connect() as connection:
+        rows = connection.execute(
+            text(
+                "SELECT b.sku, SUM(b.allocated_quantity), SUM(b.purchased_quantity), "
+                "(SELECT COALESCE(SUM(ol.qty), 0) FROM order_lines ol WHERE ol.sku = b.sku) "
+                "FROM batches b WHERE b.sku = ANY(:skus) GROUP BY b.sku"
+            ),
+            {"skus": skus},
+        ).all()
+    engine.dispose()
+
+    mismatches = [
+        sku
+        for sku, allocated, purchased, ordered in rows
+        if allocated != ordered or allocated > purchased or allocated != stats.allocated[sku] * args.line_qty
+    ]
+    print(f"stock check: {len(rows) - len(mismatches)}/{len(rows)} SKUs consistent")  # noqa: T201
+    for sku in mismatches:
+        print(f"  inconsistent stock for {sku}")  # noqa: T201
+
+
+def _percentiles(latencies: list[float]) -> tuple[float, float, float]:
+    if len(latencies) < 2:  # noqa: PLR2004
+        latency = latencies[0] if latencies else 0.0
+        return latency, latency, latency
+    cuts = statistics.quantiles(latencies, n=100)
+    return cuts[49], cuts[94], cuts[98]
+
+
+def _server_errors(stats: Stats) -> int:
+    return sum(count for status, count in stats.statuses.items() if status >= 500)  # noqa: PLR2004
+
+
+if __name__ == "__main__":
+    main()
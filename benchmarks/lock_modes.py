@@ -0,0 +1,66 @@
+import argparse
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from patterns_book.adapters import db_tables, unit_of_work
+from patterns_book.adapters.repository import LockMode
+from patterns_book.adapters.sessions import init_sessionmaker
+from patterns_book.service import metrics, models, services
+from patterns_book.settings import get_settings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare allocation throughput of the product lock modes")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--allocations", type=int, default=400, help="allocations per run")
+    parser.add_argument("--skus", type=int, nargs="+", default=[1, 4, 16, 64], help="contention levels")
+    parser.add_argument("--modes", type=LockMode, nargs="+", default=list(LockMode))
+    args = parser.parse_args()
+
+    settings = get_settings()
+    init_sessionmaker(settings.postgres_dsn, settings.postgres_schema, settings.engine_options)
+    db_tables.start_mappings(settings.product_loading_strategy)
+
+    print(f"{'skus':>6} {'mode':>12} {'alloc/s':>10} {'failed':>8} {'conflicts':>10} {'retries':>8}")  # noqa: T201
+    for skus_count in args.skus:
+        for lock_mode in args.modes:
+            row = _run(lock_mode, skus_count, args.threads, args.allocations)
+            print(  # noqa: T201
+                f"{skus_count:>6} {lock_mode:>12} {row['throughput']:>10.1f} {row['failed']:>8} "
+                f"{row['conflicts']:>10} {row['retries']:>8}"
+            )
+
+
+def _run(lock_mode: LockMode, skus_count: int, threads: int, allocations: int) -> dict[str, float]:
+    skus = [f"bench-{uuid.uuid4()}" for _ in range(skus_count)]
+    for sku in skus:
+        batch = models.Batch(reference=str(uuid.uuid4()), sku=sku, qty=allocations, eta=None)
+        services.add_batch(batch, unit_of_work.create_sql_alchemy_uow())
+
+    def allocate(_: int) -> bool:
+        line = models.OrderLine(orderid=str(uuid.uuid4()), sku=random.choice(skus), qty=1)  # noqa: S311
+        try:
+            services.allocate(line, unit_of_work.create_sql_alchemy_uow(lock_mode=lock_mode))
+        except unit_of_work.ConcurrencyError:
+            return False
+        return True
+
+    conflicts_before = metrics.concurrency_conflicts.value
+    retries_before = metrics.concurrency_retries.value
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        succeeded = sum(executor.map(allocate, range(allocations)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "throughput": succeeded / elapsed,
+        "failed": allocations - succeeded,
+        "conflicts": metrics.concurrency_conflicts.value - conflicts_before,
+        "retries": metrics.concurrency_retries.value - retries_before,
+    }
+
+
+if __name__ == "__main__":
+    main()
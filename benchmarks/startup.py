@@ -0,0 +1,62 @@
+import argparse
+import os
+import statistics
+import time
+import uuid
+
+started = time.perf_counter()
+
+from patterns_book.main import create_app_with_settings, init_worker_with_settings  # noqa: E402
+from patterns_book.settings import get_settings  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure time from worker start to its first served request")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--prewarm", type=int, default=0, help="connections each worker opens before serving")
+    parser.add_argument(
+        "--preload",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="create the app in the master before forking workers",
+    )
+    args = parser.parse_args()
+
+    settings = get_settings().model_copy(update={"postgres_pool_prewarm": args.prewarm})
+    imported = time.perf_counter()
+    app = create_app_with_settings(settings) if args.preload else None
+    created = time.perf_counter()
+    print(f"import: {(imported - started) * 1000:.1f} ms, app creation: {(created - imported) * 1000:.1f} ms")  # noqa: T201
+
+    readers = []
+    for _ in range(args.workers):
+        reader, writer = os.pipe()
+        if os.fork() == 0:
+            os.close(reader)
+            worker_started = time.perf_counter()
+            worker_app = app or create_app_with_settings(settings)
+            init_worker_with_settings(settings)
+            ready = time.perf_counter()
+            worker_app.test_client().get(f"/api/v1/allocations/{uuid.uuid4()}")
+            served = time.perf_counter()
+            os.write(writer, f"{ready - worker_started} {served - worker_started}".encode())
+            os._exit(0)
+        os.close(writer)
+        readers.append(reader)
+
+    timings = []
+    for reader in readers:
+        with os.fdopen(reader) as pipe:
+            ready, served = map(float, pipe.read().split())
+        timings.append((ready, served))
+    for _ in readers:
+        os.wait()
+
+    ready_ms = [ready * 1000 for ready, _ in timings]
+    served_ms = [served * 1000 for _, served in timings]
+    print(f"worker ready: median {statistics.median(ready_ms):.1f} ms, max {max(ready_ms):.1f} ms")  # noqa: T201
+    print(f"first request: median {statistics.median(served_ms):.1f} ms, max {max(served_ms):.1f} ms")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
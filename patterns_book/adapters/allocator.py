@@ -0,0 +1,70 @@
+import abc
+from enum import StrEnum
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from patterns_book.domain import events, model
+
+
+class AllocationEngine(StrEnum):
+    DOMAIN = "domain"
+    SQL = "sql"
+
+
+class UnknownProductError(Exception):
+    pass
+
+
+class AbstractAllocator(abc.ABC):
+    events: list[events.Event]
+
+    @abc.abstractmethod
+    def allocate(self, line: model.OrderLine) -> str | None: ...
+
+
+# Mirrors Product.allocate: the first batch without the line and with enough stock, warehouse stock first,
+# then by ETA, ties broken by the batch id the aggregate keeps its batches ordered by
+_ALLOCATE = text(
+    "WITH product AS ("
+    "SELECT sku FROM products WHERE sku = :sku"
+    "), batch AS ("
+    "SELECT batches.id FROM batches "
+    "WHERE batches.sku = :sku AND batches.purchased_quantity - batches.allocated_quantity >= :qty "
+    "AND NOT EXISTS ("
+    "SELECT 1 FROM allocations JOIN order_lines ON order_lines.id = allocations.orderline_id "
+    "WHERE allocations.batch_id = batches.id "
+    "AND order_lines.orderid = :orderid AND order_lines.sku = :sku AND order_lines.qty = :qty"
+    ") "
+    "ORDER BY batches.eta IS NOT NULL, batches.eta, batches.id LIMIT 1 FOR UPDATE"
+    "), allocated AS ("
+    "UPDATE batches SET allocated_quantity = batches.allocated_quantity + :qty "
+    "FROM batch WHERE batches.id = batch.id RETURNING batches.id, batches.reference"
+    "), line AS ("
+    "INSERT INTO order_lines (orderid, sku, qty) SELECT :orderid, :sku, :qty FROM allocated RETURNING id"
+    "), allocation AS ("
+    "INSERT INTO allocations (orderline_id, batch_id) SELECT line.id, allocated.id FROM line CROSS JOIN allocated"
+    "), version AS ("
+    "UPDATE products SET version_number = products.version_number + 1 FROM allocated WHERE products.sku = :sku"
+    ") "
+    "SELECT allocated.reference FROM product LEFT JOIN allocated ON true"
+)
+
+
+class SQLAllocator(AbstractAllocator):
+    def __init__(self, session: Session) -> None:
+        self._session = session
+        self.events = []
+
+    def allocate(self, line: model.OrderLine) -> str | None:
+        row = self._session.execute(_ALLOCATE, {"orderid": line.orderid, "sku": line.sku, "qty": line.qty}).first()
+        if row is None:
+            msg = f"Invalid sku {line.sku}"
+            raise UnknownProductError(msg)
+
+        batch_reference: str | None = row.reference
+        if batch_reference is None:
+            self.events.append(events.OutOfStock(line.sku))
+        else:
+            self.events.append(events.Allocated(line.orderid, line.sku, line.qty, batch_reference))
+        return batch_reference
@@ -0,0 +1,67 @@
+import abc
+import csv
+import functools
+import io
+from collections.abc import Callable, Sequence
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from patterns_book.adapters.sessions import get_session
+from patterns_book.service import models
+
+
+class AbstractBatchLoader(abc.ABC):
+    @abc.abstractmethod
+    def load(self, batches: Sequence[models.Batch]) -> int: ...
+
+
+class PostgresBatchLoader(AbstractBatchLoader):
+    def __init__(self, session_factory: Callable[[], Session]) -> None:
+        self._session_factory = session_factory
+
+    def load(self, batches: Sequence[models.Batch]) -> int:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for batch in batches:
+            writer.writerow((batch.reference, batch.sku, batch.qty, batch.eta))
+        buffer.seek(0)
+
+        with self._session_factory() as session:
+            session.execute(
+                text(
+                    "CREATE TEMPORARY TABLE batch_import ("
+                    "reference VARCHAR(255), sku VARCHAR(255), purchased_quantity INTEGER, eta DATE"
+                    ") ON COMMIT DROP"
+                )
+            )
+            cursor = session.connection().connection.cursor()
+            cursor.copy_expert("COPY batch_import FROM STDIN WITH (FORMAT csv)", buffer)
+
+            session.execute(
+                text("INSERT INTO products (sku) SELECT DISTINCT sku FROM batch_import ON CONFLICT DO NOTHING")
+            )
+            # Lock products in SKU order, the same order the repository uses, so imports cannot deadlock with it
+            session.execute(
+                text("SELECT sku FROM products WHERE sku IN (SELECT sku FROM batch_import) ORDER BY sku FOR UPDATE")
+            )
+            # Bumping the version makes concurrent allocations retry and invalidates cached aggregates
+            loaded = session.execute(
+                text(
+                    "WITH loaded AS ("
+                    "INSERT INTO batches (reference, sku, purchased_quantity, eta) "
+                    "SELECT reference, sku, purchased_quantity, eta FROM batch_import "
+                    "ON CONFLICT (reference) DO NOTHING RETURNING sku"
+                    ") "
+                    "UPDATE products SET version_number = version_number + 1 "
+                    "FROM (SELECT sku, count(*) AS batches FROM loaded GROUP BY sku) AS loaded "
+                    "WHERE products.sku = loaded.sku RETURNING loaded.batches"
+                )
+            ).scalars()
+            count = int(sum(loaded))
+            session.commit()
+        return count
+
+
+def create_batch_loader() -> PostgresBatchLoader:
+    return PostgresBatchLoader(functools.partial(get_session, "READ COMMITTED"))
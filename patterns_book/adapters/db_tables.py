@@ -1,6 +1,22 @@
-from sqlalchemy import Column, Date, ForeignKey, Integer, MetaData, String, Table, event
+from typing import Literal
+
+from sqlalchemy import (
+    JSON,
+    Column,
+    Date,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    event,
+    func,
+)
 from sqlalchemy.orm import registry, relationship
 
+from patterns_book.adapters.repository import LoadingStrategy
 from patterns_book.domain.model import Batch, OrderLine, Product
 
 metadata = MetaData()
@@ -13,6 +29,7 @@ order_lines = Table(
     Column("qty", Integer),
     Column("orderid", String(255)),
 )
+Index("ix_order_lines_orderid_sku", order_lines.c.orderid, order_lines.c.sku)
 
 batches = Table(
     "batches",
@@ -21,8 +38,11 @@ batches = Table(
     Column("reference", String(255)),
     Column("sku", ForeignKey("products.sku")),
     Column("purchased_quantity", Integer),
+    Column("allocated_quantity", Integer, nullable=False, server_default="0"),
     Column("eta", Date, nullable=True),
 )
+Index("ix_batches_sku", batches.c.sku)
+Index("uq_batches_reference", batches.c.reference, unique=True)
 
 allocations = Table(
     "allocations",
@@ -31,6 +51,8 @@ allocations = Table(
     Column("orderline_id", ForeignKey("order_lines.id")),
     Column("batch_id", ForeignKey("batches.id")),
 )
+Index("uq_allocations_orderline_batch", allocations.c.orderline_id, allocations.c.batch_id, unique=True)
+Index("ix_allocations_batch_id", allocations.c.batch_id)
 
 products = Table(
     "products",
@@ -39,19 +61,59 @@ products = Table(
     Column("version_number", Integer, nullable=False, server_default="0"),
 )
 
+allocations_view = Table(
+    "allocations_view",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("orderid", String(255), nullable=False, index=True),
+    Column("sku", String(255), nullable=False),
+    Column("batchref", String(255), nullable=False),
+)
+Index(
+    "uq_allocations_view_orderid_sku_batchref",
+    allocations_view.c.orderid,
+    allocations_view.c.sku,
+    allocations_view.c.batchref,
+    unique=True,
+)
+
+outbox = Table(
+    "outbox",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("event_type", String(255), nullable=False),
+    Column("payload", JSON, nullable=False),
+    Column("attempts", Integer, nullable=False, server_default="0"),
+    Column("created_at", DateTime(timezone=True), nullable=False, server_default=func.now()),
+    Column("processed_at", DateTime(timezone=True), nullable=True),
+)
+Index("ix_outbox_pending", outbox.c.id, postgresql_where=outbox.c.processed_at.is_(None))
+
 mapper_registry = registry()
 
+_RELATIONSHIP_LAZY: dict[LoadingStrategy, Literal["select", "selectin", "joined"]] = {
+    LoadingStrategy.LAZY: "select",
+    LoadingStrategy.SELECTIN: "selectin",
+    LoadingStrategy.JOINED: "joined",
+}
 
-def start_mappings() -> None:
+
+def start_mappings(loading_strategy: LoadingStrategy = LoadingStrategy.SELECTIN) -> None:
+    lazy = _RELATIONSHIP_LAZY[loading_strategy]
     mapper_registry.map_imperatively(
         Batch,
         batches,
         properties={
             "_purchased_quantity": batches.c.purchased_quantity,
+            "_allocated_quantity": batches.c.allocated_quantity,
             "_allocations": relationship(
                 OrderLine,
                 secondary=allocations,
                 collection_class=set,
+                lazy=lazy,
+                # An order line belongs to a single batch, deallocating it deletes the line itself
+                cascade="all, delete-orphan",
+                single_parent=True,
             ),
         },
     )
@@ -59,9 +121,12 @@ def start_mappings() -> None:
     mapper_registry.map_imperatively(
         Product,
         products,
+        version_id_col=products.c.version_number,
+        version_id_generator=False,
         properties={
             "_version_number": products.c.version_number,
-            "batches": relationship(Batch, collection_class=list),
+            # A stable batch order keeps ETA ties allocated the same way as the SQL allocator breaks them
+            "batches": relationship(Batch, collection_class=list, lazy=lazy, order_by=batches.c.id),
         },
     )
 
@@ -69,3 +134,14 @@ def start_mappings() -> None:
 @event.listens_for(Product, "load")
 def receive_load(product: Product, _: object) -> None:
     product.events = []
+    product._allocation_order = None  # noqa: SLF001
+    product._allocations_by_orderid = None  # noqa: SLF001
+
+
+@event.listens_for(Product, "expire")
+def receive_expire(product: Product | None, _: object) -> None:
+    # Rolling back a failed flush expires modified states whose object may already be garbage collected
+    if product is None:
+        return
+    product._allocation_order = None  # noqa: SLF001
+    product._allocations_by_orderid = None  # noqa: SLF001
@@ -0,0 +1,198 @@
+import logging
+from dataclasses import dataclass
+
+from sqlalchemy import Connection, text
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+
+class MigrationError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class ConcurrentIndex:
+    name: str
+    table: str
+    columns: tuple[str, ...]
+    unique: bool = False
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    statements: tuple[str, ...] = ()
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block, migrations with indexes run in autocommit mode
+    indexes: tuple[ConcurrentIndex, ...] = ()
+
+
+_ALLOCATIONS_VIEW_KEY = ConcurrentIndex(
+    "uq_allocations_view_orderid_sku_batchref", "allocations_view", ("orderid", "sku", "batchref"), unique=True
+)
+
+MIGRATIONS = (
+    Migration(
+        1,
+        "initial schema",
+        (
+            """
+            CREATE TABLE IF NOT EXISTS products (
+                sku VARCHAR(255) PRIMARY KEY,
+                version_number INTEGER NOT NULL DEFAULT 0
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS order_lines (
+                id SERIAL PRIMARY KEY,
+                sku VARCHAR(255),
+                qty INTEGER,
+                orderid VARCHAR(255)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS batches (
+                id SERIAL PRIMARY KEY,
+                reference VARCHAR(255),
+                sku VARCHAR(255) REFERENCES products (sku),
+                purchased_quantity INTEGER,
+                eta DATE
+            )
+            """,
+            # Databases created before the column was introduced need it added and backfilled
+            "ALTER TABLE batches ADD COLUMN IF NOT EXISTS allocated_quantity INTEGER NOT NULL DEFAULT 0",
+            """
+            CREATE TABLE IF NOT EXISTS allocations (
+                id SERIAL PRIMARY KEY,
+                orderline_id INTEGER REFERENCES order_lines (id),
+                batch_id INTEGER REFERENCES batches (id)
+            )
+            """,
+            """
+            UPDATE batches SET allocated_quantity = allocated.qty
+            FROM (
+                SELECT allocations.batch_id, SUM(order_lines.qty) AS qty
+                FROM allocations JOIN order_lines ON order_lines.id = allocations.orderline_id
+                GROUP BY allocations.batch_id
+            ) AS allocated
+            WHERE batches.id = allocated.batch_id AND batches.allocated_quantity <> allocated.qty
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS allocations_view (
+                id SERIAL PRIMARY KEY,
+                orderid VARCHAR(255) NOT NULL,
+                sku VARCHAR(255) NOT NULL,
+                batchref VARCHAR(255) NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS ix_allocations_view_orderid ON allocations_view (orderid)",
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id SERIAL PRIMARY KEY,
+                event_type VARCHAR(255) NOT NULL,
+                payload JSON NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+                processed_at TIMESTAMP WITH TIME ZONE
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS ix_outbox_pending ON outbox (id) WHERE processed_at IS NULL",
+        ),
+    ),
+    Migration(
+        2,
+        "indexes for aggregate loads and lookups",
+        indexes=(
+            ConcurrentIndex("ix_batches_sku", "batches", ("sku",)),
+            ConcurrentIndex("uq_batches_reference", "batches", ("reference",), unique=True),
+            ConcurrentIndex("uq_allocations_orderline_batch", "allocations", ("orderline_id", "batch_id"), unique=True),
+            ConcurrentIndex("ix_allocations_batch_id", "allocations", ("batch_id",)),
+        ),
+    ),
+    Migration(
+        3,
+        "unique allocations read model rows",
+        indexes=(_ALLOCATIONS_VIEW_KEY,),
+    ),
+    Migration(
+        4,
+        "index for deallocation lookups",
+        indexes=(ConcurrentIndex("ix_order_lines_orderid_sku", "order_lines", ("orderid", "sku")),),
+    ),
+    Migration(
+        5,
+        "allocations read model keyed by batch",
+        # Databases that applied an earlier migration 3 are keyed on (orderid, sku) alone
+        ("DROP INDEX CONCURRENTLY IF EXISTS uq_allocations_view_orderid_sku",),
+        indexes=(_ALLOCATIONS_VIEW_KEY,),
+    ),
+)
+
+
+def migrate(engine: Engine, migrations: tuple[Migration, ...] = MIGRATIONS) -> list[int]:
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS schema_migrations ("
+                "version INTEGER PRIMARY KEY, "
+                "description VARCHAR(255) NOT NULL, "
+                "applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now())"
+            )
+        )
+        applied_versions = set(connection.execute(text("SELECT version FROM schema_migrations")).scalars())
+
+    applied = []
+    for migration in migrations:
+        if migration.version in applied_versions:
+            continue
+
+        logger.info("Applying migration %s: %s", migration.version, migration.description)
+        if migration.indexes:
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                _apply(connection, migration)
+        else:
+            with engine.begin() as connection:
+                _apply(connection, migration)
+        applied.append(migration.version)
+    return applied
+
+
+def _apply(connection: Connection, migration: Migration) -> None:
+    for statement in migration.statements:
+        connection.execute(text(statement))
+    for index in migration.indexes:
+        _create_index(connection, index)
+    connection.execute(
+        text("INSERT INTO schema_migrations (version, description) VALUES (:version, :description)"),
+        {"version": migration.version, "description": migration.description},
+    )
+
+
+def _create_index(connection: Connection, index: ConcurrentIndex) -> None:
+    # A failed concurrent build leaves an INVALID index behind that IF NOT EXISTS would then silently keep
+    invalid = connection.execute(
+        text(
+            "SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid "
+            "WHERE pg_class.relname = :name AND pg_class.relnamespace = current_schema()::regnamespace "
+            "AND NOT pg_index.indisvalid"
+        ),
+        {"name": index.name},
+    ).scalar()
+    if invalid:
+        logger.warning("Dropping invalid index %s", index.name)
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index.name}"))
+
+    columns = ", ".join(index.columns)
+    if index.unique:
+        duplicate = connection.execute(
+            text(f"SELECT {columns} FROM {index.table} GROUP BY {columns} HAVING count(*) > 1 LIMIT 1")  # noqa: S608
+        ).first()
+        if duplicate is not None:
+            msg = f"Cannot create {index.name}, {index.table} has duplicate ({columns}): {tuple(duplicate)}"
+            raise MigrationError(msg)
+
+    unique = "UNIQUE " if index.unique else ""
+    connection.execute(
+        text(f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {index.name} ON {index.table} ({columns})")
+    )
@@ -0,0 +1,52 @@
+import logging
+from collections.abc import Callable, Iterable
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.orm import Session
+
+from patterns_book.adapters.db_tables import outbox
+from patterns_book.domain import events
+
+logger = logging.getLogger(__name__)
+
+
+def add_events(session: Session, pending: Iterable[events.Event]) -> None:
+    rows = [
+        {"event_type": event_type, "payload": payload}
+        for event_type, payload in (events.serialize(event) for event in pending)
+    ]
+    if rows:
+        session.execute(insert(outbox), rows)
+
+
+def relay_batch(
+    session_factory: Callable[[], Session],
+    handle: Callable[[events.Event], None],
+    batch_size: int,
+    max_attempts: int,
+) -> int:
+    with session_factory() as session:
+        rows = session.execute(
+            select(outbox.c.id, outbox.c.event_type, outbox.c.payload)
+            .where(outbox.c.processed_at.is_(None), outbox.c.attempts < max_attempts)
+            .order_by(outbox.c.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        ).all()
+
+        processed_ids, failed_ids = [], []
+        for row in rows:
+            try:
+                handle(events.deserialize(row.event_type, row.payload))
+            except Exception:
+                logger.exception("Failed to relay outbox event %s", row.id)
+                failed_ids.append(row.id)
+            else:
+                processed_ids.append(row.id)
+
+        if processed_ids:
+            session.execute(update(outbox).where(outbox.c.id.in_(processed_ids)).values(processed_at=func.now()))
+        if failed_ids:
+            session.execute(update(outbox).where(outbox.c.id.in_(failed_ids)).values(attempts=outbox.c.attempts + 1))
+        session.commit()
+        return len(rows)
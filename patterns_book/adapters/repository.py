@@ -1,13 +1,45 @@
 import abc
-from collections.abc import Sequence
-from typing import Generic, TypeVar
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Iterable, Sequence
+from enum import StrEnum
+from typing import Any, Generic, TypeVar
 
-from sqlalchemy import select
-from sqlalchemy.orm import Session
+from sqlalchemy import Select, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, class_mapper, joinedload, lazyload, selectinload
+from sqlalchemy.orm.strategy_options import _AbstractLoad
 
 from patterns_book.domain import model
+from patterns_book.service import metrics
 
 T = TypeVar("T")
+S = TypeVar("S")
+
+Allocation = tuple[model.Batch, model.OrderLine]
+
+
+class LoadingStrategy(StrEnum):
+    LAZY = "lazy"
+    SELECTIN = "selectin"
+    JOINED = "joined"
+
+
+class LockMode(StrEnum):
+    NONE = "none"
+    FOR_UPDATE = "for_update"
+    NOWAIT = "nowait"
+
+
+class ReadOnlyError(Exception):
+    pass
+
+
+_LOADERS: dict[LoadingStrategy, Callable[[Any], _AbstractLoad]] = {
+    LoadingStrategy.LAZY: lazyload,
+    LoadingStrategy.SELECTIN: selectinload,
+    LoadingStrategy.JOINED: joinedload,
+}
 
 
 class AbstractRepository(abc.ABC, Generic[T]):
@@ -22,6 +54,78 @@ class AbstractRepository(abc.ABC, Generic[T]):
     @abc.abstractmethod
     def list(self) -> Sequence[T]: ...
 
+    def get_many(self, ids: Iterable[str]) -> Sequence[T]:
+        return [entity for id_ in sorted(set(ids)) if (entity := self.get(id_)) is not None]
+
+    def get_for_order(self, id_: str, orderid: str) -> tuple[T | None, Sequence[Allocation] | None]:  # noqa: ARG002
+        # Without an index to find the order's lines, the aggregate looks them up itself
+        return self.get(id_), None
+
+    def before_commit(self) -> None:
+        return None
+
+    def after_commit(self) -> None:
+        return None
+
+    def after_rollback(self) -> None:
+        return None
+
+
+class AbstractAsyncRepository(abc.ABC, Generic[T]):
+    seen: set[T]
+
+    @abc.abstractmethod
+    def add(self, entity: T) -> None: ...
+
+    @abc.abstractmethod
+    async def get(self, id_: str) -> T | None: ...
+
+    @abc.abstractmethod
+    async def list(self) -> Sequence[T]: ...
+
+
+class ProductCache:
+    def __init__(self, max_entries: int) -> None:
+        self._max_entries = max_entries
+        self._entries: OrderedDict[str, model.Product] = OrderedDict()
+        self._lock = threading.Lock()
+        # Detached copies are made by merging into a private session that never touches the database
+        self._copy_session = Session()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def checkout(self, sku: str, version_number: int, session: Session) -> model.Product | None:
+        with self._lock:
+            cached = self._entries.get(sku)
+            if cached is None or cached._version_number != version_number:  # noqa: SLF001
+                metrics.product_cache_misses.inc()
+                return None
+
+            self._entries.move_to_end(sku)
+            metrics.product_cache_hits.inc()
+            product = session.merge(cached, load=False)
+
+        product.events = []
+        product._allocation_order = None  # noqa: SLF001
+        product._allocations_by_orderid = None  # noqa: SLF001
+        return product
+
+    def snapshot(self, products: Iterable[model.Product]) -> list[model.Product]:
+        with self._lock:
+            copies = [self._copy_session.merge(product, load=False) for product in products]
+            self._copy_session.expunge_all()
+        return copies
+
+    def put(self, snapshots: Iterable[model.Product]) -> None:
+        with self._lock:
+            for product in snapshots:
+                self._entries[product.sku] = product
+                self._entries.move_to_end(product.sku)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                metrics.product_cache_evictions.inc()
+
 
 class SQLRepository(AbstractRepository[T]):
     def __init__(self, session: Session) -> None:
@@ -29,21 +133,164 @@ class SQLRepository(AbstractRepository[T]):
 
 
 class ProductSQLRepository(SQLRepository[model.Product]):
-    def __init__(self, session: Session) -> None:
+    def __init__(
+        self,
+        session: Session,
+        loading_strategy: LoadingStrategy | None = None,
+        lock_mode: LockMode = LockMode.NONE,
+        lock_timeout_ms: int | None = None,
+        cache: ProductCache | None = None,
+    ) -> None:
         super().__init__(session)
         self.seen = set()
+        self._loading_strategy = loading_strategy
+        self._lock_mode = lock_mode
+        self._lock_timeout_ms = lock_timeout_ms
+        self._cache = cache
+        self._snapshots: list[model.Product] = []
 
     def add(self, product: model.Product) -> None:
         self._session.add(product)
         self.seen.add(product)
 
     def get(self, sku: str) -> model.Product | None:
-        product = self._session.execute(select(model.Product).filter_by(sku=sku)).scalars().first()
+        with metrics.stage("load"):
+            self._set_lock_timeout()
+            product = self._load(sku) if self._cache is None else self._get_cached(self._cache, sku)
         if product:
             self.seen.add(product)
         return product
 
+    def get_many(self, skus: Iterable[str]) -> Sequence[model.Product]:
+        if self._cache is not None:
+            return super().get_many(skus)
+
+        with metrics.stage("load"):
+            self._set_lock_timeout()
+            # Rows are locked in SKU order so concurrent multi-product transactions cannot deadlock
+            sku_column = _product_column("sku")
+            query = self._lock(self._select().where(sku_column.in_(set(skus))).order_by(sku_column))
+            products = self._session.execute(query).unique().scalars().all()
+        self.seen.update(products)
+        return products
+
+    def get_for_order(self, sku: str, orderid: str) -> tuple[model.Product | None, Sequence[Allocation] | None]:
+        if self._cache is not None:
+            return super().get_for_order(sku, orderid)
+
+        with metrics.stage("load"):
+            self._set_lock_timeout()
+            # Only the product row and the order's lines are loaded, found through ix_order_lines_orderid_sku
+            product = (
+                self._session.execute(self._lock(_select_products(LoadingStrategy.LAZY).filter_by(sku=sku)))
+                .scalars()
+                .first()
+            )
+            if product is None:
+                return None, None
+
+            allocations = class_mapper(model.Batch).relationships["_allocations"].class_attribute
+            rows = self._session.execute(
+                select(model.Batch, model.OrderLine)
+                .join(allocations)
+                .where(_order_line_column("orderid") == orderid, _order_line_column("sku") == sku)
+                .order_by(class_mapper(model.Batch).columns["id"])
+            ).all()
+        self.seen.add(product)
+        return product, [(batch, line) for batch, line in rows]
+
     def list(self) -> Sequence[model.Product]:
-        products = self._session.execute(select(model.Product)).scalars().all()
+        products = self._session.execute(self._select()).unique().scalars().all()
+        self.seen.update(products)
+        return products
+
+    def before_commit(self) -> None:
+        if self._cache is not None:
+            self._session.flush()
+            self._snapshots = self._cache.snapshot(self.seen)
+
+    def after_commit(self) -> None:
+        if self._cache is not None:
+            self._cache.put(self._snapshots)
+        self._snapshots = []
+
+    def after_rollback(self) -> None:
+        self._snapshots = []
+
+    def _set_lock_timeout(self) -> None:
+        if self._lock_mode is not LockMode.NONE and self._lock_timeout_ms is not None:
+            self._session.execute(select(func.set_config("lock_timeout", f"{self._lock_timeout_ms}ms", True)))  # noqa: FBT003
+
+    def _get_cached(self, cache: ProductCache, sku: str) -> model.Product | None:
+        version_number = self._session.execute(
+            self._lock(select(_product_column("_version_number")).filter_by(sku=sku))
+        ).scalar()
+        if version_number is None:
+            return None
+
+        product = cache.checkout(sku, version_number, self._session)
+        if product is None:
+            product = self._load(sku)
+            if product is not None:
+                cache.put(cache.snapshot([product]))
+        return product
+
+    def _load(self, sku: str) -> model.Product | None:
+        query = self._lock(self._select().filter_by(sku=sku))
+        return self._session.execute(query).unique().scalars().first()
+
+    def _lock(self, query: Select[tuple[S]]) -> Select[tuple[S]]:
+        if self._lock_mode is LockMode.NONE:
+            return query
+        return query.with_for_update(nowait=self._lock_mode is LockMode.NOWAIT, of=model.Product)
+
+    def _select(self) -> Select[tuple[model.Product]]:
+        return _select_products(self._loading_strategy)
+
+
+class ReadOnlyProductSQLRepository(ProductSQLRepository):
+    def add(self, product: model.Product) -> None:
+        msg = f"Cannot add product {product.sku} through a read-only repository"
+        raise ReadOnlyError(msg)
+
+
+class ProductAsyncSQLRepository(AbstractAsyncRepository[model.Product]):
+    def __init__(self, session: AsyncSession) -> None:
+        self._session = session
+        self.seen = set()
+
+    def add(self, product: model.Product) -> None:
+        self._session.add(product)
+        self.seen.add(product)
+
+    async def get(self, sku: str) -> model.Product | None:
+        # Lazy loads cannot run under asyncio, so the whole aggregate is always loaded eagerly
+        query = _select_products(LoadingStrategy.SELECTIN).filter_by(sku=sku)
+        product = (await self._session.execute(query)).unique().scalars().first()
+        if product:
+            self.seen.add(product)
+        return product
+
+    async def list(self) -> Sequence[model.Product]:
+        products = (await self._session.execute(_select_products(LoadingStrategy.SELECTIN))).unique().scalars().all()
         self.seen.update(products)
         return products
+
+
+def _product_column(key: str) -> Any:  # noqa: ANN401
+    return class_mapper(model.Product).columns[key]
+
+
+def _order_line_column(key: str) -> Any:  # noqa: ANN401
+    return class_mapper(model.OrderLine).columns[key]
+
+
+def _select_products(loading_strategy: LoadingStrategy | None) -> Select[tuple[model.Product]]:
+    query = select(model.Product)
+    if loading_strategy is None:
+        return query
+
+    loader = _LOADERS[loading_strategy]
+    batches = class_mapper(model.Product).relationships["batches"].class_attribute
+    allocations = class_mapper(model.Batch).relationships["_allocations"].class_attribute
+    return query.options(loader(batches).options(loader(allocations)))
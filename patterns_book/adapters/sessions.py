@@ -1,29 +1,351 @@
-from functools import lru_cache
+import contextlib
+import functools
+import logging
+import math
+import os
+import threading
+import time
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass
+from typing import Any
 
-from sqlalchemy import create_engine
+from sqlalchemy import Connection, Engine, ExceptionContext, Executable, RowMapping, create_engine, event, text
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import ConnectionPoolEntry, QueuePool
+
+from patterns_book.service import metrics
+
+logger = logging.getLogger(__name__)
 
 session_maker: sessionmaker[Session] | None = None
+async_session_maker: async_sessionmaker[AsyncSession] | None = None
 
 
 class SessionInitializationError(Exception):
     pass
 
 
-@lru_cache
-def init_sessionmaker(postgres_dsn: str, schema: str) -> None:
-    global session_maker  # noqa: PLW0603
-    session_maker = sessionmaker(
-        bind=create_engine(
-            postgres_dsn,
-            connect_args={"options": f"-csearch_path={schema}"},
-            isolation_level="REPEATABLE READ",
-        )
+@dataclass(frozen=True)
+class EngineOptions:
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout_seconds: float = 30.0
+    pool_recycle_seconds: int = -1
+    pool_pre_ping: bool = False
+    statement_timeout_ms: int | None = None
+    query_cache_size: int = 500
+    prepared_statement_cache_size: int = 100
+
+    def engine_arguments(self) -> dict[str, Any]:
+        return {
+            "query_cache_size": self.query_cache_size,
+            "pool_size": self.pool_size,
+            "max_overflow": self.max_overflow,
+            "pool_timeout": self.pool_timeout_seconds,
+            "pool_recycle": self.pool_recycle_seconds,
+            "pool_pre_ping": self.pool_pre_ping,
+        }
+
+    def server_settings(self, schema: str) -> dict[str, str]:
+        settings = {"search_path": schema}
+        if self.statement_timeout_ms is not None:
+            settings["statement_timeout"] = str(self.statement_timeout_ms)
+        return settings
+
+
+class _TimedQueuePool(QueuePool):
+    def _do_get(self) -> ConnectionPoolEntry:
+        try:
+            with metrics.timed(metrics.pool_checkout_wait):
+                return super()._do_get()
+        except PoolTimeoutError:
+            metrics.pool_timeouts.inc()
+            raise
+
+
+_engine_arguments: tuple[str, str, EngineOptions] | None = None
+_async_engine_arguments: tuple[str, str, EngineOptions] | None = None
+
+
+def init_sessionmaker(postgres_dsn: str, schema: str, options: EngineOptions | None = None) -> None:
+    global session_maker, _engine_arguments  # noqa: PLW0603
+    options = options or EngineOptions()
+    if session_maker is not None and _engine_arguments == (postgres_dsn, schema, options):
+        return
+
+    if session_maker is not None:
+        get_engine().dispose()
+    session_maker = sessionmaker(bind=_create_engine(postgres_dsn, schema, options))
+    _engine_arguments = (postgres_dsn, schema, options)
+
+
+def _create_engine(
+    postgres_dsn: str, schema: str, options: EngineOptions, connect_args: dict[str, Any] | None = None
+) -> Engine:
+    server_settings = options.server_settings(schema)
+    return create_engine(
+        postgres_dsn,
+        connect_args={
+            "options": " ".join(f"-c{name}={value}" for name, value in server_settings.items()),
+            **(connect_args or {}),
+        },
+        isolation_level="REPEATABLE READ",
+        poolclass=_TimedQueuePool,
+        **options.engine_arguments(),
     )
 
 
-def get_session() -> Session:
+def get_session(isolation_level: str | None = None) -> Session:
+    if session_maker is None:
+        msg = "session maker has not been initialized"
+        raise SessionInitializationError(msg)
+    if isolation_level is None:
+        return session_maker()
+    return session_maker(bind=get_engine().execution_options(isolation_level=isolation_level))
+
+
+def get_engine() -> Engine:
     if session_maker is None:
         msg = "session maker has not been initialized"
         raise SessionInitializationError(msg)
-    return session_maker()
+    engine: Engine = session_maker.kw["bind"]
+    return engine
+
+
+def prewarm_pool(connections: int) -> None:
+    engine = get_engine()
+    with contextlib.ExitStack() as stack:
+        for _ in range(connections):
+            stack.enter_context(engine.connect())
+
+
+def instrument_engine() -> None:
+    replicas = replica_router.engines if replica_router is not None else []
+    for engine in [get_engine(), *replicas]:
+        if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+            event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+    metrics.Gauge("db_pool_size", "Connections the pool keeps open", lambda: _queue_pool_stat(QueuePool.size))
+    metrics.Gauge(
+        "db_pool_checked_out_connections", "Connections in use", lambda: _queue_pool_stat(QueuePool.checkedout)
+    )
+    metrics.Gauge(
+        "db_pool_overflow_connections",
+        "Connections opened above the pool size",
+        lambda: _queue_pool_stat(QueuePool.overflow),
+    )
+
+
+def _before_cursor_execute(conn: Connection, *_: object) -> None:
+    conn.info.setdefault("statement_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn: Connection, *_: object) -> None:
+    metrics.record_statement(time.perf_counter() - conn.info["statement_started"].pop())
+
+
+def _queue_pool_stat(stat: Callable[[QueuePool], int]) -> int:
+    pool = get_engine().pool
+    return stat(pool) if isinstance(pool, QueuePool) else 0
+
+
+@dataclass(frozen=True)
+class ReplicaOptions:
+    max_lag_seconds: float = 5.0
+    check_interval_seconds: float = 1.0
+    retry_seconds: float = 5.0
+    connect_timeout_seconds: int = 2
+
+
+# A replica that has replayed everything it received is current however long ago the primary last wrote
+_REPLICATION_LAG = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+_QUERY_CANCELED = "57014"
+
+
+def replication_lag(engine: Engine) -> float | None:
+    with engine.connect() as connection:
+        lag = connection.execute(_REPLICATION_LAG).scalar()
+    return None if lag is None else float(lag)
+
+
+@dataclass
+class _Replica:
+    engine: Engine
+    usable: bool = False
+    recheck_at: float = -math.inf
+
+
+class ReplicaRouter:
+    def __init__(
+        self,
+        engines: Sequence[Engine],
+        options: ReplicaOptions | None = None,
+        clock: Callable[[], float] = time.monotonic,
+        measure_lag: Callable[[Engine], float | None] = replication_lag,
+    ) -> None:
+        self._replicas = [_Replica(engine) for engine in engines]
+        self._options = options or ReplicaOptions()
+        self._clock = clock
+        self._measure_lag = measure_lag
+        self._position = 0
+        self._lock = threading.Lock()
+        for replica in self._replicas:
+            event.listen(replica.engine, "handle_error", functools.partial(self._on_error, replica))
+
+    @property
+    def engines(self) -> list[Engine]:
+        return [replica.engine for replica in self._replicas]
+
+    def choose(self) -> Engine | None:
+        with self._lock:
+            start = self._position
+            self._position = (self._position + 1) % len(self._replicas)
+        for offset in range(len(self._replicas)):
+            replica = self._replicas[(start + offset) % len(self._replicas)]
+            if self._is_usable(replica):
+                return replica.engine
+        metrics.replica_fallbacks.inc()
+        return None
+
+    def _is_usable(self, replica: _Replica) -> bool:
+        now = self._clock()
+        if now < replica.recheck_at:
+            return replica.usable
+        try:
+            lag = self._measure_lag(replica.engine)
+        except DBAPIError:
+            self._mark_unavailable(replica)
+            return False
+        replica.usable = lag is not None and lag <= self._options.max_lag_seconds
+        replica.recheck_at = now + self._options.check_interval_seconds
+        return replica.usable
+
+    def _mark_unavailable(self, replica: _Replica) -> None:
+        replica.usable = False
+        replica.recheck_at = self._clock() + self._options.retry_seconds
+
+    def _on_error(self, replica: _Replica, context: ExceptionContext) -> None:
+        # Lost and refused connections take the replica out of rotation, failing statements do not
+        if context.is_disconnect or context.connection is None:
+            self._mark_unavailable(replica)
+
+
+replica_router: ReplicaRouter | None = None
+_replica_arguments: tuple[tuple[str, ...], str, EngineOptions, ReplicaOptions] | None = None
+
+
+def init_replicas(
+    replica_dsns: Sequence[str],
+    schema: str,
+    options: EngineOptions | None = None,
+    replica_options: ReplicaOptions | None = None,
+) -> None:
+    global replica_router, _replica_arguments  # noqa: PLW0603
+    options = options or EngineOptions()
+    replica_options = replica_options or ReplicaOptions()
+    if _replica_arguments == (tuple(replica_dsns), schema, options, replica_options):
+        return
+
+    if replica_router is not None:
+        for engine in replica_router.engines:
+            engine.dispose()
+    replica_router = None
+    if replica_dsns:
+        # Lag probes connect on the request thread, an unreachable host must not stall it for the OS timeout
+        connect_args = {"connect_timeout": replica_options.connect_timeout_seconds}
+        replica_router = ReplicaRouter(
+            [_create_engine(dsn, schema, options, connect_args) for dsn in replica_dsns], replica_options
+        )
+    _replica_arguments = (tuple(replica_dsns), schema, options, replica_options)
+
+
+def get_read_only_session() -> Session:
+    if session_maker is None:
+        msg = "session maker has not been initialized"
+        raise SessionInitializationError(msg)
+    engine = replica_router.choose() if replica_router is not None else None
+    if engine is not None:
+        session = session_maker(bind=engine.execution_options(postgresql_readonly=True))
+        try:
+            # Connecting up front lets a replica that failed since its last probe fall back to the primary
+            session.connection()
+        except DBAPIError:
+            session.close()
+            metrics.replica_fallbacks.inc()
+        else:
+            return session
+    # Falling back to the primary keeps the transaction read-only, so reads cannot start writing there
+    return session_maker(bind=get_engine().execution_options(postgresql_readonly=True))
+
+
+def fetch_read_only(statement: Executable) -> Sequence[RowMapping]:
+    engine = replica_router.choose() if replica_router is not None else None
+    if engine is not None:
+        try:
+            return _fetch(engine, statement)
+        except OperationalError as e:
+            # A statement the replica timed out would time out on the primary as well
+            if getattr(e.orig, "pgcode", None) == _QUERY_CANCELED:
+                raise
+            logger.warning("Retrying a read-only statement on the primary after a replica failed: %s", e)
+            metrics.replica_fallbacks.inc()
+    return _fetch(get_engine(), statement)
+
+
+def _fetch(engine: Engine, statement: Executable) -> Sequence[RowMapping]:
+    with engine.execution_options(postgresql_readonly=True).connect() as connection:
+        return connection.execute(statement).mappings().all()
+
+
+def init_async_sessionmaker(postgres_dsn: str, schema: str, options: EngineOptions | None = None) -> None:
+    global async_session_maker, _async_engine_arguments  # noqa: PLW0603
+    options = options or EngineOptions()
+    if async_session_maker is not None and _async_engine_arguments == (postgres_dsn, schema, options):
+        return
+
+    if async_session_maker is not None:
+        # Closing asyncpg connections needs their event loop, the replaced pool is left to the garbage collector
+        async_session_maker.kw["bind"].sync_engine.dispose(close=False)
+    async_session_maker = async_sessionmaker(
+        bind=create_async_engine(
+            postgres_dsn,
+            connect_args={
+                "server_settings": options.server_settings(schema),
+                "prepared_statement_cache_size": options.prepared_statement_cache_size,
+            },
+            isolation_level="REPEATABLE READ",
+            **options.engine_arguments(),
+        ),
+        expire_on_commit=False,
+    )
+    _async_engine_arguments = (postgres_dsn, schema, options)
+
+
+def get_async_session() -> AsyncSession:
+    if async_session_maker is None:
+        msg = "async session maker has not been initialized"
+        raise SessionInitializationError(msg)
+    return async_session_maker()
+
+
+def _reset_pools_after_fork() -> None:
+    # A forked child must not share sockets with its parent, close=False leaves the parent's connections open
+    if session_maker is not None:
+        get_engine().dispose(close=False)
+    if replica_router is not None:
+        for engine in replica_router.engines:
+            engine.dispose(close=False)
+    if async_session_maker is not None:
+        async_session_maker.kw["bind"].sync_engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_reset_pools_after_fork)
@@ -1,20 +1,90 @@
 import abc
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from typing import Self
 
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
 
-from patterns_book.adapters.repository import AbstractRepository, ProductSQLRepository
-from patterns_book.adapters.sessions import get_session
+from patterns_book.adapters import outbox
+from patterns_book.adapters.allocator import AbstractAllocator, AllocationEngine, SQLAllocator
+from patterns_book.adapters.repository import (
+    AbstractAsyncRepository,
+    AbstractRepository,
+    LockMode,
+    ProductAsyncSQLRepository,
+    ProductCache,
+    ProductSQLRepository,
+    ReadOnlyError,
+    ReadOnlyProductSQLRepository,
+)
+from patterns_book.adapters.sessions import get_async_session, get_read_only_session, get_session
+from patterns_book.adapters.views import create_sql_allocations_view, create_sql_async_allocations_view
+from patterns_book.domain import events as domain_events
 from patterns_book.domain import model as domain_model
-from patterns_book.service.message_bus import AbstractMessageBus, InMemoryMessageBus
+from patterns_book.service import metrics
+from patterns_book.service.message_bus import (
+    AbstractAsyncMessageBus,
+    AbstractMessageBus,
+    AsyncInMemoryMessageBus,
+    InMemoryMessageBus,
+)
+
+_CONCURRENCY_PGCODES = {
+    "40001",  # serialization_failure
+    "40P01",  # deadlock_detected
+    "55P03",  # lock_not_available
+}
+_UNIQUE_VIOLATION = "23505"
+# Transactions creating the same product race on its primary key, the loser finds the product when retried
+_CONCURRENTLY_INSERTED_CONSTRAINTS = {"products_pkey"}
+
+
+class ConcurrencyError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class UnitOfWorkOptions:
+    lock_mode: LockMode = LockMode.NONE
+    lock_timeout_ms: int | None = None
+    message_bus: AbstractMessageBus | None = None
+    use_outbox: bool = False
+    product_cache: ProductCache | None = None
+    allocation_engine: AllocationEngine = AllocationEngine.DOMAIN
+
+
+_options = UnitOfWorkOptions()
+
+
+def configure_unit_of_work(options: UnitOfWorkOptions) -> None:
+    global _options  # noqa: PLW0603
+    _options = options
+
+
+@dataclass(frozen=True)
+class AsyncUnitOfWorkOptions:
+    use_outbox: bool = False
+
+
+_async_options = AsyncUnitOfWorkOptions()
+
+
+def configure_async_unit_of_work(options: AsyncUnitOfWorkOptions) -> None:
+    global _async_options  # noqa: PLW0603
+    _async_options = options
 
 
 class AbstractUnitOfWork(abc.ABC):
     products: AbstractRepository[domain_model.Product]
+    allocator: AbstractAllocator | None = None
 
     def __enter__(self) -> "AbstractUnitOfWork":
         return self
 
-    def __exit__(self, *_: object) -> None:
+    def __exit__(self, _exc_type: object, _exc: BaseException | None, _traceback: object) -> None:
         self.rollback()
 
     @abc.abstractmethod
@@ -30,29 +100,178 @@ class SqlAlchemyUnitOfWork(AbstractUnitOfWork):
         products: AbstractRepository[domain_model.Product],
         session: Session,
         message_bus: AbstractMessageBus,
+        *,
+        use_outbox: bool = False,
+        allocator: AbstractAllocator | None = None,
     ) -> None:
         self.products = products
+        self.allocator = allocator
         self._session = session
         self._message_bus = message_bus
+        self._use_outbox = use_outbox
+
+    def __exit__(self, _exc_type: object, exc: BaseException | None, _traceback: object) -> None:
+        self.rollback()
+        if isinstance(exc, DBAPIError) and _is_concurrency_failure(exc):
+            raise ConcurrencyError(str(exc)) from exc
 
     def commit(self) -> None:
-        self._session.commit()
-        self._publish_events()
+        if self._use_outbox:
+            outbox.add_events(self._session, _collect_events(self.products.seen, self.allocator))
+        try:
+            with metrics.stage("commit"):
+                self.products.before_commit()
+                self._session.commit()
+        except StaleDataError as e:
+            raise ConcurrencyError(str(e)) from e
+        except DBAPIError as e:
+            if _is_concurrency_failure(e):
+                raise ConcurrencyError(str(e)) from e
+            raise
+        self.products.after_commit()
+        if not self._use_outbox:
+            with metrics.stage("publish"):
+                self._publish_events()
 
     def rollback(self) -> None:
         self._session.rollback()
+        self.products.after_rollback()
+        for product in self.products.seen:
+            product.events.clear()
+        if self.allocator is not None:
+            self.allocator.events.clear()
 
     def _publish_events(self) -> None:
+        for event in _collect_events(self.products.seen, self.allocator):
+            self._message_bus.handle(event)
+
+
+class ReadOnlyUnitOfWork(AbstractUnitOfWork):
+    def __init__(self, products: AbstractRepository[domain_model.Product], session: Session) -> None:
+        self.products = products
+        self._session = session
+
+    def commit(self) -> None:
+        msg = "Cannot commit a read-only unit of work"
+        raise ReadOnlyError(msg)
+
+    def rollback(self) -> None:
+        self._session.rollback()
+
+
+class AsyncAbstractUnitOfWork(abc.ABC):
+    products: AbstractAsyncRepository[domain_model.Product]
+
+    async def __aenter__(self) -> Self:
+        return self
+
+    async def __aexit__(self, _exc_type: object, _exc: BaseException | None, _traceback: object) -> None:
+        await self.rollback()
+
+    @abc.abstractmethod
+    async def commit(self) -> None: ...
+
+    @abc.abstractmethod
+    async def rollback(self) -> None: ...
+
+
+class SqlAlchemyAsyncUnitOfWork(AsyncAbstractUnitOfWork):
+    def __init__(
+        self,
+        products: AbstractAsyncRepository[domain_model.Product],
+        session: AsyncSession,
+        message_bus: AbstractAsyncMessageBus,
+        *,
+        use_outbox: bool = False,
+    ) -> None:
+        self.products = products
+        self._session = session
+        self._message_bus = message_bus
+        self._use_outbox = use_outbox
+
+    async def __aexit__(self, _exc_type: object, exc: BaseException | None, _traceback: object) -> None:
+        await self.rollback()
+        if isinstance(exc, DBAPIError) and _is_concurrency_failure(exc):
+            raise ConcurrencyError(str(exc)) from exc
+
+    async def commit(self) -> None:
+        if self._use_outbox:
+            await self._session.run_sync(outbox.add_events, list(_collect_events(self.products.seen)))
+        try:
+            await self._session.commit()
+        except StaleDataError as e:
+            raise ConcurrencyError(str(e)) from e
+        except DBAPIError as e:
+            if _is_concurrency_failure(e):
+                raise ConcurrencyError(str(e)) from e
+            raise
+        if not self._use_outbox:
+            await self._publish_events()
+
+    async def rollback(self) -> None:
+        await self._session.rollback()
         for product in self.products.seen:
-            while product.events:
-                event = product.events.pop(0)
-                self._message_bus.handle(event)
+            product.events.clear()
+
+    async def _publish_events(self) -> None:
+        for event in _collect_events(self.products.seen):
+            await self._message_bus.handle(event)
+
+
+def _collect_events(
+    products: Iterable[domain_model.Product], allocator: AbstractAllocator | None = None
+) -> Iterator[domain_events.Event]:
+    pending = [product.events for product in products]
+    if allocator is not None:
+        pending.append(allocator.events)
+
+    collected: set[domain_events.Event] = set()
+    for events in pending:
+        while events:
+            event = events.pop(0)
+            if event in collected:
+                metrics.suppressed_events.inc("duplicate")
+                continue
+            collected.add(event)
+            yield event
+
 
+def _is_concurrency_failure(error: DBAPIError) -> bool:
+    pgcode = getattr(error.orig, "pgcode", None)
+    if pgcode == _UNIQUE_VIOLATION:
+        diagnostics = getattr(error.orig, "diag", None)
+        return getattr(diagnostics, "constraint_name", None) in _CONCURRENTLY_INSERTED_CONSTRAINTS
+    return pgcode in _CONCURRENCY_PGCODES
 
-def create_sql_alchemy_uow() -> SqlAlchemyUnitOfWork:
-    session = get_session()
+
+def create_sql_alchemy_uow(lock_mode: LockMode | None = None) -> SqlAlchemyUnitOfWork:
+    lock_mode = lock_mode or _options.lock_mode
+    # Row locks only queue writers under READ COMMITTED, REPEATABLE READ fails the waiter after the lock is released
+    session = get_session(isolation_level=None if lock_mode is LockMode.NONE else "READ COMMITTED")
     return SqlAlchemyUnitOfWork(
-        products=ProductSQLRepository(session),
+        products=ProductSQLRepository(
+            session,
+            lock_mode=lock_mode,
+            lock_timeout_ms=_options.lock_timeout_ms,
+            cache=_options.product_cache,
+        ),
+        session=session,
+        message_bus=_options.message_bus or InMemoryMessageBus(create_sql_allocations_view()),
+        use_outbox=_options.use_outbox,
+        allocator=SQLAllocator(session) if _options.allocation_engine is AllocationEngine.SQL else None,
+    )
+
+
+def create_read_only_uow() -> ReadOnlyUnitOfWork:
+    session = get_read_only_session()
+    return ReadOnlyUnitOfWork(ReadOnlyProductSQLRepository(session), session)
+
+
+def create_sql_alchemy_async_uow() -> SqlAlchemyAsyncUnitOfWork:
+    session = get_async_session()
+    return SqlAlchemyAsyncUnitOfWork(
+        products=ProductAsyncSQLRepository(session),
         session=session,
-        message_bus=InMemoryMessageBus(),
+        message_bus=AsyncInMemoryMessageBus(create_sql_async_allocations_view()),
+        use_outbox=_async_options.use_outbox,
     )
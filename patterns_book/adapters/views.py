@@ -0,0 +1,149 @@
+import abc
+from collections.abc import Callable, Sequence
+from typing import Any
+
+from sqlalchemy import Executable, Insert, RowMapping, delete, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from patterns_book.adapters.db_tables import allocations_view, batches, products
+from patterns_book.adapters.sessions import fetch_read_only, get_async_session, get_session
+
+
+class AbstractAllocationsView(abc.ABC):
+    @abc.abstractmethod
+    def add(self, orderid: str, sku: str, batchref: str) -> None: ...
+
+    @abc.abstractmethod
+    def remove(self, orderid: str, sku: str) -> None: ...
+
+    @abc.abstractmethod
+    def get(self, orderid: str) -> list[dict[str, str]]: ...
+
+
+class AbstractAvailabilityView(abc.ABC):
+    @abc.abstractmethod
+    def get(self, sku: str) -> list[dict[str, Any]] | None: ...
+
+
+class AbstractAsyncAllocationsView(abc.ABC):
+    @abc.abstractmethod
+    async def add(self, orderid: str, sku: str, batchref: str) -> None: ...
+
+    @abc.abstractmethod
+    async def remove(self, orderid: str, sku: str) -> None: ...
+
+    @abc.abstractmethod
+    async def get(self, orderid: str) -> list[dict[str, str]]: ...
+
+
+class AllocationsSQLView(AbstractAllocationsView):
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        fetch: Callable[[Executable], Sequence[RowMapping]] | None = None,
+    ) -> None:
+        self._session_factory = session_factory
+        self._fetch = fetch or self._fetch_in_session
+
+    def add(self, orderid: str, sku: str, batchref: str) -> None:
+        with self._session_factory() as session:
+            session.execute(_upsert_allocation(orderid, sku, batchref))
+            session.commit()
+
+    def remove(self, orderid: str, sku: str) -> None:
+        with self._session_factory() as session:
+            session.execute(
+                delete(allocations_view).where(allocations_view.c.orderid == orderid, allocations_view.c.sku == sku)
+            )
+            session.commit()
+
+    def get(self, orderid: str) -> list[dict[str, str]]:
+        rows = self._fetch(
+            select(allocations_view.c.sku, allocations_view.c.batchref)
+            .where(allocations_view.c.orderid == orderid)
+            .order_by(allocations_view.c.id)
+        )
+        return [dict(row) for row in rows]
+
+    def _fetch_in_session(self, statement: Executable) -> Sequence[RowMapping]:
+        with self._session_factory() as session:
+            return session.execute(statement).mappings().all()
+
+
+class AvailabilitySQLView(AbstractAvailabilityView):
+    def __init__(self, fetch: Callable[[Executable], Sequence[RowMapping]]) -> None:
+        self._fetch = fetch
+
+    def get(self, sku: str) -> list[dict[str, Any]] | None:
+        # Batches keep their allocated quantity, so availability never needs the allocations of the aggregate
+        rows = self._fetch(
+            select(
+                batches.c.reference,
+                batches.c.eta,
+                (batches.c.purchased_quantity - batches.c.allocated_quantity).label("available_quantity"),
+            )
+            .select_from(products.outerjoin(batches, batches.c.sku == products.c.sku))
+            .where(products.c.sku == sku)
+            .order_by(batches.c.id)
+        )
+        if not rows:
+            return None
+        return [dict(row) for row in rows if row["reference"] is not None]
+
+
+class AllocationsAsyncSQLView(AbstractAsyncAllocationsView):
+    def __init__(self, session_factory: Callable[[], AsyncSession]) -> None:
+        self._session_factory = session_factory
+
+    async def add(self, orderid: str, sku: str, batchref: str) -> None:
+        async with self._session_factory() as session:
+            await session.execute(_upsert_allocation(orderid, sku, batchref))
+            await session.commit()
+
+    async def remove(self, orderid: str, sku: str) -> None:
+        async with self._session_factory() as session:
+            await session.execute(
+                delete(allocations_view).where(allocations_view.c.orderid == orderid, allocations_view.c.sku == sku)
+            )
+            await session.commit()
+
+    async def get(self, orderid: str) -> list[dict[str, str]]:
+        async with self._session_factory() as session:
+            rows = (
+                await session.execute(
+                    select(allocations_view.c.sku, allocations_view.c.batchref)
+                    .where(allocations_view.c.orderid == orderid)
+                    .order_by(allocations_view.c.id)
+                )
+            ).mappings()
+            return [dict(row) for row in rows]
+
+
+def create_sql_allocations_view() -> AllocationsSQLView:
+    return AllocationsSQLView(get_session)
+
+
+def create_read_only_allocations_view() -> AllocationsSQLView:
+    return AllocationsSQLView(get_session, fetch_read_only)
+
+
+def create_read_only_availability_view() -> AvailabilitySQLView:
+    return AvailabilitySQLView(fetch_read_only)
+
+
+def create_sql_async_allocations_view() -> AllocationsAsyncSQLView:
+    return AllocationsAsyncSQLView(get_async_session)
+
+
+def _upsert_allocation(orderid: str, sku: str, batchref: str) -> Insert:
+    # Events are delivered at least once, replaying an Allocated event must not duplicate the row.
+    # An order may hold several lines of one SKU in different batches, so the batch is part of the key
+    return (
+        insert(allocations_view)
+        .values(orderid=orderid, sku=sku, batchref=batchref)
+        .on_conflict_do_nothing(
+            index_elements=[allocations_view.c.orderid, allocations_view.c.sku, allocations_view.c.batchref]
+        )
+    )
@@ -1,10 +1,51 @@
 from dataclasses import dataclass
+from typing import Any
 
 
 class Event:
     pass
 
 
-@dataclass
+@dataclass(frozen=True)
 class OutOfStock(Event):
     sku: str
+
+
+@dataclass(frozen=True)
+class OutOfStockDigest(Event):
+    sku: str
+    suppressed: int
+
+
+@dataclass(frozen=True)
+class Allocated(Event):
+    orderid: str
+    sku: str
+    qty: int
+    batchref: str
+
+
+@dataclass(frozen=True)
+class Deallocated(Event):
+    orderid: str
+    sku: str
+    qty: int
+
+
+_EVENT_TYPES: dict[str, type[Event]] = {
+    event_type.__name__: event_type
+    for event_type in (
+        OutOfStock,
+        OutOfStockDigest,
+        Allocated,
+        Deallocated,
+    )
+}
+
+
+def serialize(event: Event) -> tuple[str, dict[str, Any]]:
+    return type(event).__name__, dict(vars(event))
+
+
+def deserialize(event_type: str, payload: dict[str, Any]) -> Event:
+    return _EVENT_TYPES[event_type](**payload)
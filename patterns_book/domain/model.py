@@ -1,12 +1,14 @@
 from __future__ import annotations
 
+import bisect
 from dataclasses import dataclass
+from datetime import date
 from typing import TYPE_CHECKING
 
 from patterns_book.domain import events
 
 if TYPE_CHECKING:
-    from datetime import date
+    from collections.abc import Sequence
 
 
 @dataclass(unsafe_hash=True)
@@ -22,19 +24,26 @@ class Batch:
         self.sku = sku
         self.eta = eta
         self._purchased_quantity = qty
+        self._allocated_quantity = 0
         self._allocations: set[OrderLine] = set()
 
+    @property
+    def allocated_quantity(self) -> int:
+        return self._allocated_quantity
+
     @property
     def available_quantity(self) -> int:
-        return self._purchased_quantity - sum(line.qty for line in self._allocations)
+        return self._purchased_quantity - self._allocated_quantity
 
     def allocate(self, line: OrderLine) -> None:
         if self.can_allocate(line):
             self._allocations.add(line)
+            self._allocated_quantity += line.qty
 
     def deallocate(self, line: OrderLine) -> None:
         if line in self._allocations:
             self._allocations.remove(line)
+            self._allocated_quantity -= line.qty
 
     def can_allocate(self, line: OrderLine) -> bool:
         return self.sku == line.sku and self.available_quantity >= line.qty and line not in self._allocations
@@ -55,24 +64,75 @@ class Batch:
         return hash(self.reference)
 
 
+def _allocation_key(batch: Batch) -> tuple[bool, date]:
+    return batch.eta is not None, batch.eta or date.min
+
+
 class Product:
     def __init__(self, sku: str, batches: list[Batch], version_number: int = 0) -> None:
         self.sku = sku
         self.batches = batches
         self.events: list[events.Event] = []
         self._version_number = version_number
+        self._allocation_order: list[Batch] | None = None
+        self._allocations_by_orderid: dict[str, list[tuple[Batch, OrderLine]]] | None = None
+
+    def add_batch(self, batch: Batch) -> None:
+        self.batches.append(batch)
+        self._version_number += 1
+        if self._allocation_order is not None and batch.available_quantity > 0:
+            bisect.insort(self._allocation_order, batch, key=_allocation_key)
 
     def allocate(self, line: OrderLine) -> str | None:
+        allocation_order = self._get_allocation_order()
         try:
-            batch = next(b for b in sorted(self.batches) if b.can_allocate(line))
+            index, batch = next((i, b) for i, b in enumerate(allocation_order) if b.can_allocate(line))
         except StopIteration:
             self.events.append(events.OutOfStock(self.sku))
             return None
 
         batch.allocate(line)
+        if batch.available_quantity == 0:
+            del allocation_order[index]
+        if self._allocations_by_orderid is not None:
+            self._allocations_by_orderid.setdefault(line.orderid, []).append((batch, line))
         self._version_number += 1
+        self.events.append(events.Allocated(line.orderid, line.sku, line.qty, batch.reference))
         return batch.reference
 
+    def deallocate(self, orderid: str, allocations: Sequence[tuple[Batch, OrderLine]] | None = None) -> list[str]:
+        # Allocations located by the caller spare building the orderid map from every line of every batch
+        if allocations is None:
+            allocations = self._get_allocations_by_orderid().pop(orderid, [])
+        elif self._allocations_by_orderid is not None:
+            self._allocations_by_orderid.pop(orderid, None)
+        for batch, line in allocations:
+            was_exhausted = batch.available_quantity == 0
+            batch.deallocate(line)
+            if was_exhausted and self._allocation_order is not None:
+                bisect.insort(self._allocation_order, batch, key=_allocation_key)
+            self.events.append(events.Deallocated(line.orderid, line.sku, line.qty))
+
+        if allocations:
+            self._version_number += 1
+        return [batch.reference for batch, _ in allocations]
+
+    def _get_allocation_order(self) -> list[Batch]:
+        if self._allocation_order is None:
+            self._allocation_order = sorted(
+                (b for b in self.batches if b.available_quantity > 0),
+                key=_allocation_key,
+            )
+        return self._allocation_order
+
+    def _get_allocations_by_orderid(self) -> dict[str, list[tuple[Batch, OrderLine]]]:
+        if self._allocations_by_orderid is None:
+            self._allocations_by_orderid = {}
+            for batch in self.batches:
+                for line in batch._allocations:  # noqa: SLF001
+                    self._allocations_by_orderid.setdefault(line.orderid, []).append((batch, line))
+        return self._allocations_by_orderid
+
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, Product):
             return False
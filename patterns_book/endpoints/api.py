@@ -1,37 +1,161 @@
-from typing import Any
+import io
+from typing import TYPE_CHECKING, Any
 
-from flask import Blueprint, request
+from flask import Blueprint, current_app, request
 from pydantic import ValidationError
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 
-from patterns_book.adapters import unit_of_work
-from patterns_book.service import models, services
+from patterns_book.adapters import batch_loader, unit_of_work, views
+from patterns_book.service import metrics, models, services
+from patterns_book.service.batch_feed import FeedFormat, read_rows
+
+if TYPE_CHECKING:
+    from patterns_book.service.group_commit import AllocationCoordinator
+
+ALLOCATION_COORDINATOR_EXTENSION = "allocation_coordinator"
 
 base_blueprint = Blueprint("api_v1", __name__, url_prefix="/api/v1")
 
 
+@base_blueprint.errorhandler(PoolTimeoutError)
+def shed_load(e: PoolTimeoutError) -> tuple[dict[str, Any], int, dict[str, str]]:
+    # An exhausted pool fails fast so an overloaded worker rejects requests instead of queueing threads
+    return {"errors": [f"Database is overloaded: {e}"]}, 503, {"Retry-After": "1"}
+
+
 @base_blueprint.route("/batches", methods=["POST"])
 def add_batch() -> tuple[dict[str, Any], int]:
     try:
-        batch = models.Batch.model_validate(request.json)
+        with metrics.stage("validate"):
+            batch = models.Batch.model_validate(request.json)
     except ValidationError as e:
         return {"errors": e.errors()}, 400
 
     uow = unit_of_work.create_sql_alchemy_uow()
-    services.add_batch(batch, uow)
+    try:
+        services.add_batch(batch, uow)
+    except unit_of_work.ConcurrencyError as e:
+        return {"errors": [str(e)]}, 409
+
     return {}, 201
 
 
+@base_blueprint.route("/batches/import", methods=["POST"])
+def import_batches() -> tuple[dict[str, Any], int]:
+    try:
+        feed_format = FeedFormat(request.args.get("format", FeedFormat.CSV))
+    except ValueError:
+        return {"errors": [f"Unsupported format, expected one of {', '.join(FeedFormat)}"]}, 400
+
+    feed = io.TextIOWrapper(request.stream, encoding="utf-8", newline="")
+    try:
+        result = services.import_batches(read_rows(feed, feed_format), batch_loader.create_batch_loader())
+    except UnicodeDecodeError as e:
+        return {"errors": [f"Feed is not valid UTF-8: {e}"]}, 400
+    except DBAPIError as e:
+        # Chunks loaded before the failure stay committed, the import is safe to repeat as references are unique
+        return {"errors": [f"Import failed: {e.orig}"]}, 500
+
+    # Rows skipped as already loaded are valid, so resending a feed succeeds
+    status = 201 if result.imported + result.skipped else 400
+    return result.model_dump(), status
+
+
 @base_blueprint.route("/allocation", methods=["POST"])
 def allocate() -> tuple[dict[str, Any], int]:
     try:
-        line = models.OrderLine.model_validate(request.json)
+        with metrics.stage("validate"):
+            line = models.OrderLine.model_validate(request.json)
     except ValidationError as e:
         return {"errors": e.errors()}, 400
 
-    uow = unit_of_work.create_sql_alchemy_uow()
+    coordinator: AllocationCoordinator | None = current_app.extensions.get(ALLOCATION_COORDINATOR_EXTENSION)
     try:
-        batchref = services.allocate(line, uow)
+        if coordinator is None:
+            batchref = services.allocate(line, unit_of_work.create_sql_alchemy_uow())
+        else:
+            batchref = coordinator.allocate(line)
     except services.InvalidSkuError as e:
         return {"errors": [str(e)]}, 400
+    except unit_of_work.ConcurrencyError as e:
+        return {"errors": [str(e)]}, 409
 
     return {"batchref": batchref}, 201
+
+
+@base_blueprint.route("/allocation", methods=["DELETE"])
+def deallocate() -> tuple[dict[str, Any], int]:
+    try:
+        with metrics.stage("validate"):
+            deallocation = models.Deallocation.model_validate(request.json)
+    except ValidationError as e:
+        return {"errors": e.errors()}, 400
+
+    uow = unit_of_work.create_sql_alchemy_uow()
+    try:
+        batchrefs = services.deallocate(deallocation, uow)
+    except services.InvalidSkuError as e:
+        return {"errors": [str(e)]}, 400
+    except unit_of_work.ConcurrencyError as e:
+        return {"errors": [str(e)]}, 409
+
+    if not batchrefs:
+        return {"errors": [f"Order {deallocation.orderid} has no allocation for sku {deallocation.sku}"]}, 404
+    return {"batchrefs": batchrefs}, 200
+
+
+@base_blueprint.route("/allocations", methods=["POST"])
+def allocate_many() -> tuple[dict[str, Any], int]:
+    try:
+        with metrics.stage("validate"):
+            allocation = models.BulkAllocation.model_validate(request.json)
+    except ValidationError as e:
+        return {"errors": e.errors()}, 400
+
+    uow = unit_of_work.create_sql_alchemy_uow()
+    try:
+        results = services.allocate_many(allocation.lines, uow, atomic=allocation.atomic)
+    except unit_of_work.ConcurrencyError as e:
+        return {"errors": [str(e)]}, 409
+
+    status = 400 if allocation.atomic and any(result.error for result in results) else 201
+    return {"results": [result.model_dump() for result in results]}, status
+
+
+@base_blueprint.route("/orders", methods=["POST"])
+def allocate_order() -> tuple[dict[str, Any], int]:
+    try:
+        with metrics.stage("validate"):
+            order = models.Order.model_validate(request.json)
+    except ValidationError as e:
+        return {"errors": e.errors(include_context=False)}, 400
+
+    uow = unit_of_work.create_sql_alchemy_uow()
+    try:
+        batchrefs = services.allocate_order(order, uow)
+    except (services.InvalidSkuError, services.OutOfStockError) as e:
+        return {"errors": [str(e)]}, 400
+    except unit_of_work.ConcurrencyError as e:
+        return {"errors": [str(e)]}, 409
+
+    return {"orderid": order.orderid, "batchrefs": batchrefs}, 201
+
+
+@base_blueprint.route("/allocations/<orderid>", methods=["GET"])
+def get_allocations(orderid: str) -> tuple[dict[str, Any], int]:
+    allocations = views.create_read_only_allocations_view().get(orderid)
+    if not allocations:
+        return {"errors": [f"No allocations for order {orderid}"]}, 404
+
+    return {"allocations": allocations}, 200
+
+
+@base_blueprint.route("/products/<sku>/availability", methods=["GET"])
+def get_availability(sku: str) -> tuple[dict[str, Any], int]:
+    try:
+        batches = services.get_availability(sku, views.create_read_only_availability_view())
+    except services.InvalidSkuError as e:
+        return {"errors": [str(e)]}, 404
+
+    return {"batches": [batch.model_dump(mode="json") for batch in batches]}, 200
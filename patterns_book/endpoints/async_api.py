@@ -0,0 +1,52 @@
+from typing import Any
+
+from pydantic import ValidationError
+from quart import Blueprint, request
+
+from patterns_book.adapters import unit_of_work, views
+from patterns_book.service import models, services
+
+async_blueprint = Blueprint("async_api_v1", __name__, url_prefix="/api/v1")
+
+
+@async_blueprint.route("/batches", methods=["POST"])
+async def add_batch() -> tuple[dict[str, Any], int]:
+    try:
+        batch = models.Batch.model_validate(await request.get_json())
+    except ValidationError as e:
+        return {"errors": e.errors()}, 400
+
+    uow = unit_of_work.create_sql_alchemy_async_uow()
+    try:
+        await services.add_batch_async(batch, uow)
+    except unit_of_work.ConcurrencyError as e:
+        return {"errors": [str(e)]}, 409
+
+    return {}, 201
+
+
+@async_blueprint.route("/allocation", methods=["POST"])
+async def allocate() -> tuple[dict[str, Any], int]:
+    try:
+        line = models.OrderLine.model_validate(await request.get_json())
+    except ValidationError as e:
+        return {"errors": e.errors()}, 400
+
+    uow = unit_of_work.create_sql_alchemy_async_uow()
+    try:
+        batchref = await services.allocate_async(line, uow)
+    except services.InvalidSkuError as e:
+        return {"errors": [str(e)]}, 400
+    except unit_of_work.ConcurrencyError as e:
+        return {"errors": [str(e)]}, 409
+
+    return {"batchref": batchref}, 201
+
+
+@async_blueprint.route("/allocations/<orderid>", methods=["GET"])
+async def get_allocations(orderid: str) -> tuple[dict[str, Any], int]:
+    allocations = await views.create_sql_async_allocations_view().get(orderid)
+    if not allocations:
+        return {"errors": [f"No allocations for order {orderid}"]}, 404
+
+    return {"allocations": allocations}, 200
@@ -0,0 +1,20 @@
+from flask import Blueprint, Response, request
+
+from patterns_book.service import metrics
+
+metrics_blueprint = Blueprint("metrics", __name__)
+
+
+@metrics_blueprint.before_app_request
+def start_request() -> None:
+    metrics.start_request()
+
+
+@metrics_blueprint.teardown_app_request
+def finish_request(_exc: BaseException | None) -> None:
+    metrics.finish_request(request.endpoint or "unknown")
+
+
+@metrics_blueprint.route("/metrics", methods=["GET"])
+def get_metrics() -> Response:
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
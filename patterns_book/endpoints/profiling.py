@@ -0,0 +1,32 @@
+from flask import Blueprint, current_app, g, request
+
+from patterns_book.service.profiling import RequestProfiler
+
+PROFILER_EXTENSION = "request_profiler"
+PROFILE_TOKEN_HEADER = "X-Profile-Token"  # noqa: S105
+
+profiling_blueprint = Blueprint("profiling", __name__)
+
+
+@profiling_blueprint.before_app_request
+def start_profile() -> None:
+    g.profile = _get_profiler().start(request.headers.get(PROFILE_TOKEN_HEADER))
+
+
+@profiling_blueprint.teardown_app_request
+def finish_profile(_exc: BaseException | None) -> None:
+    profile = g.pop("profile", None)
+    if profile is None:
+        return
+
+    body = request.get_json(silent=True)
+    sku = body.get("sku") if isinstance(body, dict) else None
+    try:
+        _get_profiler().finish(profile, request.endpoint or "unknown", sku if isinstance(sku, str) else None)
+    except OSError:
+        current_app.logger.exception("Failed to write the request profile")
+
+
+def _get_profiler() -> RequestProfiler:
+    profiler: RequestProfiler = current_app.extensions[PROFILER_EXTENSION]
+    return profiler
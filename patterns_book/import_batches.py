@@ -0,0 +1,35 @@
+import argparse
+import json
+import logging
+from pathlib import Path
+
+from patterns_book.adapters.batch_loader import create_batch_loader
+from patterns_book.adapters.sessions import init_sessionmaker
+from patterns_book.service import services
+from patterns_book.service.batch_feed import FeedFormat, read_rows
+from patterns_book.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Import a CSV or JSON Lines feed of batches")
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--format", type=FeedFormat, choices=list(FeedFormat), help="defaults to the file extension")
+    parser.add_argument("--chunk-size", type=int, default=services.IMPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    settings = get_settings()
+    init_sessionmaker(settings.postgres_dsn, settings.postgres_schema, settings.engine_options)
+
+    feed_format = args.format or FeedFormat(args.path.suffix.removeprefix(".").lower())
+    with args.path.open(encoding="utf-8", newline="") as feed:
+        result = services.import_batches(read_rows(feed, feed_format), create_batch_loader(), args.chunk_size)
+
+    logger.info("Imported %s batches, skipped %s existing, %s invalid", result.imported, result.skipped, result.invalid)
+    print(json.dumps(result.model_dump(), indent=2))  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
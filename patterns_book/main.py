@@ -1,8 +1,39 @@
+import atexit
+
 from flask import Flask
+from quart import Quart
+from sqlalchemy.orm import configure_mappers
 
-from patterns_book.adapters import db_tables
-from patterns_book.adapters.sessions import init_sessionmaker
-from patterns_book.endpoints.api import base_blueprint
+from patterns_book.adapters import db_tables, views
+from patterns_book.adapters.repository import LoadingStrategy, ProductCache
+from patterns_book.adapters.sessions import (
+    init_async_sessionmaker,
+    init_replicas,
+    init_sessionmaker,
+    instrument_engine,
+    prewarm_pool,
+)
+from patterns_book.adapters.unit_of_work import (
+    AsyncUnitOfWorkOptions,
+    UnitOfWorkOptions,
+    configure_async_unit_of_work,
+    configure_unit_of_work,
+    create_sql_alchemy_uow,
+)
+from patterns_book.endpoints.api import ALLOCATION_COORDINATOR_EXTENSION, base_blueprint
+from patterns_book.endpoints.async_api import async_blueprint
+from patterns_book.endpoints.metrics import metrics_blueprint
+from patterns_book.endpoints.profiling import PROFILER_EXTENSION, profiling_blueprint
+from patterns_book.service import metrics
+from patterns_book.service.group_commit import AllocationCoordinator
+from patterns_book.service.message_bus import (
+    AbstractMessageBus,
+    BackgroundMessageBus,
+    CoalescingMessageBus,
+    EventDispatchMode,
+    InMemoryMessageBus,
+)
+from patterns_book.service.profiling import ProfilingOptions, RequestProfiler
 from patterns_book.settings import Settings, get_settings
 
 
@@ -12,10 +43,85 @@ def create_app() -> Flask:
 
 
 def create_app_with_settings(settings: Settings) -> Flask:
-    init_sessionmaker(settings.postgres_dsn, settings.postgres_schema)
-    db_tables.start_mappings()
+    init_sessionmaker(settings.postgres_dsn, settings.postgres_schema, settings.engine_options)
+    init_replicas(
+        settings.postgres_replica_dsns, settings.postgres_schema, settings.engine_options, settings.replica_options
+    )
+    db_tables.start_mappings(settings.product_loading_strategy)
+    # Configured before a prefork server forks, so workers do not pay for it on their first request
+    configure_mappers()
+    configure_unit_of_work(
+        UnitOfWorkOptions(
+            lock_mode=settings.allocation_lock_mode,
+            lock_timeout_ms=settings.allocation_lock_timeout_ms,
+            message_bus=create_message_bus(settings),
+            use_outbox=settings.event_outbox_enabled,
+            product_cache=ProductCache(settings.product_cache_size) if settings.product_cache_size > 0 else None,
+            allocation_engine=settings.allocation_engine,
+        )
+    )
 
     app = Flask(__name__)
     app.register_blueprint(base_blueprint)
+    if settings.allocation_group_commit_enabled:
+        app.extensions[ALLOCATION_COORDINATOR_EXTENSION] = AllocationCoordinator(
+            create_sql_alchemy_uow, settings.allocation_group_commit_max_batch_size
+        )
+    if settings.metrics_enabled:
+        metrics.enable()
+        instrument_engine()
+        app.register_blueprint(metrics_blueprint)
+    if settings.profiling_enabled:
+        app.extensions[PROFILER_EXTENSION] = RequestProfiler(
+            ProfilingOptions(
+                directory=settings.profiling_directory,
+                sample_rate=settings.profiling_sample_rate,
+                token=settings.profiling_token,
+                max_profiles_per_minute=settings.profiling_max_per_minute,
+                top_allocations=settings.profiling_top_allocations,
+            )
+        )
+        app.register_blueprint(profiling_blueprint)
 
     return app
+
+
+def init_worker() -> None:
+    init_worker_with_settings(get_settings())
+
+
+def init_worker_with_settings(settings: Settings) -> None:
+    # Called from the post-fork hook of a prefork server, or once after create_app in a single process
+    prewarm_pool(settings.postgres_pool_prewarm)
+
+
+def create_async_app() -> Quart:
+    settings = get_settings()
+    return create_async_app_with_settings(settings)
+
+
+def create_async_app_with_settings(settings: Settings) -> Quart:
+    init_async_sessionmaker(settings.postgres_async_dsn, settings.postgres_schema, settings.engine_options)
+    db_tables.start_mappings(LoadingStrategy.SELECTIN)
+    configure_mappers()
+    configure_async_unit_of_work(AsyncUnitOfWorkOptions(use_outbox=settings.event_outbox_enabled))
+
+    app = Quart(__name__)
+    app.register_blueprint(async_blueprint)
+
+    return app
+
+
+def create_message_bus(settings: Settings) -> AbstractMessageBus:
+    message_bus: AbstractMessageBus = InMemoryMessageBus(views.create_sql_allocations_view())
+    if settings.out_of_stock_coalesce_window_seconds > 0:
+        message_bus = CoalescingMessageBus(message_bus, settings.out_of_stock_coalesce_window_seconds)
+    if settings.event_dispatch_mode is EventDispatchMode.BACKGROUND:
+        background_message_bus = BackgroundMessageBus(
+            message_bus,
+            workers=settings.event_workers,
+            queue_size=settings.event_queue_size,
+        )
+        atexit.register(background_message_bus.shutdown)
+        message_bus = background_message_bus
+    return message_bus
@@ -0,0 +1,61 @@
+import functools
+import logging
+import signal
+import threading
+from collections.abc import Callable
+
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from patterns_book.adapters import outbox, views
+from patterns_book.adapters.sessions import get_session, init_sessionmaker
+from patterns_book.service.message_bus import AbstractMessageBus, CoalescingMessageBus, InMemoryMessageBus
+from patterns_book.settings import Settings, get_settings
+
+logger = logging.getLogger(__name__)
+
+
+def run(
+    session_factory: Callable[[], Session],
+    message_bus: AbstractMessageBus,
+    settings: Settings,
+    stop: threading.Event,
+) -> None:
+    while not stop.is_set():
+        try:
+            relayed = outbox.relay_batch(
+                session_factory,
+                message_bus.handle,
+                batch_size=settings.outbox_batch_size,
+                max_attempts=settings.outbox_max_attempts,
+            )
+        except DBAPIError:
+            # Lost connections and serialization failures are transient, the batch is picked up on the next poll
+            logger.exception("Failed to relay outbox batch")
+            relayed = 0
+        if relayed < settings.outbox_batch_size:
+            message_bus.flush()
+            stop.wait(settings.outbox_poll_interval_seconds)
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    settings = get_settings()
+    init_sessionmaker(settings.postgres_dsn, settings.postgres_schema, settings.engine_options)
+
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+
+    message_bus: AbstractMessageBus = InMemoryMessageBus(views.create_sql_allocations_view())
+    if settings.out_of_stock_coalesce_window_seconds > 0:
+        message_bus = CoalescingMessageBus(message_bus, settings.out_of_stock_coalesce_window_seconds)
+
+    logger.info("Outbox relay started")
+    # Under REPEATABLE READ, skipping rows another relay has just committed raises a serialization failure
+    run(functools.partial(get_session, "READ COMMITTED"), message_bus, settings, stop)
+    logger.info("Outbox relay stopped")
+
+
+if __name__ == "__main__":
+    main()
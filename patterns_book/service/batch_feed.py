@@ -0,0 +1,31 @@
+import csv
+import json
+from collections.abc import Iterable, Iterator
+from enum import StrEnum
+
+
+class FeedFormat(StrEnum):
+    CSV = "csv"
+    JSONL = "jsonl"
+
+
+def read_rows(lines: Iterable[str], feed_format: FeedFormat) -> Iterator[object]:
+    if feed_format is FeedFormat.CSV:
+        return _read_csv(lines)
+    return _read_jsonl(lines)
+
+
+def _read_csv(lines: Iterable[str]) -> Iterator[object]:
+    for row in csv.DictReader(lines):
+        yield {key: value or None for key, value in row.items()}
+
+
+def _read_jsonl(lines: Iterable[str]) -> Iterator[object]:
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            # Malformed lines are reported by validation together with the other invalid rows
+            yield line
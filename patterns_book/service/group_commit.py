@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+from patterns_book.service import metrics, services
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from patterns_book.adapters.unit_of_work import AbstractUnitOfWork
+    from patterns_book.service.models import OrderLine
+
+MAX_BATCH_SIZE = 100
+
+
+@dataclass
+class _PendingAllocation:
+    line: OrderLine
+    done: threading.Event = field(default_factory=threading.Event)
+    leads: bool = False
+    batch_reference: str | None = None
+    error: Exception | None = None
+
+
+class AllocationCoordinator:
+    def __init__(self, uow_factory: Callable[[], AbstractUnitOfWork], max_batch_size: int = MAX_BATCH_SIZE) -> None:
+        self._uow_factory = uow_factory
+        self._max_batch_size = max_batch_size
+        # A SKU has a queue only while some request leads it, the leader is always at the head of the queue
+        self._queues: dict[str, deque[_PendingAllocation]] = {}
+        self._lock = threading.Lock()
+
+    def allocate(self, line: OrderLine) -> str | None:
+        pending = _PendingAllocation(line)
+        with self._lock:
+            queue = self._queues.get(line.sku)
+            if queue is None:
+                queue = self._queues[line.sku] = deque()
+                pending.leads = True
+            queue.append(pending)
+
+        if not pending.leads:
+            pending.done.wait()
+        # A waiting request is woken either with its result or to lead the next batch
+        if pending.leads:
+            self._lead(line.sku)
+
+        if pending.error is not None:
+            raise pending.error
+        return pending.batch_reference
+
+    def _lead(self, sku: str) -> None:
+        with self._lock:
+            queue = self._queues[sku]
+            batch = [queue.popleft() for _ in range(min(len(queue), self._max_batch_size))]
+
+        try:
+            batch_references = services.allocate_for_sku(sku, [pending.line for pending in batch], self._uow_factory())
+        except Exception as e:  # noqa: BLE001
+            for pending in batch:
+                pending.error = e
+        except BaseException:
+            # The leader is unwinding, its waiters must not mistake the missing result for an out of stock line
+            msg = f"Allocation of {sku} was interrupted"
+            for pending in batch:
+                pending.error = RuntimeError(msg)
+            raise
+        else:
+            for pending, batch_reference in zip(batch, batch_references, strict=True):
+                pending.batch_reference = batch_reference
+        finally:
+            metrics.group_commit_batch_size.observe(len(batch))
+
+            with self._lock:
+                if queue:
+                    queue[0].leads = True
+                    queue[0].done.set()
+                else:
+                    del self._queues[sku]
+
+            for pending in batch:
+                pending.done.set()
@@ -1,27 +1,66 @@
+from __future__ import annotations
+
 import abc
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from enum import StrEnum
 from typing import TYPE_CHECKING, Any
 
 from patterns_book.adapters import email
 from patterns_book.domain import events
+from patterns_book.service import metrics
 
 if TYPE_CHECKING:
-    from collections.abc import Callable
+    from collections.abc import Awaitable, Callable
+
+    from patterns_book.adapters.views import AbstractAllocationsView, AbstractAsyncAllocationsView
+
+logger = logging.getLogger(__name__)
+
+ORDERED_PUT_TIMEOUT = 5.0
+
+
+class EventDispatchMode(StrEnum):
+    SYNC = "sync"
+    BACKGROUND = "background"
 
 
 class AbstractMessageBus(abc.ABC):
     @abc.abstractmethod
     def handle(self, event: events.Event) -> None: ...
 
+    def flush(self) -> None:  # noqa: B027
+        # Called when the bus is idle, buses holding back events hand them on here
+        pass
+
+
+class AbstractAsyncMessageBus(abc.ABC):
+    @abc.abstractmethod
+    async def handle(self, event: events.Event) -> None: ...
+
 
 class InMemoryMessageBus(AbstractMessageBus):
-    def __init__(self) -> None:
+    def __init__(self, allocations_view: AbstractAllocationsView) -> None:
+        self._allocations_view = allocations_view
         self.handlers: dict[type[events.Event], list[Callable[[Any], None]]] = {
             events.OutOfStock: [self._send_out_of_stock_notification],
+            events.OutOfStockDigest: [self._send_out_of_stock_digest],
+            events.Allocated: [self._add_allocation_to_read_model],
+            events.Deallocated: [self._remove_allocation_from_read_model],
         }
 
     def handle(self, event: events.Event) -> None:
-        for handler in self.handlers[type(event)]:
-            handler(event)
+        event_type = type(event).__name__
+        metrics.handled_events.inc(event_type)
+        with metrics.timed(metrics.event_handling_duration, event_type):
+            for handler in self.handlers[type(event)]:
+                handler(event)
 
     @staticmethod
     def _send_out_of_stock_notification(event: events.OutOfStock) -> None:
@@ -29,3 +68,211 @@ class InMemoryMessageBus(AbstractMessageBus):
             "stock@made.com",
             f"Out of stock for {event.sku}",
         )
+
+    @staticmethod
+    def _send_out_of_stock_digest(event: events.OutOfStockDigest) -> None:
+        email.send_mail(
+            "stock@made.com",
+            f"Out of stock for {event.sku}, {event.suppressed} more failed allocations since the last notification",
+        )
+
+    def _add_allocation_to_read_model(self, event: events.Allocated) -> None:
+        self._allocations_view.add(event.orderid, event.sku, event.batchref)
+
+    def _remove_allocation_from_read_model(self, event: events.Deallocated) -> None:
+        self._allocations_view.remove(event.orderid, event.sku)
+
+
+class BackgroundMessageBus(AbstractMessageBus):
+    def __init__(
+        self,
+        message_bus: AbstractMessageBus,
+        workers: int = 4,
+        queue_size: int = 1000,
+        put_timeout: float = 0.1,
+        flush_interval: float = 1.0,
+    ) -> None:
+        self._message_bus = message_bus
+        self._workers_count = workers
+        self._queue_size = queue_size
+        self._put_timeout = put_timeout
+        self._flush_interval = flush_interval
+        self._closed = False
+        self._queues: list[queue.Queue[events.Event | None]] = []
+        self._workers: list[threading.Thread] = []
+        self._pid = 0
+        self._start_lock = threading.Lock()
+        with self._start_lock:
+            self._start_workers()
+
+    def handle(self, event: events.Event) -> None:
+        # Shutdown sends its sentinels under the same lock, an event is never queued behind them
+        with self._start_lock:
+            queued = not self._closed and self._enqueue(event)
+        if not queued:
+            self._handle_safely(event)
+
+    def shutdown(self, timeout: float | None = None) -> None:
+        with self._start_lock:
+            if self._closed:
+                return
+
+            self._closed = True
+            for worker_queue in self._queues:
+                worker_queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def _enqueue(self, event: events.Event) -> bool:
+        if self._pid != os.getpid():
+            # Threads do not survive a fork, a child of a prefork server starts its own workers
+            self._start_workers()
+
+        worker_queue = self._queues[hash(_routing_key(event)) % len(self._queues)]
+        # Handling it on the caller thread could overtake an earlier event of the same allocation, so it waits longer
+        ordered = isinstance(event, events.Allocated | events.Deallocated)
+        try:
+            worker_queue.put(event, timeout=ORDERED_PUT_TIMEOUT if ordered else self._put_timeout)
+        except queue.Full:
+            logger.warning("Message bus queue is full, handling %s on the caller thread", type(event).__name__)
+            return False
+        return True
+
+    def _start_workers(self) -> None:
+        # Every worker owns a queue, events of one allocation always go to the same worker and keep their order
+        self._queues = [
+            queue.Queue(maxsize=max(1, self._queue_size // self._workers_count)) for _ in range(self._workers_count)
+        ]
+        self._workers = [
+            threading.Thread(target=self._work, args=(worker_queue,), name=f"message-bus-worker-{i}", daemon=True)
+            for i, worker_queue in enumerate(self._queues)
+        ]
+        for worker in self._workers:
+            worker.start()
+        self._pid = os.getpid()
+
+    def _work(self, worker_queue: queue.Queue[events.Event | None]) -> None:
+        while True:
+            try:
+                event = worker_queue.get(timeout=self._flush_interval)
+            except queue.Empty:
+                self._flush_safely()
+                continue
+            if event is None:
+                return
+            self._handle_safely(event)
+
+    def _handle_safely(self, event: events.Event) -> None:
+        try:
+            self._message_bus.handle(event)
+        except Exception:
+            logger.exception("Failed to handle %s", event)
+
+    def _flush_safely(self) -> None:
+        try:
+            self._message_bus.flush()
+        except Exception:
+            logger.exception("Failed to flush message bus")
+
+
+def _routing_key(event: events.Event) -> tuple[str, ...]:
+    if isinstance(event, events.Allocated | events.Deallocated):
+        return event.orderid, event.sku
+    if isinstance(event, events.OutOfStock | events.OutOfStockDigest):
+        return (event.sku,)
+    return (type(event).__name__,)
+
+
+@dataclass
+class _CoalescingWindow:
+    opened_at: float
+    suppressed: int = 0
+
+
+class CoalescingMessageBus(AbstractMessageBus):
+    def __init__(
+        self,
+        message_bus: AbstractMessageBus,
+        window_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._message_bus = message_bus
+        self._window_seconds = window_seconds
+        self._clock = clock
+        self._windows: OrderedDict[str, _CoalescingWindow] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def handle(self, event: events.Event) -> None:
+        self._send_digests()
+        if isinstance(event, events.OutOfStock) and not self._open_window(event.sku):
+            metrics.suppressed_events.inc("coalesced")
+            return
+        self._message_bus.handle(event)
+
+    def flush(self) -> None:
+        self._send_digests()
+        self._message_bus.flush()
+
+    def _send_digests(self) -> None:
+        # A window that suppressed events is closed with a single digest for its SKU
+        for digest in self._close_expired_windows():
+            self._message_bus.handle(digest)
+
+    def _open_window(self, sku: str) -> bool:
+        with self._lock:
+            window = self._windows.get(sku)
+            if window is not None:
+                window.suppressed += 1
+                return False
+            self._windows[sku] = _CoalescingWindow(self._clock())
+            return True
+
+    def _close_expired_windows(self) -> list[events.OutOfStockDigest]:
+        digests = []
+        with self._lock:
+            now = self._clock()
+            while self._windows:
+                sku, window = next(iter(self._windows.items()))
+                if now - window.opened_at < self._window_seconds:
+                    break
+                del self._windows[sku]
+                if window.suppressed:
+                    digests.append(events.OutOfStockDigest(sku, window.suppressed))
+        return digests
+
+
+class AsyncInMemoryMessageBus(AbstractAsyncMessageBus):
+    def __init__(self, allocations_view: AbstractAsyncAllocationsView) -> None:
+        self._allocations_view = allocations_view
+        self.handlers: dict[type[events.Event], list[Callable[[Any], Awaitable[None]]]] = {
+            events.OutOfStock: [self._send_out_of_stock_notification],
+            events.OutOfStockDigest: [self._send_out_of_stock_digest],
+            events.Allocated: [self._add_allocation_to_read_model],
+            events.Deallocated: [self._remove_allocation_from_read_model],
+        }
+
+    async def handle(self, event: events.Event) -> None:
+        for handler in self.handlers[type(event)]:
+            await handler(event)
+
+    @staticmethod
+    async def _send_out_of_stock_notification(event: events.OutOfStock) -> None:
+        await asyncio.to_thread(
+            email.send_mail,
+            "stock@made.com",
+            f"Out of stock for {event.sku}",
+        )
+
+    @staticmethod
+    async def _send_out_of_stock_digest(event: events.OutOfStockDigest) -> None:
+        await asyncio.to_thread(
+            email.send_mail,
+            "stock@made.com",
+            f"Out of stock for {event.sku}, {event.suppressed} more failed allocations since the last notification",
+        )
+
+    async def _add_allocation_to_read_model(self, event: events.Allocated) -> None:
+        await self._allocations_view.add(event.orderid, event.sku, event.batchref)
+
+    async def _remove_allocation_from_read_model(self, event: events.Deallocated) -> None:
+        await self._allocations_view.remove(event.orderid, event.sku)
@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+import bisect
+import contextlib
+import math
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Protocol
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+    from contextlib import AbstractContextManager
+    from types import TracebackType
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COUNT_BUCKETS = (1.0, 2.0, 3.0, 5.0, 10.0, 20.0, 50.0, 100.0)
+
+
+class _Metric(Protocol):
+    name: str
+
+    def render(self) -> list[str]: ...
+
+
+_registry: dict[str, _Metric] = {}
+_enabled = False
+
+
+class Counter:
+    def __init__(self, name: str, description: str) -> None:
+        self.name = name
+        self.description = description
+        self._value = 0
+        self._lock = threading.Lock()
+        _registry[name] = self
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+    def inc(self, amount: int = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    def render(self) -> list[str]:
+        return [*_header(self.name, self.description, "counter"), f"{self.name} {self._value}"]
+
+
+class LabeledCounter:
+    def __init__(self, name: str, description: str, label: str) -> None:
+        self.name = name
+        self.description = description
+        self._label = label
+        self._values: dict[str, int] = {}
+        self._lock = threading.Lock()
+        _registry[name] = self
+
+    def value(self, label_value: str) -> int:
+        return self._values.get(label_value, 0)
+
+    def inc(self, label_value: str, amount: int = 1) -> None:
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = _header(self.name, self.description, "counter")
+        lines.extend(f"{self.name}{_labels({self._label: label_value})} {value}" for label_value, value in values)
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, description: str, read: Callable[[], float]) -> None:
+        self.name = name
+        self.description = description
+        self._read = read
+        _registry[name] = self
+
+    def render(self) -> list[str]:
+        return [*_header(self.name, self.description, "gauge"), f"{self.name} {_format_value(self._read())}"]
+
+
+@dataclass
+class _Series:
+    buckets: list[int]
+    total: float = 0.0
+    count: int = 0
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        label: str | None = None,
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.description = description
+        self._label = label
+        self._bounds = buckets
+        self._series: dict[str, _Series] = {}
+        self._lock = threading.Lock()
+        _registry[name] = self
+
+    def count(self, label_value: str = "") -> int:
+        series = self._series.get(label_value)
+        return series.count if series else 0
+
+    def observe(self, value: float, label_value: str = "") -> None:
+        index = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = _Series([0] * (len(self._bounds) + 1))
+            series.buckets[index] += 1
+            series.total += value
+            series.count += 1
+
+    def render(self) -> list[str]:
+        lines = _header(self.name, self.description, "histogram")
+        with self._lock:
+            for label_value, series in sorted(self._series.items()):
+                labels = {self._label: label_value} if self._label else {}
+                cumulative = 0
+                for bound, observed in zip((*self._bounds, math.inf), series.buckets, strict=True):
+                    cumulative += observed
+                    lines.append(f"{self.name}_bucket{_labels({**labels, 'le': _format_value(bound)})} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(labels)} {_format_value(series.total)}")
+                lines.append(f"{self.name}_count{_labels(labels)} {series.count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, label_value: str) -> None:
+        self._histogram = histogram
+        self._label_value = label_value
+        self._started = 0.0
+
+    def __enter__(self) -> None:
+        self._started = time.perf_counter()
+
+    def __exit__(
+        self, _exc_type: type[BaseException] | None, _exc: BaseException | None, _traceback: TracebackType | None
+    ) -> None:
+        self._histogram.observe(time.perf_counter() - self._started, self._label_value)
+
+
+@dataclass
+class _RequestStats:
+    started: float = field(default_factory=time.perf_counter)
+    statements: int = 0
+
+
+_DISABLED = contextlib.nullcontext()
+_request_stats: ContextVar[_RequestStats | None] = ContextVar("request_stats", default=None)
+
+
+def enable() -> None:
+    global _enabled  # noqa: PLW0603
+    _enabled = True
+
+
+def disable() -> None:
+    global _enabled  # noqa: PLW0603
+    _enabled = False
+
+
+def timed(histogram: Histogram, label_value: str = "") -> AbstractContextManager[None]:
+    # Disabled metrics cost one global lookup, no clock reads and no locking
+    if not _enabled:
+        return _DISABLED
+    return _Timer(histogram, label_value)
+
+
+def stage(name: str) -> AbstractContextManager[None]:
+    return timed(stage_duration, name)
+
+
+def start_request() -> None:
+    _request_stats.set(_RequestStats())
+
+
+def finish_request(endpoint: str) -> None:
+    stats = _request_stats.get()
+    if stats is None:
+        return
+    _request_stats.set(None)
+    request_duration.observe(time.perf_counter() - stats.started, endpoint)
+    sql_statements_per_request.observe(stats.statements, endpoint)
+
+
+def record_statement(seconds: float) -> None:
+    sql_statement_duration.observe(seconds)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.statements += 1
+
+
+def render() -> str:
+    lines = [line for metric in _registry.values() for line in metric.render()]
+    return "\n".join(lines) + "\n"
+
+
+def _header(name: str, description: str, metric_type: str) -> list[str]:
+    return [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}"]
+
+
+def _labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _escape(label_value: str) -> str:
+    return label_value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(value)
+
+
+concurrency_conflicts = Counter("concurrency_conflicts_total", "Transactions failed on a concurrent update")
+concurrency_retries = Counter("concurrency_retries_total", "Transactions retried after a concurrent update")
+suppressed_events = LabeledCounter("suppressed_events_total", "Events dropped before reaching handlers", "reason")
+product_cache_hits = Counter("product_cache_hits_total", "Product aggregates served from the cache")
+product_cache_misses = Counter("product_cache_misses_total", "Product aggregates loaded from the database")
+product_cache_evictions = Counter("product_cache_evictions_total", "Product aggregates evicted from the cache")
+written_profiles = Counter("written_profiles_total", "Requests profiled and written to disk")
+skipped_profiles = Counter("skipped_profiles_total", "Profiling requests skipped by the rate limit")
+replica_fallbacks = Counter("db_replica_fallbacks_total", "Read-only sessions routed to the primary")
+pool_timeouts = Counter("db_pool_timeouts_total", "Connection checkouts that gave up on an exhausted pool")
+handled_events = LabeledCounter("handled_events_total", "Events dispatched to handlers", "event_type")
+stage_duration = Histogram("stage_duration_seconds", "Time spent in each stage of a request", "stage")
+event_handling_duration = Histogram("event_handling_duration_seconds", "Time spent handling an event", "event_type")
+request_duration = Histogram("request_duration_seconds", "Time spent serving a request", "endpoint")
+pool_checkout_wait = Histogram("db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection")
+sql_statement_duration = Histogram("sql_statement_duration_seconds", "Time spent executing a SQL statement")
+group_commit_batch_size = Histogram(
+    "group_commit_batch_size", "Allocations committed together for one SKU", buckets=COUNT_BUCKETS
+)
+sql_statements_per_request = Histogram(
+    "sql_statements_per_request", "SQL statements executed by a request", "endpoint", buckets=COUNT_BUCKETS
+)
@@ -1,6 +1,7 @@
 from datetime import date
+from typing import Self
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 
 
 class OrderLine(BaseModel):
@@ -9,8 +10,56 @@ class OrderLine(BaseModel):
     qty: int = Field(gt=0)
 
 
+class Deallocation(BaseModel):
+    orderid: str
+    sku: str
+
+
 class Batch(BaseModel):
     reference: str
     sku: str
     qty: int = Field(gt=0)
-    eta: date | None
+    eta: date | None = None
+
+
+class BatchAvailability(BaseModel):
+    reference: str
+    eta: date | None = None
+    available_quantity: int
+
+
+class BulkAllocation(BaseModel):
+    lines: list[OrderLine] = Field(min_length=1)
+    atomic: bool = False
+
+
+class AllocationResult(BaseModel):
+    orderid: str
+    sku: str
+    batchref: str | None = None
+    error: str | None = None
+
+
+class OrderItem(BaseModel):
+    sku: str
+    qty: int = Field(gt=0)
+
+
+class Order(BaseModel):
+    orderid: str
+    lines: list[OrderItem] = Field(min_length=1)
+
+    @model_validator(mode="after")
+    def check_unique_skus(self) -> Self:
+        skus = [line.sku for line in self.lines]
+        if len(skus) != len(set(skus)):
+            msg = "Order lines must have distinct skus"
+            raise ValueError(msg)
+        return self
+
+
+class ImportResult(BaseModel):
+    imported: int = 0
+    skipped: int = 0
+    invalid: int = 0
+    errors: list[str] = Field(default_factory=list)
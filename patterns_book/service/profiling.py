@@ -0,0 +1,102 @@
+import cProfile
+import logging
+import random
+import re
+import secrets
+import threading
+import time
+import tracemalloc
+from collections import deque
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import UTC, datetime
+from pathlib import Path
+
+from patterns_book.service import metrics
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_WINDOW_SECONDS = 60.0
+
+_UNSAFE_FILENAME_CHARACTERS = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+@dataclass(frozen=True)
+class ProfilingOptions:
+    directory: Path
+    sample_rate: float = 0.0
+    token: str | None = None
+    max_profiles_per_minute: int = 1
+    top_allocations: int = 25
+
+
+@dataclass
+class Profile:
+    profiler: cProfile.Profile
+    started_tracing: bool
+
+
+class RequestProfiler:
+    def __init__(
+        self,
+        options: ProfilingOptions,
+        clock: Callable[[], float] = time.monotonic,
+        sample: Callable[[], float] = random.random,
+    ) -> None:
+        self._options = options
+        self._clock = clock
+        self._sample = sample
+        self._started: deque[float] = deque()
+        # tracemalloc traces the whole process, so only one request is profiled at a time
+        self._active = False
+        self._lock = threading.Lock()
+
+    def start(self, token: str | None = None) -> Profile | None:
+        if not self._is_requested(token) and self._sample() >= self._options.sample_rate:
+            return None
+
+        with self._lock:
+            now = self._clock()
+            while self._started and now - self._started[0] >= RATE_LIMIT_WINDOW_SECONDS:
+                self._started.popleft()
+            if self._active or len(self._started) >= self._options.max_profiles_per_minute:
+                metrics.skipped_profiles.inc()
+                return None
+            self._active = True
+            self._started.append(now)
+
+        profile = Profile(cProfile.Profile(), started_tracing=not tracemalloc.is_tracing())
+        if profile.started_tracing:
+            tracemalloc.start()
+        profile.profiler.enable()
+        return profile
+
+    def finish(self, profile: Profile, route: str, sku: str | None = None) -> list[Path]:
+        try:
+            profile.profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+            if profile.started_tracing:
+                tracemalloc.stop()
+        finally:
+            with self._lock:
+                self._active = False
+
+        stem = "-".join(
+            _UNSAFE_FILENAME_CHARACTERS.sub("_", part)
+            for part in (datetime.now(UTC).strftime("%Y%m%dT%H%M%S%f"), route, sku or "none")
+        )
+        self._options.directory.mkdir(parents=True, exist_ok=True)
+        profile_path = self._options.directory / f"{stem}.prof"
+        allocations_path = self._options.directory / f"{stem}.allocations.txt"
+        profile.profiler.dump_stats(profile_path)
+        top_allocations = snapshot.statistics("lineno")[: self._options.top_allocations]
+        allocations_path.write_text("".join(f"{statistic}\n" for statistic in top_allocations))
+
+        metrics.written_profiles.inc()
+        logger.info("Profiled %s for sku %s into %s", route, sku, profile_path)
+        return [profile_path, allocations_path]
+
+    def _is_requested(self, token: str | None) -> bool:
+        return (
+            token is not None and self._options.token is not None and secrets.compare_digest(token, self._options.token)
+        )
@@ -1,36 +1,320 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+import asyncio
+import functools
+import random
+import time
+from collections import defaultdict
+from typing import TYPE_CHECKING, TypeVar
 
+from pydantic import ValidationError
+
+from patterns_book.adapters.allocator import UnknownProductError
+from patterns_book.adapters.unit_of_work import ConcurrencyError
 from patterns_book.domain import model as domain_models
+from patterns_book.service import metrics
+from patterns_book.service.models import AllocationResult, Batch, BatchAvailability, ImportResult
 
 if TYPE_CHECKING:
-    from patterns_book.adapters.unit_of_work import AbstractUnitOfWork
-    from patterns_book.service.models import Batch, OrderLine
+    from collections.abc import Awaitable, Callable, Iterable, Sequence
+
+    from patterns_book.adapters.batch_loader import AbstractBatchLoader
+    from patterns_book.adapters.unit_of_work import AbstractUnitOfWork, AsyncAbstractUnitOfWork
+    from patterns_book.adapters.views import AbstractAvailabilityView
+    from patterns_book.service.models import Deallocation, Order, OrderLine
+
+T = TypeVar("T")
+
+MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 0.01
+BACKOFF_MAX_SECONDS = 0.5
+
+IMPORT_CHUNK_SIZE = 5_000
+MAX_REPORTED_IMPORT_ERRORS = 100
 
 
 class InvalidSkuError(Exception):
     pass
 
 
+class OutOfStockError(Exception):
+    pass
+
+
 def add_batch(batch: Batch, uow: AbstractUnitOfWork) -> None:
+    _retry_on_conflict(lambda: _add_batch(batch, uow))
+
+
+def _add_batch(batch: Batch, uow: AbstractUnitOfWork) -> None:
     with uow:
         product = uow.products.get(batch.sku)
         if product is None:
             product = domain_models.Product(batch.sku, batches=[])
             uow.products.add(product)
 
-        product.batches.append(domain_models.Batch(batch.reference, batch.sku, batch.qty, batch.eta))
+        product.add_batch(domain_models.Batch(batch.reference, batch.sku, batch.qty, batch.eta))
         uow.commit()
 
 
+def import_batches(
+    rows: Iterable[object],
+    loader: AbstractBatchLoader,
+    chunk_size: int = IMPORT_CHUNK_SIZE,
+) -> ImportResult:
+    result = ImportResult()
+    chunk: list[Batch] = []
+    for row_number, row in enumerate(rows, start=1):
+        try:
+            chunk.append(Batch.model_validate(row))
+        except ValidationError as e:
+            result.invalid += 1
+            if len(result.errors) < MAX_REPORTED_IMPORT_ERRORS:
+                result.errors.append(f"row {row_number}: {_format_validation_error(e)}")
+            continue
+
+        if len(chunk) == chunk_size:
+            _load_chunk(chunk, loader, result)
+            chunk = []
+
+    if chunk:
+        _load_chunk(chunk, loader, result)
+    return result
+
+
+def _load_chunk(chunk: list[Batch], loader: AbstractBatchLoader, result: ImportResult) -> None:
+    loaded = loader.load(chunk)
+    result.imported += loaded
+    result.skipped += len(chunk) - loaded
+
+
+def _format_validation_error(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(map(str, e['loc'])) or 'row'}: {e['msg']}" for e in error.errors())
+
+
 def allocate(line: OrderLine, uow: AbstractUnitOfWork) -> str | None:
+    return _retry_on_conflict(lambda: _allocate(line, uow))
+
+
+def _allocate(line: OrderLine, uow: AbstractUnitOfWork) -> str | None:
+    domain_line = domain_models.OrderLine(line.orderid, line.sku, line.qty)
     with uow:
-        product = uow.products.get(line.sku)
+        if uow.allocator is not None:
+            try:
+                with metrics.stage("allocate"):
+                    batch_reference = uow.allocator.allocate(domain_line)
+            except UnknownProductError as e:
+                raise InvalidSkuError(str(e)) from e
+        else:
+            product = uow.products.get(line.sku)
+            if product is None:
+                msg = f"Invalid sku {line.sku}"
+                raise InvalidSkuError(msg)
+            with metrics.stage("allocate"):
+                batch_reference = product.allocate(domain_line)
+
+        uow.commit()
+        return batch_reference
+
+
+def allocate_for_sku(sku: str, lines: Sequence[OrderLine], uow: AbstractUnitOfWork) -> list[str | None]:
+    return _retry_on_conflict(lambda: _allocate_for_sku(sku, lines, uow))
+
+
+def _allocate_for_sku(sku: str, lines: Sequence[OrderLine], uow: AbstractUnitOfWork) -> list[str | None]:
+    with uow:
+        product = uow.products.get(sku)
+        if product is None:
+            msg = f"Invalid sku {sku}"
+            raise InvalidSkuError(msg)
+
+        with metrics.stage("allocate"):
+            batch_references = [
+                product.allocate(domain_models.OrderLine(line.orderid, sku, line.qty)) for line in lines
+            ]
+        uow.commit()
+        return batch_references
+
+
+def deallocate(deallocation: Deallocation, uow: AbstractUnitOfWork) -> list[str]:
+    return _retry_on_conflict(lambda: _deallocate(deallocation, uow))
+
+
+def _deallocate(deallocation: Deallocation, uow: AbstractUnitOfWork) -> list[str]:
+    with uow:
+        product, allocations = uow.products.get_for_order(deallocation.sku, deallocation.orderid)
+        if product is None:
+            msg = f"Invalid sku {deallocation.sku}"
+            raise InvalidSkuError(msg)
+
+        batch_references = product.deallocate(deallocation.orderid, allocations)
+        if batch_references:
+            uow.commit()
+        return batch_references
+
+
+def get_availability(sku: str, view: AbstractAvailabilityView) -> list[BatchAvailability]:
+    batches = view.get(sku)
+    if batches is None:
+        msg = f"Invalid sku {sku}"
+        raise InvalidSkuError(msg)
+    return [BatchAvailability.model_validate(batch) for batch in batches]
+
+
+def allocate_many(lines: list[OrderLine], uow: AbstractUnitOfWork, *, atomic: bool = False) -> list[AllocationResult]:
+    lines_by_sku: defaultdict[str, list[tuple[int, OrderLine]]] = defaultdict(list)
+    for index, line in enumerate(lines):
+        lines_by_sku[line.sku].append((index, line))
+
+    if atomic:
+        results = _retry_on_conflict(functools.partial(_allocate_many_atomically, lines_by_sku, uow))
+    else:
+        results = {}
+        for sku, indexed_lines in lines_by_sku.items():
+            try:
+                results.update(_retry_on_conflict(functools.partial(_allocate_sku_lines, sku, indexed_lines, uow)))
+            except ConcurrencyError:
+                for index, line in indexed_lines:
+                    results[index] = AllocationResult(
+                        orderid=line.orderid, sku=sku, error=f"Conflicting update of {sku}"
+                    )
+
+    return [results[index] for index in range(len(lines))]
+
+
+def _allocate_many_atomically(
+    lines_by_sku: dict[str, list[tuple[int, OrderLine]]], uow: AbstractUnitOfWork
+) -> dict[int, AllocationResult]:
+    results: dict[int, AllocationResult] = {}
+    with uow:
+        # Products are locked in SKU order by one query, the same order allocate_order takes its locks in
+        products = {product.sku: product for product in uow.products.get_many(lines_by_sku)}
+        for sku in sorted(lines_by_sku):
+            results.update(_allocate_lines(products.get(sku), sku, lines_by_sku[sku]))
+
+        if any(result.error for result in results.values()):
+            return {index: result.model_copy(update={"batchref": None}) for index, result in results.items()}
+        uow.commit()
+    return results
+
+
+def _allocate_sku_lines(
+    sku: str, indexed_lines: list[tuple[int, OrderLine]], uow: AbstractUnitOfWork
+) -> dict[int, AllocationResult]:
+    with uow:
+        product = uow.products.get(sku)
+        results = _allocate_lines(product, sku, indexed_lines)
+        if product is not None:
+            uow.commit()
+        return results
+
+
+def _allocate_lines(
+    product: domain_models.Product | None, sku: str, indexed_lines: list[tuple[int, OrderLine]]
+) -> dict[int, AllocationResult]:
+    results = {}
+    for index, line in indexed_lines:
+        if product is None:
+            results[index] = AllocationResult(orderid=line.orderid, sku=sku, error=f"Invalid sku {sku}")
+            continue
+
+        with metrics.stage("allocate"):
+            batch_reference = product.allocate(domain_models.OrderLine(line.orderid, sku, line.qty))
+        error = None if batch_reference else "Out of stock"
+        results[index] = AllocationResult(orderid=line.orderid, sku=sku, batchref=batch_reference, error=error)
+    return results
+
+
+def allocate_order(order: Order, uow: AbstractUnitOfWork) -> dict[str, str]:
+    return _retry_on_conflict(lambda: _allocate_order(order, uow))
+
+
+def _allocate_order(order: Order, uow: AbstractUnitOfWork) -> dict[str, str]:
+    with uow:
+        products = {product.sku: product for product in uow.products.get_many(line.sku for line in order.lines)}
+        if unknown := sorted({line.sku for line in order.lines} - products.keys()):
+            msg = f"Invalid sku {', '.join(unknown)}"
+            raise InvalidSkuError(msg)
+
+        batch_references: dict[str, str] = {}
+        out_of_stock = []
+        for line in sorted(order.lines, key=lambda line: line.sku):
+            with metrics.stage("allocate"):
+                batch_reference = products[line.sku].allocate(
+                    domain_models.OrderLine(order.orderid, line.sku, line.qty)
+                )
+            if batch_reference is None:
+                out_of_stock.append(line.sku)
+            else:
+                batch_references[line.sku] = batch_reference
+
+        if out_of_stock:
+            msg = f"Out of stock for sku {', '.join(out_of_stock)}"
+            raise OutOfStockError(msg)
+
+        uow.commit()
+        return {line.sku: batch_references[line.sku] for line in order.lines}
+
+
+async def add_batch_async(batch: Batch, uow: AsyncAbstractUnitOfWork) -> None:
+    await _retry_on_conflict_async(lambda: _add_batch_async(batch, uow))
+
+
+async def _add_batch_async(batch: Batch, uow: AsyncAbstractUnitOfWork) -> None:
+    async with uow:
+        product = await uow.products.get(batch.sku)
+        if product is None:
+            product = domain_models.Product(batch.sku, batches=[])
+            uow.products.add(product)
+
+        product.add_batch(domain_models.Batch(batch.reference, batch.sku, batch.qty, batch.eta))
+        await uow.commit()
+
+
+async def allocate_async(line: OrderLine, uow: AsyncAbstractUnitOfWork) -> str | None:
+    return await _retry_on_conflict_async(lambda: _allocate_async(line, uow))
+
+
+async def _allocate_async(line: OrderLine, uow: AsyncAbstractUnitOfWork) -> str | None:
+    async with uow:
+        product = await uow.products.get(line.sku)
         if product is None:
             msg = f"Invalid sku {line.sku}"
             raise InvalidSkuError(msg)
 
         batch_reference = product.allocate(domain_models.OrderLine(line.orderid, line.sku, line.qty))
-        uow.commit()
+        await uow.commit()
         return batch_reference
+
+
+def _retry_on_conflict(operation: Callable[[], T]) -> T:
+    attempt = 1
+    while True:
+        try:
+            return operation()
+        except ConcurrencyError:
+            metrics.concurrency_conflicts.inc()
+            if attempt >= MAX_ATTEMPTS:
+                raise
+
+        metrics.concurrency_retries.inc()
+        time.sleep(_backoff(attempt))
+        attempt += 1
+
+
+async def _retry_on_conflict_async(operation: Callable[[], Awaitable[T]]) -> T:
+    attempt = 1
+    while True:
+        try:
+            return await operation()
+        except ConcurrencyError:
+            metrics.concurrency_conflicts.inc()
+            if attempt >= MAX_ATTEMPTS:
+                raise
+
+        metrics.concurrency_retries.inc()
+        await asyncio.sleep(_backoff(attempt))
+        attempt += 1
+
+
+def _backoff(attempt: int) -> float:
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2**attempt))  # noqa: S311
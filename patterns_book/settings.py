@@ -1,7 +1,13 @@
 from functools import lru_cache
+from pathlib import Path
 
 from pydantic_settings import BaseSettings
 
+from patterns_book.adapters.allocator import AllocationEngine
+from patterns_book.adapters.repository import LoadingStrategy, LockMode
+from patterns_book.adapters.sessions import EngineOptions, ReplicaOptions
+from patterns_book.service.message_bus import EventDispatchMode
+
 
 class Settings(BaseSettings):
     postgres_user: str
@@ -10,11 +16,73 @@ class Settings(BaseSettings):
     postgres_port: int
     postgres_db: str
     postgres_schema: str
+    postgres_pool_size: int = 5
+    postgres_max_overflow: int = 10
+    postgres_pool_timeout_seconds: float = 30.0
+    postgres_pool_recycle_seconds: int = -1
+    postgres_pool_pre_ping: bool = False
+    postgres_pool_prewarm: int = 0
+    postgres_statement_timeout_ms: int | None = None
+    postgres_query_cache_size: int = 500
+    postgres_prepared_statement_cache_size: int = 100
+    postgres_replica_dsns: list[str] = []
+    postgres_replica_max_lag_seconds: float = 5.0
+    postgres_replica_check_interval_seconds: float = 1.0
+    postgres_replica_retry_seconds: float = 5.0
+    postgres_replica_connect_timeout_seconds: int = 2
+    product_loading_strategy: LoadingStrategy = LoadingStrategy.SELECTIN
+    product_cache_size: int = 0
+    allocation_engine: AllocationEngine = AllocationEngine.DOMAIN
+    allocation_lock_mode: LockMode = LockMode.NONE
+    allocation_lock_timeout_ms: int | None = None
+    allocation_group_commit_enabled: bool = False
+    allocation_group_commit_max_batch_size: int = 100
+    event_dispatch_mode: EventDispatchMode = EventDispatchMode.SYNC
+    event_workers: int = 4
+    event_queue_size: int = 1000
+    event_outbox_enabled: bool = False
+    out_of_stock_coalesce_window_seconds: float = 0.0
+    outbox_batch_size: int = 100
+    outbox_poll_interval_seconds: float = 1.0
+    outbox_max_attempts: int = 10
+    metrics_enabled: bool = False
+    profiling_enabled: bool = False
+    profiling_sample_rate: float = 0.0
+    profiling_token: str | None = None
+    profiling_directory: Path = Path("profiles")
+    profiling_max_per_minute: int = 1
+    profiling_top_allocations: int = 25
 
     @property
     def postgres_dsn(self) -> str:
         return f"postgresql://{self.postgres_user}:{self.postgres_password}@{self.postgres_host}:{self.postgres_port}/{self.postgres_db}"
 
+    @property
+    def postgres_async_dsn(self) -> str:
+        return self.postgres_dsn.replace("postgresql://", "postgresql+asyncpg://", 1)
+
+    @property
+    def engine_options(self) -> EngineOptions:
+        return EngineOptions(
+            pool_size=self.postgres_pool_size,
+            max_overflow=self.postgres_max_overflow,
+            pool_timeout_seconds=self.postgres_pool_timeout_seconds,
+            pool_recycle_seconds=self.postgres_pool_recycle_seconds,
+            pool_pre_ping=self.postgres_pool_pre_ping,
+            statement_timeout_ms=self.postgres_statement_timeout_ms,
+            query_cache_size=self.postgres_query_cache_size,
+            prepared_statement_cache_size=self.postgres_prepared_statement_cache_size,
+        )
+
+    @property
+    def replica_options(self) -> ReplicaOptions:
+        return ReplicaOptions(
+            max_lag_seconds=self.postgres_replica_max_lag_seconds,
+            check_interval_seconds=self.postgres_replica_check_interval_seconds,
+            retry_seconds=self.postgres_replica_retry_seconds,
+            connect_timeout_seconds=self.postgres_replica_connect_timeout_seconds,
+        )
+
 
 @lru_cache
 def get_settings() -> Settings:
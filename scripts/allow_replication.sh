@@ -0,0 +1,3 @@
+#!/bin/bash
+# Run by the postgres image on first start, lets the replica service stream WAL from the primary
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"
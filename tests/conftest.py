@@ -46,6 +46,8 @@ def session(sessionmaker: sa_sessionmaker[Session]) -> Session:
 @pytest.fixture
 def db_cleanup(session: Session) -> Generator[None, None, None]:
     yield
+    session.execute(text("DELETE FROM outbox"))
+    session.execute(text("DELETE FROM allocations_view"))
     session.execute(text("DELETE FROM allocations"))
     session.execute(text("DELETE FROM batches"))
     session.execute(text("DELETE FROM order_lines"))
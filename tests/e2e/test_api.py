@@ -53,3 +53,143 @@ def test_successful_allocation(test_client: FlaskClient) -> None:
     assert response.status_code == 201
     assert response.json is not None
     assert response.json.get("batchref") == early_batch
+
+
+def test_import_batches(test_client: FlaskClient) -> None:
+    sku = generate_sku()
+    feed = f"reference,sku,qty,eta\nimport1,{sku},10,\nimport2,{sku},0,\n"
+
+    response = test_client.post("/api/v1/batches/import?format=csv", data=feed, content_type="text/csv")
+
+    assert response.status_code == 201
+    assert response.json is not None
+    assert (response.json["imported"], response.json["invalid"]) == (1, 1)
+    response = test_client.post("/api/v1/allocation", json={"orderid": "order1", "sku": sku, "qty": 10})
+    assert response.json == {"batchref": "import1"}
+
+
+def test_import_batches_accepts_feed_sent_again(test_client: FlaskClient) -> None:
+    feed = f"reference,sku,qty,eta\nimport1,{generate_sku()},10,\n"
+    test_client.post("/api/v1/batches/import?format=csv", data=feed, content_type="text/csv")
+
+    response = test_client.post("/api/v1/batches/import?format=csv", data=feed, content_type="text/csv")
+
+    assert response.status_code == 201
+    assert response.json is not None
+    assert (response.json["imported"], response.json["skipped"]) == (0, 1)
+
+
+def test_import_batches_rejects_feed_without_valid_rows(test_client: FlaskClient) -> None:
+    feed = b'{"reference": "import1", "qty": 10}\n'
+
+    response = test_client.post("/api/v1/batches/import?format=jsonl", data=feed)
+    assert response.status_code == 400
+    assert response.json is not None
+    assert response.json["invalid"] == 1
+
+    response = test_client.post("/api/v1/batches/import?format=jsonl", data=b"\xff\xfe")
+    assert response.status_code == 400
+
+
+def test_bulk_allocation(test_client: FlaskClient) -> None:
+    sku1, sku2 = generate_sku(), generate_sku()
+    for reference, sku in (("batch1", sku1), ("batch2", sku2)):
+        test_client.post(
+            "/api/v1/batches",
+            json={
+                "reference": reference,
+                "sku": sku,
+                "qty": 100,
+                "eta": None,
+            },
+        )
+
+    response = test_client.post(
+        "/api/v1/allocations",
+        json={
+            "lines": [
+                {"orderid": "order1", "sku": sku1, "qty": 10},
+                {"orderid": "order1", "sku": sku2, "qty": 10},
+                {"orderid": "order1", "sku": "unknown", "qty": 10},
+            ],
+        },
+    )
+
+    assert response.status_code == 201
+    assert response.json is not None
+    results = response.json["results"]
+    assert [result["batchref"] for result in results] == ["batch1", "batch2", None]
+    assert results[2]["error"] == "Invalid sku unknown"
+
+
+def test_allocate_order(test_client: FlaskClient) -> None:
+    sku1, sku2 = generate_sku(), generate_sku()
+    for reference, sku, qty in (("batch1", sku1, 100), ("batch2", sku2, 5)):
+        test_client.post("/api/v1/batches", json={"reference": reference, "sku": sku, "qty": qty, "eta": None})
+
+    response = test_client.post(
+        "/api/v1/orders",
+        json={"orderid": "order1", "lines": [{"sku": sku1, "qty": 10}, {"sku": sku2, "qty": 5}]},
+    )
+
+    assert response.status_code == 201
+    assert response.json == {"orderid": "order1", "batchrefs": {sku1: "batch1", sku2: "batch2"}}
+
+    response = test_client.post(
+        "/api/v1/orders",
+        json={"orderid": "order2", "lines": [{"sku": sku1, "qty": 10}, {"sku": sku2, "qty": 1}]},
+    )
+
+    assert response.status_code == 400
+    assert response.json == {"errors": [f"Out of stock for sku {sku2}"]}
+    response = test_client.get("/api/v1/allocations/order2")
+    assert response.status_code == 404
+
+
+def test_deallocation(test_client: FlaskClient) -> None:
+    sku = generate_sku()
+    test_client.post("/api/v1/batches", json={"reference": "batch1", "sku": sku, "qty": 10, "eta": None})
+    test_client.post("/api/v1/allocation", json={"orderid": "order1", "sku": sku, "qty": 10})
+
+    response = test_client.delete("/api/v1/allocation", json={"orderid": "order1", "sku": sku})
+
+    assert response.status_code == 200
+    assert response.json == {"batchrefs": ["batch1"]}
+    assert test_client.get("/api/v1/allocations/order1").status_code == 404
+    response = test_client.post("/api/v1/allocation", json={"orderid": "order2", "sku": sku, "qty": 10})
+    assert response.json == {"batchref": "batch1"}
+
+    response = test_client.delete("/api/v1/allocation", json={"orderid": "order1", "sku": sku})
+    assert response.status_code == 404
+
+
+def test_get_allocations(test_client: FlaskClient) -> None:
+    sku = generate_sku()
+    test_client.post(
+        "/api/v1/batches",
+        json={
+            "reference": "batch1",
+            "sku": sku,
+            "qty": 100,
+            "eta": None,
+        },
+    )
+    test_client.post(
+        "/api/v1/allocation",
+        json={
+            "orderid": "order1",
+            "sku": sku,
+            "qty": 10,
+        },
+    )
+
+    response = test_client.get("/api/v1/allocations/order1")
+
+    assert response.status_code == 200
+    assert response.json == {"allocations": [{"sku": sku, "batchref": "batch1"}]}
+
+
+def test_get_allocations_returns_404_for_unknown_order(test_client: FlaskClient) -> None:
+    response = test_client.get("/api/v1/allocations/unknown")
+
+    assert response.status_code == 404
@@ -0,0 +1,102 @@
+import asyncio
+from collections.abc import Generator
+from typing import Any
+
+import pytest
+from quart.typing import TestClientProtocol as QuartTestClient
+from sqlalchemy.orm import clear_mappers
+
+from patterns_book.main import create_async_app_with_settings
+from patterns_book.settings import Settings
+from tests.conftest import generate_sku
+
+pytestmark = pytest.mark.usefixtures("db_cleanup")
+
+
+@pytest.fixture(scope="module")
+def event_loop() -> Generator[asyncio.AbstractEventLoop, None, None]:
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="module")
+def test_client(settings: Settings) -> Generator[QuartTestClient, None, None]:
+    app = create_async_app_with_settings(settings)
+    yield app.test_client()
+    clear_mappers()
+
+
+def test_successful_allocation(test_client: QuartTestClient, event_loop: asyncio.AbstractEventLoop) -> None:
+    sku = generate_sku()
+
+    async def scenario() -> tuple[int, Any]:
+        for reference, eta in (("early_batch", "2011-01-01"), ("later_batch", "2012-01-01")):
+            await test_client.post(
+                "/api/v1/batches",
+                json={
+                    "reference": reference,
+                    "sku": sku,
+                    "qty": 100,
+                    "eta": eta,
+                },
+            )
+        response = await test_client.post(
+            "/api/v1/allocation",
+            json={
+                "orderid": "order1",
+                "sku": sku,
+                "qty": 10,
+            },
+        )
+        return response.status_code, await response.get_json()
+
+    status_code, body = event_loop.run_until_complete(scenario())
+
+    assert status_code == 201
+    assert body == {"batchref": "early_batch"}
+
+
+def test_get_allocations(test_client: QuartTestClient, event_loop: asyncio.AbstractEventLoop) -> None:
+    sku = generate_sku()
+
+    async def scenario() -> tuple[int, Any]:
+        await test_client.post(
+            "/api/v1/batches",
+            json={
+                "reference": "batch1",
+                "sku": sku,
+                "qty": 100,
+                "eta": None,
+            },
+        )
+        await test_client.post(
+            "/api/v1/allocation",
+            json={
+                "orderid": "order1",
+                "sku": sku,
+                "qty": 10,
+            },
+        )
+        response = await test_client.get("/api/v1/allocations/order1")
+        return response.status_code, await response.get_json()
+
+    status_code, body = event_loop.run_until_complete(scenario())
+
+    assert status_code == 200
+    assert body == {"allocations": [{"sku": sku, "batchref": "batch1"}]}
+
+
+def test_allocation_with_invalid_sku(test_client: QuartTestClient, event_loop: asyncio.AbstractEventLoop) -> None:
+    async def scenario() -> int:
+        response = await test_client.post(
+            "/api/v1/allocation",
+            json={
+                "orderid": "order1",
+                "sku": "unknown",
+                "qty": 10,
+            },
+        )
+        return response.status_code
+
+    assert event_loop.run_until_complete(scenario()) == 400
@@ -0,0 +1,30 @@
+from collections.abc import Generator
+
+import pytest
+from flask.testing import FlaskClient
+from sqlalchemy.orm import clear_mappers
+
+from patterns_book.adapters import sessions
+from patterns_book.main import create_app_with_settings
+from patterns_book.settings import Settings
+from tests.conftest import generate_sku
+
+
+@pytest.fixture(scope="module")
+def test_client(settings: Settings) -> Generator[FlaskClient, None, None]:
+    app = create_app_with_settings(
+        settings.model_copy(
+            update={"postgres_pool_size": 1, "postgres_max_overflow": 0, "postgres_pool_timeout_seconds": 0.1}
+        )
+    )
+    yield app.test_client()
+    clear_mappers()
+    sessions.init_sessionmaker(settings.postgres_dsn, settings.postgres_schema, settings.engine_options)
+
+
+def test_rejects_requests_when_pool_is_exhausted(test_client: FlaskClient) -> None:
+    with sessions.get_engine().connect():
+        response = test_client.post("/api/v1/allocation", json={"orderid": "order", "sku": generate_sku(), "qty": 1})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
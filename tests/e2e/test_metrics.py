@@ -0,0 +1,38 @@
+from collections.abc import Generator
+
+import pytest
+from flask.testing import FlaskClient
+from sqlalchemy.orm import clear_mappers
+
+from patterns_book.main import create_app_with_settings
+from patterns_book.service import metrics
+from patterns_book.settings import Settings
+from tests.conftest import generate_sku
+
+pytestmark = pytest.mark.usefixtures("db_cleanup")
+
+
+@pytest.fixture(scope="module")
+def test_client(settings: Settings) -> Generator[FlaskClient, None, None]:
+    app = create_app_with_settings(settings.model_copy(update={"metrics_enabled": True}))
+    yield app.test_client()
+    metrics.disable()
+    clear_mappers()
+
+
+def test_metrics_report_allocation_stages(test_client: FlaskClient) -> None:
+    sku = generate_sku()
+    test_client.post("/api/v1/batches", json={"reference": "batch", "sku": sku, "qty": 100, "eta": None})
+    test_client.post("/api/v1/allocation", json={"orderid": "order", "sku": sku, "qty": 10})
+
+    response = test_client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain; version=0.0.4")
+    body = response.get_data(as_text=True)
+    for stage in ("validate", "load", "allocate", "commit", "publish"):
+        assert f'stage_duration_seconds_count{{stage="{stage}"}}' in body
+    assert 'sql_statements_per_request_count{endpoint="api_v1.allocate"} 1' in body
+    assert 'handled_events_total{event_type="Allocated"}' in body
+    assert "db_pool_checked_out_connections 0" in body
+    assert "db_pool_checkout_wait_seconds_count" in body
@@ -0,0 +1,50 @@
+from collections.abc import Generator
+from pathlib import Path
+
+import pytest
+from flask.testing import FlaskClient
+from sqlalchemy.orm import clear_mappers
+
+from patterns_book.endpoints.profiling import PROFILE_TOKEN_HEADER
+from patterns_book.main import create_app_with_settings
+from patterns_book.settings import Settings
+from tests.conftest import generate_sku
+
+pytestmark = pytest.mark.usefixtures("db_cleanup")
+
+
+@pytest.fixture(scope="module")
+def profiles_directory(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    return tmp_path_factory.mktemp("profiles")
+
+
+@pytest.fixture(scope="module")
+def test_client(settings: Settings, profiles_directory: Path) -> Generator[FlaskClient, None, None]:
+    app = create_app_with_settings(
+        settings.model_copy(
+            update={
+                "profiling_enabled": True,
+                "profiling_token": "secret",
+                "profiling_directory": profiles_directory,
+            }
+        )
+    )
+    yield app.test_client()
+    clear_mappers()
+
+
+def test_profiles_request_with_token(test_client: FlaskClient, profiles_directory: Path) -> None:
+    sku = generate_sku()
+    test_client.post("/api/v1/batches", json={"reference": "batch", "sku": sku, "qty": 100, "eta": None})
+
+    response = test_client.post(
+        "/api/v1/allocation",
+        json={"orderid": "order", "sku": sku, "qty": 10},
+        headers={PROFILE_TOKEN_HEADER: "secret"},
+    )
+
+    assert response.status_code == 201
+    assert [path.name.split("-", 1)[1] for path in sorted(profiles_directory.iterdir())] == [
+        f"api_v1.allocate-{sku}.allocations.txt",
+        f"api_v1.allocate-{sku}.prof",
+    ]
@@ -0,0 +1,41 @@
+from collections.abc import Generator
+
+import pytest
+from flask.testing import FlaskClient
+from sqlalchemy.orm import clear_mappers
+
+from patterns_book.adapters import sessions
+from patterns_book.main import create_app_with_settings
+from patterns_book.settings import Settings
+from tests.conftest import generate_sku
+
+pytestmark = pytest.mark.usefixtures("db_cleanup")
+
+
+@pytest.fixture(scope="module")
+def test_client(settings: Settings) -> Generator[FlaskClient, None, None]:
+    # The primary stands in for the replica the reads are routed to
+    app = create_app_with_settings(settings.model_copy(update={"postgres_replica_dsns": [settings.postgres_dsn]}))
+    yield app.test_client()
+    clear_mappers()
+    sessions.init_replicas([], settings.postgres_schema)
+
+
+def test_reads_availability_from_replica(test_client: FlaskClient) -> None:
+    sku = generate_sku()
+    test_client.post("/api/v1/batches", json={"reference": "batch1", "sku": sku, "qty": 10, "eta": "2030-01-01"})
+    test_client.post("/api/v1/allocation", json={"orderid": "order1", "sku": sku, "qty": 3})
+
+    response = test_client.get(f"/api/v1/products/{sku}/availability")
+
+    assert response.status_code == 200
+    assert response.json == {"batches": [{"reference": "batch1", "eta": "2030-01-01", "available_quantity": 7}]}
+    allocations = test_client.get("/api/v1/allocations/order1")
+    assert allocations.json == {"allocations": [{"sku": sku, "batchref": "batch1"}]}
+
+
+def test_availability_of_unknown_sku_returns_404(test_client: FlaskClient) -> None:
+    response = test_client.get("/api/v1/products/unknown/availability")
+
+    assert response.status_code == 404
+    assert response.json == {"errors": ["Invalid sku unknown"]}
@@ -0,0 +1,127 @@
+import random
+import uuid
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from sqlalchemy.orm import sessionmaker as sa_sessionmaker
+
+from patterns_book.adapters.allocator import SQLAllocator, UnknownProductError
+from patterns_book.adapters.repository import ProductSQLRepository
+from patterns_book.adapters.unit_of_work import SqlAlchemyUnitOfWork
+from patterns_book.domain import events as domain_events
+from patterns_book.domain import model as domain_model
+from patterns_book.service import models, services
+from patterns_book.service.message_bus import AbstractMessageBus
+from tests.conftest import generate_sku, make_domain_batch, make_domain_order_line, make_domain_product
+
+pytestmark = pytest.mark.usefixtures("db_cleanup")
+
+
+def test_allocates_to_warehouse_stock_first(session: Session) -> None:
+    sku = generate_sku()
+    shipment = make_domain_batch(sku, 10, eta=date(2030, 1, 1))
+    in_stock = make_domain_batch(sku, 10)
+    session.add(make_domain_product(sku, [shipment, in_stock]))
+    session.commit()
+    line = make_domain_order_line(sku, 3)
+    allocator = SQLAllocator(session)
+
+    batch_reference = allocator.allocate(line)
+    session.commit()
+
+    assert batch_reference == in_stock.reference
+    assert allocator.events == [domain_events.Allocated(line.orderid, sku, 3, in_stock.reference)]
+    product = ProductSQLRepository(session).get(sku)
+    assert product is not None
+    assert product._version_number == 1
+    assert product.deallocate(line.orderid) == [in_stock.reference]
+    session.rollback()
+
+
+def test_reports_out_of_stock_without_touching_the_product(session: Session) -> None:
+    sku = generate_sku()
+    session.add(make_domain_product(sku, [make_domain_batch(sku, 2)]))
+    session.commit()
+    allocator = SQLAllocator(session)
+
+    batch_reference = allocator.allocate(make_domain_order_line(sku, 3))
+    session.commit()
+
+    assert batch_reference is None
+    assert allocator.events == [domain_events.OutOfStock(sku)]
+    assert session.execute(text("SELECT version_number FROM products WHERE sku = :sku"), {"sku": sku}).scalar() == 0
+
+
+def test_raises_for_unknown_product(session: Session) -> None:
+    with pytest.raises(UnknownProductError, match="Invalid sku unknown"):
+        SQLAllocator(session).allocate(domain_model.OrderLine("order", "unknown", 1))
+
+
+def test_allocate_service_publishes_events_of_sql_allocator(session: Session) -> None:
+    sku = generate_sku()
+    batch = make_domain_batch(sku, 10)
+    session.add(make_domain_product(sku, [batch]))
+    session.commit()
+    message_bus = _FakeMessageBus()
+    uow = SqlAlchemyUnitOfWork(ProductSQLRepository(session), session, message_bus, allocator=SQLAllocator(session))
+    line = models.OrderLine(orderid=str(uuid.uuid4()), sku=sku, qty=4)
+
+    batch_reference = services.allocate(line, uow)
+
+    assert batch_reference == batch.reference
+    assert message_bus.handled_events == [domain_events.Allocated(line.orderid, sku, 4, batch.reference)]
+    with pytest.raises(services.InvalidSkuError):
+        services.allocate(models.OrderLine(orderid="order", sku="unknown", qty=1), uow)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_sql_allocator_matches_product_allocate(sessionmaker: sa_sessionmaker[Session], seed: int) -> None:
+    rnd = random.Random(seed)
+    sku = generate_sku()
+    # Few distinct ETAs and order ids make ties and repeated lines common
+    etas = [None, date(2030, 1, 1), date(2030, 1, 1) + timedelta(days=1)]
+    batches = [make_domain_batch(sku, rnd.randint(1, 20), rnd.choice(etas)) for _ in range(rnd.randint(1, 6))]
+    with sessionmaker() as session:
+        session.add(make_domain_product(sku, batches))
+        session.commit()
+        references = session.execute(
+            text("SELECT reference FROM batches WHERE sku = :sku ORDER BY id"), {"sku": sku}
+        ).scalars()
+        by_reference = {batch.reference: batch for batch in batches}
+        expected_product = make_domain_product(
+            sku,
+            [
+                domain_model.Batch(ref, sku, by_reference[ref]._purchased_quantity, by_reference[ref].eta)
+                for ref in references
+            ],
+        )
+
+    for _ in range(30):
+        line = domain_model.OrderLine(rnd.choice(["o1", "o2", "o3"]), sku, rnd.randint(1, 8))
+        with sessionmaker() as session:
+            allocator = SQLAllocator(session)
+            actual = allocator.allocate(line)
+            session.commit()
+
+        expected = expected_product.allocate(line)
+        assert actual == expected
+        assert allocator.events == expected_product.events
+        expected_product.events.clear()
+
+    with sessionmaker() as session:
+        product = ProductSQLRepository(session).get(sku)
+        assert product is not None
+        assert product._version_number == expected_product._version_number
+        assert {b.reference: b.allocated_quantity for b in product.batches} == {
+            b.reference: b.allocated_quantity for b in expected_product.batches
+        }
+
+
+class _FakeMessageBus(AbstractMessageBus):
+    def __init__(self) -> None:
+        self.handled_events: list[domain_events.Event] = []
+
+    def handle(self, event: domain_events.Event) -> None:
+        self.handled_events.append(event)
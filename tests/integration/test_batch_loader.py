@@ -0,0 +1,59 @@
+from datetime import date
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from sqlalchemy.orm import sessionmaker as sa_sessionmaker
+
+from patterns_book.adapters.batch_loader import PostgresBatchLoader
+from patterns_book.adapters.repository import ProductSQLRepository
+from patterns_book.service import models
+from tests.conftest import generate_sku, make_domain_product
+
+pytestmark = pytest.mark.usefixtures("db_cleanup")
+
+
+def test_load_creates_products_and_batches(sessionmaker: sa_sessionmaker[Session], session: Session) -> None:
+    sku1, sku2 = generate_sku(), generate_sku()
+    batches = [
+        models.Batch(reference="batch1", sku=sku1, qty=10),
+        models.Batch(reference="batch2", sku=sku1, qty=20, eta=date(2021, 1, 1)),
+        models.Batch(reference="batch3", sku=sku2, qty=30),
+    ]
+
+    loaded = PostgresBatchLoader(sessionmaker).load(batches)
+
+    assert loaded == 3
+    rows = session.execute(text("SELECT reference, sku, purchased_quantity, eta FROM batches ORDER BY reference")).all()
+    assert [tuple(row) for row in rows] == [
+        ("batch1", sku1, 10, None),
+        ("batch2", sku1, 20, date(2021, 1, 1)),
+        ("batch3", sku2, 30, None),
+    ]
+    products = session.execute(
+        text("SELECT sku FROM products WHERE sku IN (:sku1, :sku2)"), {"sku1": sku1, "sku2": sku2}
+    )
+    assert {sku for (sku,) in products} == {sku1, sku2}
+
+
+def test_load_skips_existing_references_and_bumps_version(
+    sessionmaker: sa_sessionmaker[Session], session: Session
+) -> None:
+    sku = generate_sku()
+    ProductSQLRepository(session).add(make_domain_product(sku))
+    session.commit()
+    loader = PostgresBatchLoader(sessionmaker)
+    loader.load([models.Batch(reference="batch1", sku=sku, qty=10)])
+
+    loaded = loader.load(
+        [
+            models.Batch(reference="batch1", sku=sku, qty=10),
+            models.Batch(reference="batch2", sku=sku, qty=10),
+            models.Batch(reference="batch2", sku=sku, qty=10),
+        ]
+    )
+
+    assert loaded == 1
+    assert session.execute(text("SELECT count(*) FROM batches WHERE sku = :sku"), {"sku": sku}).scalar() == 2
+    version = session.execute(text("SELECT version_number FROM products WHERE sku = :sku"), {"sku": sku}).scalar()
+    assert version == 2
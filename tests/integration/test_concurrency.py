@@ -3,11 +3,15 @@ import time
 from collections.abc import Callable
 
 import pytest
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import Session
 from sqlalchemy.orm import sessionmaker as sa_sessionmaker
 
-from patterns_book.adapters.repository import ProductSQLRepository
-from patterns_book.adapters.unit_of_work import SqlAlchemyUnitOfWork
+from patterns_book.adapters.repository import LockMode, ProductSQLRepository
+from patterns_book.adapters.unit_of_work import ConcurrencyError, SqlAlchemyUnitOfWork
+from patterns_book.adapters.views import AllocationsSQLView
+from patterns_book.service import metrics, models, services
+from patterns_book.service.group_commit import AllocationCoordinator
 from patterns_book.service.message_bus import InMemoryMessageBus
 from tests.conftest import generate_sku, make_domain_batch, make_domain_order_line, make_domain_product
 
@@ -28,7 +32,22 @@ def order_line_qty() -> int:
 def uow_factory(sessionmaker: sa_sessionmaker[Session]) -> Callable[[], SqlAlchemyUnitOfWork]:
     def factory() -> SqlAlchemyUnitOfWork:
         session = sessionmaker()
-        return SqlAlchemyUnitOfWork(ProductSQLRepository(session), session, InMemoryMessageBus())
+        message_bus = InMemoryMessageBus(AllocationsSQLView(sessionmaker))
+        return SqlAlchemyUnitOfWork(ProductSQLRepository(session), session, message_bus)
+
+    return factory
+
+
+@pytest.fixture
+def locking_uow_factory(
+    engine: Engine, sessionmaker: sa_sessionmaker[Session]
+) -> Callable[[LockMode], SqlAlchemyUnitOfWork]:
+    read_committed_sessionmaker = sa_sessionmaker(bind=engine.execution_options(isolation_level="READ COMMITTED"))
+
+    def factory(lock_mode: LockMode) -> SqlAlchemyUnitOfWork:
+        session = read_committed_sessionmaker()
+        message_bus = InMemoryMessageBus(AllocationsSQLView(sessionmaker))
+        return SqlAlchemyUnitOfWork(ProductSQLRepository(session, lock_mode=lock_mode), session, message_bus)
 
     return factory
 
@@ -45,6 +64,29 @@ def product_sku(uow_factory: Callable[[], SqlAlchemyUnitOfWork], batch_qty: int)
         return sku
 
 
+def test_concurrent_creation_of_product_is_retried(
+    sessionmaker: sa_sessionmaker[Session], uow_factory: Callable[[], SqlAlchemyUnitOfWork]
+) -> None:
+    sku = generate_sku()
+    retries_before = metrics.concurrency_retries.value
+    with sessionmaker() as session:
+        session.add(make_domain_product(sku, [make_domain_batch(sku, 10)]))
+        session.flush()
+        # The second insert of the product waits for this transaction and then violates the primary key
+        adding = threading.Thread(
+            target=services.add_batch, args=(models.Batch(reference="batch2", sku=sku, qty=20), uow_factory())
+        )
+        adding.start()
+        time.sleep(0.2)
+        session.commit()
+    adding.join()
+
+    product = uow_factory().products.get(sku)
+    assert product is not None
+    assert sorted(batch.available_quantity for batch in product.batches) == [10, 20]
+    assert metrics.concurrency_retries.value == retries_before + 1
+
+
 def test_concurrent_allocations(
     product_sku: str, uow_factory: Callable[[], SqlAlchemyUnitOfWork], batch_qty: int, order_line_qty: int
 ) -> None:
@@ -65,6 +107,102 @@ def test_concurrent_allocations(
     assert product.batches[0].available_quantity == expected_qty
 
 
+def test_concurrent_allocations_are_retried(
+    product_sku: str, uow_factory: Callable[[], SqlAlchemyUnitOfWork], batch_qty: int, order_line_qty: int
+) -> None:
+    threads_count = 4
+    barrier = threading.Barrier(threads_count)
+    results: list[str | None] = []
+
+    def allocate() -> None:
+        line = models.OrderLine(orderid=generate_sku(), sku=product_sku, qty=order_line_qty)
+        uow = uow_factory()
+        barrier.wait()
+        results.append(services.allocate(line, uow))
+
+    threads = [threading.Thread(target=allocate) for _ in range(threads_count)]
+    for t in threads:
+        t.start()
+
+    for t in threads:
+        t.join()
+
+    uow = uow_factory()
+    product = uow.products.get(product_sku)
+    assert product is not None
+    assert len(results) == threads_count
+    assert all(results)
+    assert product.batches[0].available_quantity == batch_qty - threads_count * order_line_qty
+
+
+def test_group_commit_allocates_concurrent_lines_without_conflicts(
+    product_sku: str, uow_factory: Callable[[], SqlAlchemyUnitOfWork], batch_qty: int, order_line_qty: int
+) -> None:
+    threads_count = 8
+    barrier = threading.Barrier(threads_count)
+    coordinator = AllocationCoordinator(uow_factory)
+    results: list[str | None] = []
+    conflicts_before = metrics.concurrency_conflicts.value
+
+    def allocate() -> None:
+        line = models.OrderLine(orderid=generate_sku(), sku=product_sku, qty=order_line_qty)
+        barrier.wait()
+        results.append(coordinator.allocate(line))
+
+    threads = [threading.Thread(target=allocate) for _ in range(threads_count)]
+    for t in threads:
+        t.start()
+
+    for t in threads:
+        t.join()
+
+    uow = uow_factory()
+    product = uow.products.get(product_sku)
+    assert product is not None
+    assert len(results) == threads_count
+    assert all(results)
+    assert product.batches[0].available_quantity == batch_qty - threads_count * order_line_qty
+    assert metrics.concurrency_conflicts.value == conflicts_before
+
+
+def test_concurrent_allocations_queue_on_row_lock(
+    product_sku: str,
+    locking_uow_factory: Callable[[LockMode], SqlAlchemyUnitOfWork],
+    batch_qty: int,
+    order_line_qty: int,
+) -> None:
+    def uow_factory() -> SqlAlchemyUnitOfWork:
+        return locking_uow_factory(LockMode.FOR_UPDATE)
+
+    t1 = threading.Thread(target=_make_test_allocation, args=(product_sku, uow_factory, order_line_qty))
+    t2 = threading.Thread(target=_make_test_allocation, args=(product_sku, uow_factory, order_line_qty))
+
+    for t in (t1, t2):
+        t.start()
+
+    for t in (t1, t2):
+        t.join()
+
+    uow = uow_factory()
+    with uow:
+        product = uow.products.get(product_sku)
+        assert product is not None
+        assert product.batches[0].available_quantity == batch_qty - 2 * order_line_qty
+
+
+def test_nowait_lock_raises_concurrency_error(
+    product_sku: str,
+    locking_uow_factory: Callable[[LockMode], SqlAlchemyUnitOfWork],
+) -> None:
+    holder = locking_uow_factory(LockMode.FOR_UPDATE)
+    with holder:
+        assert holder.products.get(product_sku) is not None
+
+        uow = locking_uow_factory(LockMode.NOWAIT)
+        with pytest.raises(ConcurrencyError), uow:
+            uow.products.get(product_sku)
+
+
 def _make_test_allocation(sku: str, uow_factory: Callable[[], SqlAlchemyUnitOfWork], order_line_qty: int) -> None:
     try:
         uow = uow_factory()
@@ -0,0 +1,140 @@
+import gc
+from collections.abc import Generator
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from patterns_book.adapters.db_tables import metadata
+from patterns_book.adapters.migrations import MIGRATIONS, MigrationError, migrate
+from patterns_book.settings import Settings
+
+SCRATCH_SCHEMA = "patterns_migrations"
+
+
+@pytest.fixture
+def scratch_engine(engine: Engine, settings: Settings) -> Generator[Engine, None, None]:
+    # CREATE INDEX CONCURRENTLY waits for every open transaction in the database, including the ones
+    # still held by unreferenced sessions of earlier tests
+    gc.collect()
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {SCRATCH_SCHEMA} CASCADE"))
+        connection.execute(text(f"CREATE SCHEMA {SCRATCH_SCHEMA}"))
+    scratch = create_engine(settings.postgres_dsn, connect_args={"options": f"-csearch_path={SCRATCH_SCHEMA}"})
+    yield scratch
+    scratch.dispose()
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP SCHEMA {SCRATCH_SCHEMA} CASCADE"))
+
+
+def test_migrations_are_applied_once(scratch_engine: Engine) -> None:
+    assert migrate(scratch_engine) == [migration.version for migration in MIGRATIONS]
+    assert migrate(scratch_engine) == []
+
+
+def test_migrations_backfill_allocated_quantity_of_existing_schema(scratch_engine: Engine) -> None:
+    with scratch_engine.begin() as connection:
+        for statement in (
+            "CREATE TABLE products (sku VARCHAR(255) PRIMARY KEY, version_number INTEGER NOT NULL DEFAULT 0)",
+            "CREATE TABLE order_lines (id SERIAL PRIMARY KEY, sku VARCHAR(255), qty INTEGER, orderid VARCHAR(255))",
+            "CREATE TABLE batches (id SERIAL PRIMARY KEY, reference VARCHAR(255), "
+            "sku VARCHAR(255) REFERENCES products (sku), purchased_quantity INTEGER, eta DATE)",
+            "CREATE TABLE allocations (id SERIAL PRIMARY KEY, orderline_id INTEGER REFERENCES order_lines (id), "
+            "batch_id INTEGER REFERENCES batches (id))",
+            "INSERT INTO products (sku) VALUES ('sku')",
+            "INSERT INTO batches (id, reference, sku, purchased_quantity) VALUES (1, 'batch1', 'sku', 100)",
+            "INSERT INTO order_lines (id, sku, qty, orderid) VALUES (1, 'sku', 10, 'order1'), (2, 'sku', 5, 'order2')",
+            "INSERT INTO allocations (orderline_id, batch_id) VALUES (1, 1), (2, 1)",
+        ):
+            connection.execute(text(statement))
+
+    migrate(scratch_engine)
+
+    with scratch_engine.connect() as connection:
+        assert connection.execute(text("SELECT allocated_quantity FROM batches")).scalar() == 15
+
+
+def test_migrations_rebuild_invalid_index(scratch_engine: Engine) -> None:
+    migrate(scratch_engine)
+    with scratch_engine.begin() as connection:
+        connection.execute(
+            text("UPDATE pg_index SET indisvalid = false WHERE indexrelid = 'uq_batches_reference'::regclass")
+        )
+        connection.execute(text("DELETE FROM schema_migrations WHERE version = 2"))
+
+    assert migrate(scratch_engine) == [2]
+
+    with scratch_engine.connect() as connection:
+        valid = connection.execute(
+            text("SELECT indisvalid FROM pg_index WHERE indexrelid = 'uq_batches_reference'::regclass")
+        ).scalar()
+    assert valid
+
+
+def test_migrations_refuse_unique_index_over_duplicates(scratch_engine: Engine) -> None:
+    migrate(scratch_engine, MIGRATIONS[:1])
+    with scratch_engine.begin() as connection:
+        connection.execute(text("INSERT INTO products (sku) VALUES ('sku')"))
+        connection.execute(
+            text(
+                "INSERT INTO batches (reference, sku, purchased_quantity) "
+                "VALUES ('batch1', 'sku', 1), ('batch1', 'sku', 1)"
+            )
+        )
+
+    with pytest.raises(MigrationError, match="uq_batches_reference"):
+        migrate(scratch_engine)
+
+    assert "uq_batches_reference" not in {index["name"] for index in inspect(scratch_engine).get_indexes("batches")}
+
+
+def test_migrations_rekey_allocations_read_model_without_losing_rows(scratch_engine: Engine) -> None:
+    migrate(scratch_engine, MIGRATIONS[:2])
+    with scratch_engine.begin() as connection:
+        # The read model as an earlier migration 3 left it, keyed on (orderid, sku) alone
+        connection.execute(
+            text("CREATE UNIQUE INDEX uq_allocations_view_orderid_sku ON allocations_view (orderid, sku)")
+        )
+        connection.execute(text("INSERT INTO schema_migrations (version, description) VALUES (3, 'old')"))
+        connection.execute(
+            text("INSERT INTO allocations_view (orderid, sku, batchref) VALUES ('order1', 'sku', 'batch1')")
+        )
+
+    assert migrate(scratch_engine) == [4, 5]
+
+    with scratch_engine.begin() as connection:
+        connection.execute(
+            text("INSERT INTO allocations_view (orderid, sku, batchref) VALUES ('order1', 'sku', 'batch2')")
+        )
+        assert connection.execute(text("SELECT count(*) FROM allocations_view")).scalar() == 2
+    indexes = {index["name"] for index in inspect(scratch_engine).get_indexes("allocations_view")}
+    assert "uq_allocations_view_orderid_sku" not in indexes
+    assert "uq_allocations_view_orderid_sku_batchref" in indexes
+
+
+def test_migrated_schema_has_declared_indexes(scratch_engine: Engine) -> None:
+    migrate(scratch_engine)
+    inspector = inspect(scratch_engine)
+
+    for table in metadata.sorted_tables:
+        actual = {index["name"]: index["unique"] for index in inspector.get_indexes(table.name)}
+        expected = {index.name: index.unique for index in table.indexes}
+        assert actual == expected, table.name
+
+
+@pytest.mark.parametrize(
+    ("query", "index"),
+    [
+        ("SELECT * FROM batches WHERE sku = 'sku'", "ix_batches_sku"),
+        ("SELECT * FROM batches WHERE reference = 'ref'", "uq_batches_reference"),
+        ("SELECT * FROM allocations WHERE batch_id = 1", "ix_allocations_batch_id"),
+        ("SELECT * FROM allocations WHERE orderline_id = 1", "uq_allocations_orderline_batch"),
+    ],
+)
+def test_queries_use_indexes(session: Session, query: str, index: str) -> None:
+    session.execute(text("SET LOCAL enable_seqscan = off"))
+    plan = "\n".join(session.execute(text(f"EXPLAIN {query}")).scalars())
+    session.rollback()
+
+    assert index in plan
@@ -0,0 +1,112 @@
+import threading
+from collections.abc import Callable
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm import sessionmaker as sa_sessionmaker
+
+from patterns_book import relay
+from patterns_book.adapters import outbox
+from patterns_book.adapters.repository import ProductSQLRepository
+from patterns_book.adapters.unit_of_work import SqlAlchemyUnitOfWork
+from patterns_book.adapters.views import AllocationsSQLView
+from patterns_book.domain import events
+from patterns_book.service.message_bus import AbstractMessageBus, InMemoryMessageBus
+from patterns_book.settings import Settings
+from tests.conftest import generate_sku, make_domain_batch, make_domain_order_line, make_domain_product
+
+pytestmark = pytest.mark.usefixtures("db_cleanup")
+
+
+@pytest.fixture
+def uow_factory(sessionmaker: sa_sessionmaker[Session]) -> Callable[[], SqlAlchemyUnitOfWork]:
+    def factory() -> SqlAlchemyUnitOfWork:
+        session = sessionmaker()
+        message_bus = InMemoryMessageBus(AllocationsSQLView(sessionmaker))
+        return SqlAlchemyUnitOfWork(ProductSQLRepository(session), session, message_bus, use_outbox=True)
+
+    return factory
+
+
+def test_commit_writes_events_to_outbox(
+    uow_factory: Callable[[], SqlAlchemyUnitOfWork], sessionmaker: sa_sessionmaker[Session]
+) -> None:
+    sku = generate_sku()
+    batch = make_domain_batch(sku, 10)
+    line = make_domain_order_line(sku, 2)
+    uow = uow_factory()
+    with uow:
+        product = make_domain_product(sku, [batch])
+        uow.products.add(product)
+        product.allocate(line)
+        uow.commit()
+
+    with sessionmaker() as session:
+        rows = session.execute(text("SELECT event_type, payload, processed_at FROM outbox")).all()
+    assert [tuple(row) for row in rows] == [
+        ("Allocated", {"orderid": line.orderid, "sku": sku, "qty": 2, "batchref": batch.reference}, None),
+    ]
+
+
+def test_relay_batch_marks_handled_events_processed(sessionmaker: sa_sessionmaker[Session]) -> None:
+    sent = [events.OutOfStock(generate_sku()) for _ in range(3)]
+    with sessionmaker() as session:
+        outbox.add_events(session, sent)
+        session.commit()
+    handled: list[events.Event] = []
+
+    relayed = outbox.relay_batch(sessionmaker, handled.append, batch_size=2, max_attempts=3)
+    relayed += outbox.relay_batch(sessionmaker, handled.append, batch_size=2, max_attempts=3)
+
+    assert relayed == 3
+    assert handled == sent
+    assert outbox.relay_batch(sessionmaker, handled.append, batch_size=2, max_attempts=3) == 0
+
+
+def test_relay_batch_retries_failed_events_up_to_max_attempts(sessionmaker: sa_sessionmaker[Session]) -> None:
+    with sessionmaker() as session:
+        outbox.add_events(session, [events.OutOfStock(generate_sku())])
+        session.commit()
+
+    def fail(_: events.Event) -> None:
+        raise RuntimeError
+
+    assert outbox.relay_batch(sessionmaker, fail, batch_size=10, max_attempts=2) == 1
+    assert outbox.relay_batch(sessionmaker, fail, batch_size=10, max_attempts=2) == 1
+    assert outbox.relay_batch(sessionmaker, fail, batch_size=10, max_attempts=2) == 0
+
+    with sessionmaker() as session:
+        attempts = session.execute(text("SELECT attempts, processed_at FROM outbox")).one()
+    assert attempts == (2, None)
+
+
+def test_relay_keeps_running_after_database_error(sessionmaker: sa_sessionmaker[Session], settings: Settings) -> None:
+    with sessionmaker() as session:
+        outbox.add_events(session, [events.OutOfStock(generate_sku())])
+        session.commit()
+
+    stop = threading.Event()
+    sessions_opened = 0
+
+    def session_factory() -> Session:
+        nonlocal sessions_opened
+        sessions_opened += 1
+        if sessions_opened == 1:
+            msg = "SELECT"
+            raise OperationalError(msg, {}, Exception("connection lost"))
+        return sessionmaker()
+
+    class StoppingMessageBus(AbstractMessageBus):
+        def handle(self, _: events.Event) -> None:
+            stop.set()
+
+    relay.run(
+        session_factory,
+        StoppingMessageBus(),
+        settings.model_copy(update={"outbox_poll_interval_seconds": 0}),
+        stop,
+    )
+
+    assert sessions_opened == 2
@@ -1,15 +1,31 @@
+from collections.abc import Generator
 from datetime import date
 
 import pytest
-from sqlalchemy import text
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
 
-from patterns_book.adapters.repository import ProductSQLRepository
+from patterns_book.adapters.repository import LoadingStrategy, ProductCache, ProductSQLRepository
+from patterns_book.domain import model as domain_model
 from tests.conftest import generate_sku, make_domain_batch, make_domain_order_line, make_domain_product
 
 pytestmark = pytest.mark.usefixtures("db_cleanup")
 
 
+@pytest.fixture
+def statements(engine: Engine) -> Generator[list[str], None, None]:
+    executed: list[str] = []
+
+    def before_cursor_execute(_conn: object, _cursor: object, statement: str, *_: object) -> None:
+        executed.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    yield executed
+    event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
 def test_add_new_product(session: Session) -> None:
     sku = generate_sku()
     product = make_domain_product(sku)
@@ -127,6 +143,79 @@ def test_allocate_order_line_to_retrieved_product(session: Session) -> None:
     assert order_line in final_product.batches[0]._allocations
 
 
+def test_deallocated_order_line_is_deleted(session: Session) -> None:
+    sku = generate_sku()
+    product = make_domain_product(sku, [make_domain_batch(sku, 10)])
+    line = make_domain_order_line(sku, 5)
+    orderid = line.orderid
+    product.allocate(line)
+    ProductSQLRepository(session).add(product)
+    session.commit()
+    session.close()
+
+    retrieved_product = ProductSQLRepository(session).get(sku)
+    assert retrieved_product is not None
+    retrieved_product.deallocate(orderid)
+    session.commit()
+
+    assert session.execute(text("SELECT count(*) FROM allocations")).scalar() == 0
+    assert session.execute(text("SELECT count(*) FROM order_lines")).scalar() == 0
+
+
+def test_get_for_order_loads_only_the_lines_of_the_order(session: Session, statements: list[str]) -> None:
+    sku = generate_sku()
+    batch, other_batch = make_domain_batch(sku, 10), make_domain_batch(sku, 10)
+    product = make_domain_product(sku, [batch, other_batch])
+    line = domain_model.OrderLine("order1", sku, 10)
+    product.allocate(line)
+    product.allocate(domain_model.OrderLine("order2", sku, 5))
+    ProductSQLRepository(session).add(product)
+    session.commit()
+    reference = batch.reference
+    session.close()
+    statements.clear()
+
+    retrieved_product, allocations = ProductSQLRepository(session).get_for_order(sku, "order1")
+
+    assert retrieved_product is not None
+    assert allocations is not None
+    assert [(b.reference, line) for b, line in allocations] == [(reference, line)]
+    assert "batches" not in vars(retrieved_product)
+    assert not any("FROM batches" in statement and "orderid" not in statement for statement in statements)
+    assert retrieved_product.deallocate("order1", allocations) == [reference]
+    session.commit()
+    assert session.execute(text("SELECT sum(allocated_quantity) FROM batches")).scalar() == 5
+
+
+def test_get_for_order_of_unknown_product(session: Session) -> None:
+    assert ProductSQLRepository(session).get_for_order("unknown", "order1") == (None, None)
+
+
+def test_allocated_quantity_is_persisted(session: Session) -> None:
+    sku = generate_sku()
+    batch = make_domain_batch(sku, 10, date(2021, 1, 1))
+    product = make_domain_product(sku, [batch])
+    product.allocate(make_domain_order_line(sku, 2))
+    product.allocate(make_domain_order_line(sku, 3))
+
+    rep = ProductSQLRepository(session)
+    rep.add(product)
+    session.commit()
+
+    actual = session.execute(
+        text("SELECT allocated_quantity FROM batches WHERE reference = :reference"),
+        {"reference": batch.reference},
+    ).fetchone()
+    assert actual == (5,)
+
+    session.expunge_all()
+    retrieved_product = ProductSQLRepository(session).get(sku)
+    assert retrieved_product is not None
+    retrieved_batch = retrieved_product.batches[0]
+    assert retrieved_batch.allocated_quantity == sum(line.qty for line in retrieved_batch._allocations)
+    assert retrieved_batch.available_quantity == 5
+
+
 def test_get_batch_returns_none(session: Session) -> None:
     rep = ProductSQLRepository(session)
     assert rep.get("anything") is None
@@ -162,3 +251,157 @@ def test_list_multiple_products(session: Session) -> None:
     assert product3.sku in product_skus
 
     assert rep.seen == {product1, product2, product3}
+
+
+@pytest.mark.parametrize(
+    ("loading_strategy", "expected_statements"),
+    [
+        (LoadingStrategy.SELECTIN, 3),
+        (LoadingStrategy.JOINED, 1),
+        (LoadingStrategy.LAZY, 2 + 20),
+    ],
+)
+def test_get_product_statement_count(
+    session: Session,
+    statements: list[str],
+    loading_strategy: LoadingStrategy,
+    expected_statements: int,
+) -> None:
+    sku = generate_sku()
+    product = make_domain_product(sku, [make_domain_batch(sku, 100) for _ in range(20)])
+    for _ in range(60):
+        product.allocate(make_domain_order_line(sku, 1))
+    ProductSQLRepository(session).add(product)
+    session.commit()
+    session.close()
+
+    statements.clear()
+    retrieved_product = ProductSQLRepository(session, loading_strategy).get(sku)
+    assert retrieved_product is not None
+    allocated = sum(len(batch._allocations) for batch in retrieved_product.batches)
+
+    assert allocated == 60
+    assert len(statements) == expected_statements
+
+
+def test_get_many_loads_products_in_one_query(session: Session, statements: list[str]) -> None:
+    skus = sorted(generate_sku() for _ in range(5))
+    repository = ProductSQLRepository(session)
+    for sku in skus:
+        repository.add(make_domain_product(sku, [make_domain_batch(sku, 100)]))
+    session.commit()
+    session.close()
+
+    statements.clear()
+    products = ProductSQLRepository(session, LoadingStrategy.JOINED).get_many([*reversed(skus), "UNKNOWN"])
+
+    assert [product.sku for product in products] == skus
+    assert len(statements) == 1
+
+
+def _add_cached_product(session: Session, sku: str, cache: ProductCache) -> None:
+    ProductSQLRepository(session).add(make_domain_product(sku, [make_domain_batch(sku, 100) for _ in range(5)]))
+    session.commit()
+    session.close()
+    ProductSQLRepository(session, cache=cache).get(sku)
+    session.close()
+
+
+def test_cached_product_is_validated_with_a_single_statement(session: Session, statements: list[str]) -> None:
+    sku = generate_sku()
+    cache = ProductCache(max_entries=10)
+    _add_cached_product(session, sku, cache)
+
+    statements.clear()
+    product = ProductSQLRepository(session, cache=cache).get(sku)
+
+    assert product is not None
+    assert len(product.batches) == 5
+    assert product.events == []
+    assert len(statements) == 1
+
+
+def test_cached_product_is_reloaded_when_version_changes(session: Session, statements: list[str]) -> None:
+    sku = generate_sku()
+    cache = ProductCache(max_entries=10)
+    _add_cached_product(session, sku, cache)
+    session.execute(text("UPDATE products SET version_number = version_number + 1 WHERE sku = :sku"), {"sku": sku})
+    session.commit()
+    session.close()
+
+    statements.clear()
+    product = ProductSQLRepository(session, cache=cache).get(sku)
+
+    assert product is not None
+    assert product._version_number == 1
+    assert len(statements) > 1
+
+
+def test_committed_product_refreshes_cache(session: Session, statements: list[str]) -> None:
+    sku = generate_sku()
+    cache = ProductCache(max_entries=10)
+    _add_cached_product(session, sku, cache)
+
+    repository = ProductSQLRepository(session, cache=cache)
+    product = repository.get(sku)
+    assert product is not None
+    product.allocate(make_domain_order_line(sku, 7))
+    repository.before_commit()
+    session.commit()
+    repository.after_commit()
+    session.close()
+
+    statements.clear()
+    cached = ProductSQLRepository(session, cache=cache).get(sku)
+
+    assert cached is not None
+    assert sum(batch.allocated_quantity for batch in cached.batches) == 7
+    assert len(statements) == 1
+    assert session.execute(text("SELECT count(*) FROM allocations")).scalar() == 1
+
+
+def test_cached_product_sees_batch_added_elsewhere(session: Session) -> None:
+    sku = generate_sku()
+    cache = ProductCache(max_entries=10)
+    _add_cached_product(session, sku, cache)
+
+    product = ProductSQLRepository(session).get(sku)
+    assert product is not None
+    product.add_batch(make_domain_batch(sku, 100))
+    session.commit()
+    session.close()
+
+    cached = ProductSQLRepository(session, cache=cache).get(sku)
+
+    assert cached is not None
+    assert len(cached.batches) == 6
+
+
+def test_cache_evicts_least_recently_used_product(session: Session) -> None:
+    cache = ProductCache(max_entries=2)
+    skus = [generate_sku() for _ in range(3)]
+    for sku in skus:
+        _add_cached_product(session, sku, cache)
+
+    assert len(cache) == 2
+    assert cache.checkout(skus[0], 0, session) is None
+    assert cache.checkout(skus[2], 0, session) is not None
+
+
+def test_rollback_after_failed_flush_of_unreferenced_product(session: Session) -> None:
+    sku = generate_sku()
+    session.add(make_domain_product(sku, [make_domain_batch(sku, 10)]))
+    session.commit()
+    _allocate_without_keeping_product(ProductSQLRepository(session), sku)
+    session.execute(text("UPDATE products SET version_number = 5 WHERE sku = :sku"), {"sku": sku})
+
+    with pytest.raises(StaleDataError):
+        session.commit()
+    session.rollback()
+
+
+def _allocate_without_keeping_product(repository: ProductSQLRepository, sku: str) -> None:
+    product = repository.get(sku)
+    assert product is not None
+    product.allocate(make_domain_order_line(sku, 1))
+    repository.seen.clear()
@@ -0,0 +1,94 @@
+import os
+import time
+from collections.abc import Generator
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+from patterns_book.adapters import sessions
+from patterns_book.service import metrics
+from patterns_book.settings import Settings
+
+
+@pytest.fixture
+def initialized(settings: Settings) -> None:
+    sessions.init_sessionmaker(settings.postgres_dsn, settings.postgres_schema)
+
+
+@pytest.fixture
+def small_pool(settings: Settings) -> Generator[None, None, None]:
+    options = sessions.EngineOptions(pool_size=1, max_overflow=0, pool_timeout_seconds=0.1, statement_timeout_ms=50)
+    sessions.init_sessionmaker(settings.postgres_dsn, settings.postgres_schema, options)
+    yield
+    sessions.init_sessionmaker(settings.postgres_dsn, settings.postgres_schema)
+
+
+def _backend_pid() -> int:
+    with sessions.get_session() as session:
+        backend_pid: int = session.execute(text("SELECT pg_backend_pid()")).scalar_one()
+        return backend_pid
+
+
+@pytest.mark.usefixtures("initialized")
+def test_init_sessionmaker_keeps_engine_for_same_arguments(settings: Settings) -> None:
+    engine = sessions.get_engine()
+
+    sessions.init_sessionmaker(settings.postgres_dsn, settings.postgres_schema)
+
+    assert sessions.get_engine() is engine
+
+
+@pytest.mark.usefixtures("initialized")
+def test_prewarm_pool_opens_connections() -> None:
+    sessions.get_engine().dispose()
+
+    sessions.prewarm_pool(3)
+
+    pool = sessions.get_engine().pool
+    assert isinstance(pool, QueuePool)
+    assert pool.checkedin() == 3
+
+
+@pytest.mark.usefixtures("initialized")
+def test_forked_child_opens_its_own_connections() -> None:
+    sessions.get_engine().dispose()
+    parent_backend_pid = _backend_pid()
+    reader, writer = os.pipe()
+
+    if (child_pid := os.fork()) == 0:
+        os.close(reader)
+        os.write(writer, str(_backend_pid()).encode())
+        os._exit(0)
+
+    os.close(writer)
+    with os.fdopen(reader) as pipe:
+        child_backend_pid = int(pipe.read())
+    os.waitpid(child_pid, 0)
+
+    assert child_backend_pid != parent_backend_pid
+    # The child did not close the parent's pooled connection on exit
+    assert _backend_pid() == parent_backend_pid
+
+
+@pytest.mark.usefixtures("small_pool")
+def test_exhausted_pool_fails_fast() -> None:
+    timeouts_before = metrics.pool_timeouts.value
+
+    with sessions.get_engine().connect():
+        started = time.monotonic()
+        with pytest.raises(PoolTimeoutError), sessions.get_session() as session:
+            session.execute(text("SELECT 1"))
+
+    assert time.monotonic() - started < 1
+    assert metrics.pool_timeouts.value == timeouts_before + 1
+
+
+@pytest.mark.usefixtures("small_pool")
+def test_statement_timeout_cancels_slow_statements() -> None:
+    with sessions.get_session() as session:
+        assert session.execute(text("SHOW statement_timeout")).scalar_one() == "50ms"
+        with pytest.raises(OperationalError, match="statement timeout"):
+            session.execute(text("SELECT pg_sleep(1)"))
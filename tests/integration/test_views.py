@@ -0,0 +1,84 @@
+from datetime import date
+
+import pytest
+from sqlalchemy.orm import Session
+from sqlalchemy.orm import sessionmaker as sa_sessionmaker
+
+from patterns_book.adapters.views import AllocationsSQLView, AvailabilitySQLView
+from tests.conftest import generate_sku, make_domain_batch, make_domain_order_line, make_domain_product
+
+pytestmark = pytest.mark.usefixtures("db_cleanup")
+
+
+def test_add_and_get_allocations(sessionmaker: sa_sessionmaker[Session]) -> None:
+    view = AllocationsSQLView(sessionmaker)
+    sku1, sku2 = generate_sku(), generate_sku()
+
+    view.add("order1", sku1, "batch1")
+    view.add("order1", sku2, "batch2")
+    view.add("order2", sku1, "batch1")
+
+    assert view.get("order1") == [
+        {"sku": sku1, "batchref": "batch1"},
+        {"sku": sku2, "batchref": "batch2"},
+    ]
+
+
+def test_add_is_idempotent(sessionmaker: sa_sessionmaker[Session]) -> None:
+    view = AllocationsSQLView(sessionmaker)
+    sku = generate_sku()
+
+    view.add("order1", sku, "batch1")
+    view.add("order1", sku, "batch1")
+
+    assert view.get("order1") == [{"sku": sku, "batchref": "batch1"}]
+
+
+def test_keeps_lines_of_one_sku_allocated_to_different_batches(sessionmaker: sa_sessionmaker[Session]) -> None:
+    view = AllocationsSQLView(sessionmaker)
+    sku = generate_sku()
+
+    view.add("order1", sku, "batch1")
+    view.add("order1", sku, "batch2")
+    view.add("order1", sku, "batch1")
+
+    assert view.get("order1") == [{"sku": sku, "batchref": "batch1"}, {"sku": sku, "batchref": "batch2"}]
+
+    view.remove("order1", sku)
+
+    assert view.get("order1") == []
+
+
+def test_remove_allocation(sessionmaker: sa_sessionmaker[Session]) -> None:
+    view = AllocationsSQLView(sessionmaker)
+    sku1, sku2 = generate_sku(), generate_sku()
+    view.add("order1", sku1, "batch1")
+    view.add("order1", sku2, "batch2")
+
+    view.remove("order1", sku1)
+
+    assert view.get("order1") == [{"sku": sku2, "batchref": "batch2"}]
+
+
+def test_get_unknown_order_returns_empty_list(sessionmaker: sa_sessionmaker[Session]) -> None:
+    view = AllocationsSQLView(sessionmaker)
+
+    assert view.get("unknown") == []
+
+
+def test_availability_is_read_from_batches(session: Session) -> None:
+    sku, empty_sku = generate_sku(), generate_sku()
+    shipment = make_domain_batch(sku, 10, date(2030, 1, 1))
+    in_stock = make_domain_batch(sku, 20)
+    product = make_domain_product(sku, [shipment, in_stock])
+    product.allocate(make_domain_order_line(sku, 5))
+    session.add_all([product, make_domain_product(empty_sku)])
+    session.commit()
+    view = AvailabilitySQLView(lambda statement: session.execute(statement).mappings().all())
+
+    assert view.get(sku) == [
+        {"reference": shipment.reference, "eta": date(2030, 1, 1), "available_quantity": 10},
+        {"reference": in_stock.reference, "eta": None, "available_quantity": 15},
+    ]
+    assert view.get(empty_sku) == []
+    assert view.get("unknown") is None
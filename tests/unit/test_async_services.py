@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from patterns_book.adapters.repository import AbstractAsyncRepository
+from patterns_book.adapters.unit_of_work import AsyncAbstractUnitOfWork, ConcurrencyError
+from patterns_book.domain import model as domain_model
+from patterns_book.service import services
+from tests.conftest import generate_sku
+from tests.unit.test_services import make_batch, make_order_line
+
+
+@pytest.fixture
+def uow() -> "FakeAsyncUOF":
+    return FakeAsyncUOF(FakeAsyncRepository([]))
+
+
+def test_allocate_returns_allocation(uow: "FakeAsyncUOF") -> None:
+    sku = generate_sku()
+    batch = make_batch(sku, 100)
+    asyncio.run(services.add_batch_async(batch, uow))
+
+    result = asyncio.run(services.allocate_async(make_order_line(sku, 10), uow))
+
+    assert result == batch.reference
+    assert uow.commits == 2
+
+
+def test_allocate_raises_error_for_invalid_sku(uow: "FakeAsyncUOF") -> None:
+    with pytest.raises(services.InvalidSkuError, match="Invalid sku NONEXISTENTSKU"):
+        asyncio.run(services.allocate_async(make_order_line("NONEXISTENTSKU", 10), uow))
+
+
+def test_allocate_retries_on_concurrency_error(uow: "FakeAsyncUOF", monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(services, "BACKOFF_MAX_SECONDS", 0)
+    sku = generate_sku()
+    asyncio.run(services.add_batch_async(make_batch(sku, 100), uow))
+    uow.conflicts = 2
+    uow.commits = 0
+
+    asyncio.run(services.allocate_async(make_order_line(sku, 10), uow))
+
+    assert uow.commits == 1
+
+
+class FakeAsyncRepository(AbstractAsyncRepository[domain_model.Product]):
+    def __init__(self, products: list[domain_model.Product]) -> None:
+        self._products = set(products)
+
+    def add(self, product: domain_model.Product) -> None:
+        self._products.add(product)
+
+    async def get(self, sku: str) -> domain_model.Product | None:
+        return next((p for p in self._products if p.sku == sku), None)
+
+    async def list(self) -> list[domain_model.Product]:
+        return list(self._products)
+
+
+class FakeAsyncUOF(AsyncAbstractUnitOfWork):
+    def __init__(self, products: AbstractAsyncRepository[domain_model.Product]) -> None:
+        self.products = products
+        self.commits = 0
+        self.conflicts = 0
+
+    async def commit(self) -> None:
+        if self.conflicts:
+            self.conflicts -= 1
+            raise ConcurrencyError
+        self.commits += 1
+
+    async def rollback(self) -> None:
+        pass
@@ -0,0 +1,26 @@
+from patterns_book.service.batch_feed import FeedFormat, read_rows
+
+
+def test_read_csv_rows() -> None:
+    lines = ["reference,sku,qty,eta\n", "batch1,sku1,10,2021-01-01\n", "batch2,sku1,5,\n"]
+
+    rows = list(read_rows(lines, FeedFormat.CSV))
+
+    assert rows == [
+        {"reference": "batch1", "sku": "sku1", "qty": "10", "eta": "2021-01-01"},
+        {"reference": "batch2", "sku": "sku1", "qty": "5", "eta": None},
+    ]
+
+
+def test_read_csv_rows_without_eta_column() -> None:
+    rows = list(read_rows(["reference,sku,qty\n", "batch1,sku1,10\n"], FeedFormat.CSV))
+
+    assert rows == [{"reference": "batch1", "sku": "sku1", "qty": "10"}]
+
+
+def test_read_jsonl_rows_skips_blank_lines_and_keeps_malformed_ones() -> None:
+    lines = ['{"reference": "batch1", "sku": "sku1", "qty": 10}\n', "\n", "not json\n"]
+
+    rows = list(read_rows(lines, FeedFormat.JSONL))
+
+    assert rows == [{"reference": "batch1", "sku": "sku1", "qty": 10}, "not json\n"]
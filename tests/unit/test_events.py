@@ -0,0 +1,11 @@
+from patterns_book.domain import events
+
+
+def test_serialize_and_deserialize_event() -> None:
+    event = events.Allocated("order1", "sku1", 10, "batch1")
+
+    event_type, payload = events.serialize(event)
+
+    assert event_type == "Allocated"
+    assert payload == {"orderid": "order1", "sku": "sku1", "qty": 10, "batchref": "batch1"}
+    assert events.deserialize(event_type, payload) == event
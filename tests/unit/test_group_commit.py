@@ -0,0 +1,121 @@
+import threading
+import time
+
+import pytest
+
+from patterns_book.domain import model as domain_model
+from patterns_book.service import models, services
+from patterns_book.service.group_commit import AllocationCoordinator
+from tests.conftest import generate_sku
+from tests.unit.test_services import FakeRepository, FakeUOF, make_order_line
+
+
+class BlockingRepository(FakeRepository):
+    def __init__(self, products: list[domain_model.Product]) -> None:
+        super().__init__(products)
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def get(self, sku: str) -> domain_model.Product | None:
+        self.entered.set()
+        self.release.wait()
+        return super().get(sku)
+
+
+@pytest.fixture
+def sku() -> str:
+    return generate_sku()
+
+
+@pytest.fixture
+def uow(sku: str) -> FakeUOF:
+    return FakeUOF(FakeRepository([domain_model.Product(sku, [domain_model.Batch("batch", sku, 20)])]))
+
+
+def test_allocates_single_line(uow: FakeUOF, sku: str) -> None:
+    coordinator = AllocationCoordinator(lambda: uow)
+
+    assert coordinator.allocate(make_order_line(sku, 5)) == "batch"
+    assert uow.commits == 1
+
+
+def test_returns_none_when_out_of_stock(uow: FakeUOF, sku: str) -> None:
+    coordinator = AllocationCoordinator(lambda: uow)
+
+    assert coordinator.allocate(make_order_line(sku, 25)) is None
+
+
+def test_raises_for_invalid_sku(uow: FakeUOF) -> None:
+    coordinator = AllocationCoordinator(lambda: uow)
+
+    with pytest.raises(services.InvalidSkuError, match="Invalid sku unknown"):
+        coordinator.allocate(make_order_line("unknown", 1))
+
+
+def test_commits_queued_lines_together_in_arrival_order(sku: str) -> None:
+    repository = BlockingRepository([domain_model.Product(sku, [domain_model.Batch("batch", sku, 20)])])
+    uow = FakeUOF(repository)
+    coordinator = AllocationCoordinator(lambda: uow)
+    lines = [make_order_line(sku, qty) for qty in (5, 10, 10)]
+    results: dict[str, str | None] = {}
+
+    def allocate(line: models.OrderLine) -> None:
+        results[line.orderid] = coordinator.allocate(line)
+
+    threads = [threading.Thread(target=allocate, args=(line,)) for line in lines]
+    threads[0].start()
+    assert repository.entered.wait(timeout=5)
+    for queued, thread in enumerate(threads[1:], start=1):
+        thread.start()
+        _wait_for_queue(coordinator, sku, queued)
+    repository.release.set()
+    for thread in threads:
+        thread.join()
+
+    assert uow.commits == 2
+    assert [results[line.orderid] for line in lines] == ["batch", "batch", None]
+
+
+def test_wakes_queued_lines_when_leader_is_interrupted(sku: str) -> None:
+    class InterruptingRepository(BlockingRepository):
+        interrupt = False
+
+        def get(self, sku: str) -> domain_model.Product | None:
+            product = super().get(sku)
+            if self.interrupt:
+                raise KeyboardInterrupt
+            self.interrupt = True
+            return product
+
+    repository = InterruptingRepository([domain_model.Product(sku, [domain_model.Batch("batch", sku, 20)])])
+    coordinator = AllocationCoordinator(lambda: FakeUOF(repository))
+    lines = [make_order_line(sku, 5) for _ in range(3)]
+    errors: dict[str, BaseException] = {}
+
+    def allocate(line: models.OrderLine) -> None:
+        try:
+            coordinator.allocate(line)
+        except BaseException as e:  # noqa: BLE001
+            errors[line.orderid] = e
+
+    threads = [threading.Thread(target=allocate, args=(line,)) for line in lines]
+    threads[0].start()
+    assert repository.entered.wait(timeout=5)
+    for queued, thread in enumerate(threads[1:], start=1):
+        thread.start()
+        _wait_for_queue(coordinator, sku, queued)
+    repository.release.set()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert not any(thread.is_alive() for thread in threads)
+    assert isinstance(errors[lines[1].orderid], KeyboardInterrupt)
+    assert isinstance(errors[lines[2].orderid], RuntimeError)
+    assert coordinator._queues == {}
+
+
+def _wait_for_queue(coordinator: AllocationCoordinator, sku: str, length: int) -> None:
+    deadline = time.monotonic() + 5
+    while len(coordinator._queues[sku]) < length:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
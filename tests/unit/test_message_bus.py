@@ -0,0 +1,282 @@
+import os
+import threading
+import time
+
+import pytest
+
+from patterns_book.adapters.views import AbstractAllocationsView
+from patterns_book.domain import events
+from patterns_book.service import message_bus as message_bus_module
+from patterns_book.service import metrics
+from patterns_book.service.message_bus import (
+    AbstractMessageBus,
+    BackgroundMessageBus,
+    CoalescingMessageBus,
+    InMemoryMessageBus,
+)
+
+
+@pytest.fixture
+def allocations_view() -> "_FakeAllocationsView":
+    return _FakeAllocationsView()
+
+
+def test_allocated_event_adds_allocation_to_read_model(allocations_view: "_FakeAllocationsView") -> None:
+    message_bus = InMemoryMessageBus(allocations_view)
+
+    message_bus.handle(events.Allocated("order1", "sku1", 10, "batch1"))
+
+    assert allocations_view.get("order1") == [{"sku": "sku1", "batchref": "batch1"}]
+
+
+def test_out_of_stock_digest_sends_notification_with_suppressed_count(
+    allocations_view: "_FakeAllocationsView", capsys: pytest.CaptureFixture[str]
+) -> None:
+    InMemoryMessageBus(allocations_view).handle(events.OutOfStockDigest("sku1", 41))
+
+    assert "Out of stock for sku1, 41 more failed allocations" in capsys.readouterr().out
+
+
+def test_deallocated_event_removes_allocation_from_read_model(allocations_view: "_FakeAllocationsView") -> None:
+    message_bus = InMemoryMessageBus(allocations_view)
+    message_bus.handle(events.Allocated("order1", "sku1", 10, "batch1"))
+    message_bus.handle(events.Allocated("order1", "sku2", 10, "batch2"))
+
+    message_bus.handle(events.Deallocated("order1", "sku1", 10))
+
+    assert allocations_view.get("order1") == [{"sku": "sku2", "batchref": "batch2"}]
+
+
+def test_background_bus_handles_events_off_the_caller_thread() -> None:
+    inner = _RecordingMessageBus()
+    message_bus = BackgroundMessageBus(inner, workers=1)
+    event = events.OutOfStock("sku1")
+
+    message_bus.handle(event)
+    message_bus.shutdown()
+
+    assert inner.handled_events == [event]
+    assert inner.threads != {threading.get_ident()}
+
+
+def test_background_bus_drains_queue_on_shutdown() -> None:
+    inner = _RecordingMessageBus()
+    message_bus = BackgroundMessageBus(inner, workers=2)
+    sent = [events.OutOfStock(f"sku{i}") for i in range(100)]
+
+    for event in sent:
+        message_bus.handle(event)
+    message_bus.shutdown()
+
+    assert sorted(inner.skus) == sorted(e.sku for e in sent)
+
+
+def test_background_bus_restarts_workers_in_forked_child() -> None:
+    inner = _RecordingMessageBus()
+    message_bus = BackgroundMessageBus(inner, workers=1)
+    reader, writer = os.pipe()
+
+    if (child_pid := os.fork()) == 0:
+        os.close(reader)
+        message_bus.handle(events.OutOfStock("child"))
+        message_bus.shutdown()
+        os.write(writer, ",".join(inner.skus).encode())
+        os._exit(0)
+
+    os.close(writer)
+    with os.fdopen(reader) as pipe:
+        handled_in_child = pipe.read()
+    os.waitpid(child_pid, 0)
+    message_bus.shutdown()
+
+    assert handled_in_child == "child"
+
+
+def test_background_bus_isolates_handler_errors() -> None:
+    inner = _RecordingMessageBus(failing_sku="bad")
+    message_bus = BackgroundMessageBus(inner, workers=1)
+
+    message_bus.handle(events.OutOfStock("bad"))
+    message_bus.handle(events.OutOfStock("good"))
+    message_bus.shutdown()
+
+    assert inner.skus == ["good"]
+
+
+def test_background_bus_handles_event_on_caller_thread_when_queue_is_full() -> None:
+    inner = _RecordingMessageBus(blocking_sku="slow")
+    message_bus = BackgroundMessageBus(inner, workers=1, queue_size=1, put_timeout=0.01)
+
+    message_bus.handle(events.OutOfStock("slow"))
+    inner.started.wait()
+    message_bus.handle(events.OutOfStock("queued"))
+    message_bus.handle(events.OutOfStock("overflow"))
+
+    assert inner.skus == ["overflow"]
+    assert threading.get_ident() in inner.threads
+
+    inner.release.set()
+    message_bus.shutdown()
+    assert inner.skus == ["overflow", "slow", "queued"]
+
+
+def test_background_bus_bounds_wait_for_allocation_events_when_queue_is_full(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(message_bus_module, "ORDERED_PUT_TIMEOUT", 0.01)
+    inner = _RecordingMessageBus(blocking_sku="slow")
+    message_bus = BackgroundMessageBus(inner, workers=1, queue_size=1)
+    allocated = events.Allocated("order1", "overflow", 10, "batch1")
+
+    message_bus.handle(events.OutOfStock("slow"))
+    inner.started.wait()
+    message_bus.handle(events.OutOfStock("queued"))
+    message_bus.handle(allocated)
+
+    assert inner.handled_events == [allocated]
+
+    inner.release.set()
+    message_bus.shutdown()
+
+
+def test_background_bus_handles_event_sent_while_shutting_down(monkeypatch: pytest.MonkeyPatch) -> None:
+    inner = _RecordingMessageBus()
+    message_bus = BackgroundMessageBus(inner, workers=1)
+    shutting_down = threading.Thread(target=message_bus.shutdown)
+    routing_key = message_bus_module._routing_key
+
+    def shut_down_before_routing(event: events.Event) -> tuple[str, ...]:
+        shutting_down.start()
+        time.sleep(0.05)
+        return routing_key(event)
+
+    monkeypatch.setattr(message_bus_module, "_routing_key", shut_down_before_routing)
+    message_bus.handle(events.OutOfStock("sku1"))
+    shutting_down.join()
+
+    assert inner.skus == ["sku1"]
+
+
+def test_background_bus_keeps_order_of_events_of_one_allocation(allocations_view: "_FakeAllocationsView") -> None:
+    read_model_bus = InMemoryMessageBus(allocations_view)
+
+    class SlowAllocatedMessageBus(AbstractMessageBus):
+        def handle(self, event: events.Event) -> None:
+            if isinstance(event, events.Allocated):
+                time.sleep(0.005)
+            read_model_bus.handle(event)
+
+    message_bus = BackgroundMessageBus(SlowAllocatedMessageBus(), workers=4, queue_size=4)
+
+    for i in range(20):
+        message_bus.handle(events.Allocated(f"order{i}", "sku1", 10, "batch1"))
+        message_bus.handle(events.Deallocated(f"order{i}", "sku1", 10))
+    message_bus.shutdown()
+
+    assert all(allocations_view.get(f"order{i}") == [] for i in range(20))
+
+
+def test_coalescing_bus_suppresses_out_of_stock_within_window() -> None:
+    inner = _RecordingMessageBus()
+    now = [0.0]
+    message_bus = CoalescingMessageBus(inner, window_seconds=10, clock=lambda: now[0])
+    suppressed_before = metrics.suppressed_events.value("coalesced")
+
+    message_bus.handle(events.OutOfStock("sku1"))
+    now[0] = 5
+    message_bus.handle(events.OutOfStock("sku1"))
+    message_bus.handle(events.OutOfStock("sku2"))
+    now[0] = 10
+    message_bus.handle(events.OutOfStock("sku1"))
+
+    assert inner.handled_events == [
+        events.OutOfStock("sku1"),
+        events.OutOfStock("sku2"),
+        events.OutOfStockDigest("sku1", 1),
+        events.OutOfStock("sku1"),
+    ]
+    assert metrics.suppressed_events.value("coalesced") - suppressed_before == 1
+
+
+def test_coalescing_bus_sends_digest_on_flush_after_window() -> None:
+    inner = _RecordingMessageBus()
+    now = [0.0]
+    message_bus = CoalescingMessageBus(inner, window_seconds=10, clock=lambda: now[0])
+
+    for _ in range(3):
+        message_bus.handle(events.OutOfStock("sku1"))
+    message_bus.handle(events.OutOfStock("sku2"))
+    message_bus.flush()
+    now[0] = 10
+    message_bus.flush()
+    message_bus.flush()
+
+    assert inner.handled_events == [
+        events.OutOfStock("sku1"),
+        events.OutOfStock("sku2"),
+        events.OutOfStockDigest("sku1", 2),
+    ]
+
+
+def test_background_bus_flushes_coalesced_events_when_idle() -> None:
+    inner = _RecordingMessageBus()
+    message_bus = BackgroundMessageBus(CoalescingMessageBus(inner, window_seconds=0.05), workers=1, flush_interval=0.01)
+
+    message_bus.handle(events.OutOfStock("sku1"))
+    message_bus.handle(events.OutOfStock("sku1"))
+    deadline = time.monotonic() + 5
+    while len(inner.handled_events) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    message_bus.shutdown()
+
+    assert inner.handled_events == [events.OutOfStock("sku1"), events.OutOfStockDigest("sku1", 1)]
+
+
+def test_coalescing_bus_passes_other_events_through() -> None:
+    inner = _RecordingMessageBus()
+    message_bus = CoalescingMessageBus(inner, window_seconds=10)
+    event = events.Allocated("order1", "sku1", 10, "batch1")
+
+    message_bus.handle(event)
+    message_bus.handle(event)
+
+    assert inner.handled_events == [event, event]
+
+
+class _RecordingMessageBus(AbstractMessageBus):
+    def __init__(self, failing_sku: str | None = None, blocking_sku: str | None = None) -> None:
+        self.handled_events: list[events.Event] = []
+        self.threads: set[int] = set()
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self._failing_sku = failing_sku
+        self._blocking_sku = blocking_sku
+        self._lock = threading.Lock()
+
+    @property
+    def skus(self) -> list[str]:
+        return [getattr(event, "sku", "") for event in self.handled_events]
+
+    def handle(self, event: events.Event) -> None:
+        sku = getattr(event, "sku", None)
+        if sku == self._failing_sku:
+            raise RuntimeError(sku)
+        if sku == self._blocking_sku:
+            self.started.set()
+            self.release.wait()
+        with self._lock:
+            self.handled_events.append(event)
+            self.threads.add(threading.get_ident())
+
+
+class _FakeAllocationsView(AbstractAllocationsView):
+    def __init__(self) -> None:
+        self._rows: list[tuple[str, str, str]] = []
+
+    def add(self, orderid: str, sku: str, batchref: str) -> None:
+        if (orderid, sku, batchref) not in self._rows:
+            self._rows.append((orderid, sku, batchref))
+
+    def remove(self, orderid: str, sku: str) -> None:
+        self._rows = [row for row in self._rows if row[:2] != (orderid, sku)]
+
+    def get(self, orderid: str) -> list[dict[str, str]]:
+        return [{"sku": sku, "batchref": batchref} for o, sku, batchref in self._rows if o == orderid]
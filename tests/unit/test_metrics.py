@@ -0,0 +1,67 @@
+from collections.abc import Generator
+
+import pytest
+
+from patterns_book.service import metrics
+
+
+@pytest.fixture
+def enabled() -> Generator[None, None, None]:
+    metrics.enable()
+    yield
+    metrics.disable()
+
+
+def test_histogram_renders_cumulative_buckets() -> None:
+    histogram = metrics.Histogram("test_render_seconds", "Test histogram", "stage", buckets=(0.1, 1.0))
+
+    histogram.observe(0.05, "load")
+    histogram.observe(0.5, "load")
+    histogram.observe(5.0, "load")
+
+    assert histogram.render() == [
+        "# HELP test_render_seconds Test histogram",
+        "# TYPE test_render_seconds histogram",
+        'test_render_seconds_bucket{stage="load",le="0.1"} 1',
+        'test_render_seconds_bucket{stage="load",le="1.0"} 2',
+        'test_render_seconds_bucket{stage="load",le="+Inf"} 3',
+        'test_render_seconds_sum{stage="load"} 5.55',
+        'test_render_seconds_count{stage="load"} 3',
+    ]
+
+
+def test_labeled_counter_escapes_label_values() -> None:
+    counter = metrics.LabeledCounter("test_escaped_total", "Test counter", "name")
+
+    counter.inc('a "quoted"\\name')
+
+    assert counter.render()[-1] == 'test_escaped_total{name="a \\"quoted\\"\\\\name"} 1'
+
+
+def test_stage_is_not_timed_when_disabled() -> None:
+    before = metrics.stage_duration.count("test_disabled")
+
+    with metrics.stage("test_disabled"):
+        pass
+
+    assert metrics.stage_duration.count("test_disabled") == before
+
+
+@pytest.mark.usefixtures("enabled")
+def test_stage_is_timed_when_enabled() -> None:
+    before = metrics.stage_duration.count("test_enabled")
+
+    with metrics.stage("test_enabled"):
+        pass
+
+    assert metrics.stage_duration.count("test_enabled") == before + 1
+
+
+def test_statements_are_counted_per_request() -> None:
+    metrics.start_request()
+    metrics.record_statement(0.001)
+    metrics.record_statement(0.002)
+    metrics.finish_request("test_endpoint")
+
+    assert metrics.sql_statements_per_request.count("test_endpoint") == 1
+    assert 'sql_statements_per_request_bucket{endpoint="test_endpoint",le="2.0"} 1' in metrics.render()
@@ -1,6 +1,6 @@
 from datetime import UTC, datetime, timedelta
 
-from patterns_book.domain.events import OutOfStock
+from patterns_book.domain.events import Allocated, Deallocated, OutOfStock
 from patterns_book.domain.model import Batch, OrderLine, Product
 from tests.conftest import generate_sku, make_domain_batch, make_domain_order_line
 
@@ -39,6 +39,20 @@ def test_deallocate_if_line_is_not_allocated_does_not_reduces_the_available_quan
     assert batch.available_quantity == 20
 
 
+def test_allocated_quantity_tracks_allocations_and_deallocations() -> None:
+    sku = generate_sku()
+    batch = make_domain_batch(sku, 20)
+    line1 = make_domain_order_line(sku, 2)
+    line2 = make_domain_order_line(sku, 5)
+
+    batch.allocate(line1)
+    batch.allocate(line2)
+    batch.deallocate(line1)
+
+    assert batch.allocated_quantity == 5
+    assert batch.available_quantity == 15
+
+
 def test_can_allocate_if_available_greater_than_required() -> None:
     batch, line = _make_batch_and_line(20, 2)
 
@@ -112,6 +126,17 @@ def test_returns_allocated_batch_ref() -> None:
     assert allocation == in_stock_batch.reference
 
 
+def test_adds_allocated_event() -> None:
+    sku = generate_sku()
+    batch = make_domain_batch(sku, 100)
+    product = Product(sku, [batch])
+    line = make_domain_order_line(sku, 10)
+
+    product.allocate(line)
+
+    assert product.events == [Allocated(line.orderid, sku, 10, batch.reference)]
+
+
 def test_returns_none_and_add_out_of_stock_event_if_cannot_allocate() -> None:
     sku = generate_sku()
     batch = make_domain_batch(sku, 5)
@@ -136,6 +161,142 @@ def test_allocate_later_if_earlier_cannot_allocate() -> None:
     assert allocation == later.reference
 
 
+def test_allocates_to_batch_added_after_first_allocation() -> None:
+    today = datetime.now(tz=UTC).date()
+    sku = generate_sku()
+    later = make_domain_batch(sku, 100, eta=today + timedelta(days=5))
+    product = Product(sku, [later])
+    product.allocate(make_domain_order_line(sku, 10))
+
+    earlier = make_domain_batch(sku, 100, eta=today)
+    product.add_batch(earlier)
+    allocation = product.allocate(make_domain_order_line(sku, 10))
+
+    assert allocation == earlier.reference
+    assert earlier in product.batches
+
+
+def test_add_batch_increments_version_number() -> None:
+    sku = generate_sku()
+    product = Product(sku, [])
+
+    product.add_batch(make_domain_batch(sku, 100))
+
+    assert product._version_number == 1
+
+
+def test_skips_exhausted_batches() -> None:
+    today = datetime.now(tz=UTC).date()
+    sku = generate_sku()
+    earlier = make_domain_batch(sku, 10, eta=today)
+    later = make_domain_batch(sku, 100, eta=today + timedelta(days=5))
+    product = Product(sku, [later, earlier])
+
+    first = product.allocate(make_domain_order_line(sku, 10))
+    second = product.allocate(make_domain_order_line(sku, 10))
+
+    assert first == earlier.reference
+    assert second == later.reference
+    assert earlier.available_quantity == 0
+    assert later.available_quantity == 90
+
+
+def test_keeps_batches_order_for_equal_eta() -> None:
+    sku = generate_sku()
+    first = make_domain_batch(sku, 100)
+    second = make_domain_batch(sku, 100)
+    product = Product(sku, [first, second])
+
+    allocation = product.allocate(make_domain_order_line(sku, 10))
+
+    assert allocation == first.reference
+
+
+def test_product_deallocate_returns_batch_ref_and_adds_deallocated_event() -> None:
+    sku = generate_sku()
+    batch = make_domain_batch(sku, 100)
+    product = Product(sku, [batch])
+    line = make_domain_order_line(sku, 10)
+    product.allocate(line)
+    product.events.clear()
+
+    actual = product.deallocate(line.orderid)
+
+    assert actual == [batch.reference]
+    assert batch.available_quantity == 100
+    assert product.events == [Deallocated(line.orderid, sku, 10)]
+
+
+def test_product_deallocate_finds_allocations_made_before_load() -> None:
+    sku = generate_sku()
+    batch = make_domain_batch(sku, 100)
+    line = make_domain_order_line(sku, 10)
+    batch.allocate(line)
+    product = Product(sku, [batch])
+
+    assert product.deallocate(line.orderid) == [batch.reference]
+    assert batch.available_quantity == 100
+
+
+def test_product_deallocate_returns_nothing_for_unknown_order() -> None:
+    sku = generate_sku()
+    product = Product(sku, [make_domain_batch(sku, 100)])
+
+    assert product.deallocate("unknown") == []
+    assert product.events == []
+
+
+def test_product_deallocate_frees_every_line_of_the_order() -> None:
+    sku = generate_sku()
+    first, second = make_domain_batch(sku, 10), make_domain_batch(sku, 10)
+    product = Product(sku, [first, second])
+    product.deallocate("warm-up")
+    product.allocate(OrderLine("order1", sku, 10))
+    product.allocate(OrderLine("order1", sku, 10))
+
+    actual = product.deallocate("order1")
+
+    assert actual == [first.reference, second.reference]
+    assert first.available_quantity == second.available_quantity == 10
+
+
+def test_product_deallocate_frees_allocations_located_by_caller() -> None:
+    sku = generate_sku()
+    batch = make_domain_batch(sku, 100)
+    line = make_domain_order_line(sku, 10)
+    batch.allocate(line)
+    product = Product(sku, [batch])
+
+    assert product.deallocate(line.orderid, [(batch, line)]) == [batch.reference]
+    assert batch.available_quantity == 100
+    assert product._allocations_by_orderid is None
+    assert product.events == [Deallocated(line.orderid, sku, 10)]
+
+
+def test_allocate_does_not_build_orderid_map() -> None:
+    sku = generate_sku()
+    product = Product(sku, [make_domain_batch(sku, 100)])
+
+    product.allocate(make_domain_order_line(sku, 10))
+
+    assert product._allocations_by_orderid is None
+
+
+def test_deallocated_batch_is_allocatable_again() -> None:
+    today = datetime.now(tz=UTC).date()
+    sku = generate_sku()
+    earlier = make_domain_batch(sku, 10, eta=today)
+    later = make_domain_batch(sku, 100, eta=today + timedelta(days=5))
+    product = Product(sku, [later, earlier])
+    line = make_domain_order_line(sku, 10)
+    product.allocate(line)
+
+    product.deallocate(line.orderid)
+    allocation = product.allocate(make_domain_order_line(sku, 10))
+
+    assert allocation == earlier.reference
+
+
 def _make_batch_and_line(batch_qty: int, line_qty: int) -> tuple[Batch, OrderLine]:
     sku = generate_sku()
     batch = make_domain_batch(sku, batch_qty)
@@ -0,0 +1,79 @@
+import pstats
+from pathlib import Path
+
+import pytest
+
+from patterns_book.service.profiling import ProfilingOptions, RequestProfiler
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+def test_profiles_requests_presenting_the_token(tmp_path: Path) -> None:
+    profiler = RequestProfiler(ProfilingOptions(tmp_path, token="secret"), sample=lambda: 0.5)
+
+    assert profiler.start("wrong") is None
+    assert profiler.start() is None
+    profile = profiler.start("secret")
+
+    assert profile is not None
+    profiler.finish(profile, "api_v1.allocate")
+
+
+def test_samples_requests(tmp_path: Path) -> None:
+    profiler = RequestProfiler(ProfilingOptions(tmp_path, sample_rate=0.1), sample=lambda: 0.05)
+
+    profile = profiler.start()
+
+    assert profile is not None
+    profiler.finish(profile, "api_v1.allocate")
+
+
+def test_rate_limits_profiles(tmp_path: Path, clock: FakeClock) -> None:
+    profiler = RequestProfiler(
+        ProfilingOptions(tmp_path, sample_rate=1.0, max_profiles_per_minute=1), clock=clock, sample=lambda: 0.0
+    )
+    profile = profiler.start()
+    assert profile is not None
+    profiler.finish(profile, "api_v1.allocate")
+
+    assert profiler.start() is None
+    clock.now = 60.0
+    profile = profiler.start()
+    assert profile is not None
+    profiler.finish(profile, "api_v1.allocate")
+
+
+def test_profiles_one_request_at_a_time(tmp_path: Path) -> None:
+    profiler = RequestProfiler(ProfilingOptions(tmp_path, sample_rate=1.0, max_profiles_per_minute=10))
+    profile = profiler.start()
+    assert profile is not None
+
+    assert profiler.start() is None
+    profiler.finish(profile, "api_v1.allocate")
+    profile = profiler.start()
+    assert profile is not None
+    profiler.finish(profile, "api_v1.allocate")
+
+
+def test_writes_profile_and_allocations_tagged_with_route_and_sku(tmp_path: Path) -> None:
+    profiler = RequestProfiler(ProfilingOptions(tmp_path / "profiles", sample_rate=1.0, top_allocations=3))
+    profile = profiler.start()
+    assert profile is not None
+    _ = [str(number) for number in range(1000)]
+
+    profile_path, allocations_path = profiler.finish(profile, "api_v1.allocate", "RED/CHAIR")
+
+    assert profile_path.name.endswith("-api_v1.allocate-RED_CHAIR.prof")
+    assert pstats.Stats(str(profile_path)).get_stats_profile().func_profiles
+    assert 0 < len(allocations_path.read_text().splitlines()) <= 3
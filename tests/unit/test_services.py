@@ -1,12 +1,16 @@
 import uuid
+from collections.abc import Iterable, Sequence
 from datetime import date
+from typing import Any
 
 import pytest
 
+from patterns_book.adapters.batch_loader import AbstractBatchLoader
 from patterns_book.adapters.repository import AbstractRepository
-from patterns_book.adapters.unit_of_work import AbstractUnitOfWork
+from patterns_book.adapters.unit_of_work import AbstractUnitOfWork, ConcurrencyError
+from patterns_book.adapters.views import AbstractAvailabilityView
 from patterns_book.domain import model as domain_model
-from patterns_book.service import models, services
+from patterns_book.service import metrics, models, services
 from tests.conftest import generate_sku
 
 
@@ -15,6 +19,11 @@ def uow() -> "FakeUOF":
     return FakeUOF(FakeRepository([]))
 
 
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr("patterns_book.service.services.time.sleep", lambda _: None)
+
+
 def test_allocate_returns_allocation(uow: "FakeUOF") -> None:
     sku = generate_sku()
     line = make_order_line(sku, 10)
@@ -58,6 +67,296 @@ def test_add_batch(uow: "FakeUOF") -> None:
     assert uow.committed
 
 
+def test_allocate_retries_on_concurrency_error(uow: "FakeUOF") -> None:
+    sku = generate_sku()
+    services.add_batch(make_batch(sku, 100), uow)
+    uow.conflicts = 2
+    uow.commits = 0
+    conflicts_before = metrics.concurrency_conflicts.value
+    retries_before = metrics.concurrency_retries.value
+
+    services.allocate(make_order_line(sku, 10), uow)
+
+    assert uow.commits == 1
+    assert metrics.concurrency_conflicts.value - conflicts_before == 2
+    assert metrics.concurrency_retries.value - retries_before == 2
+
+
+def test_allocate_gives_up_after_max_attempts(uow: "FakeUOF") -> None:
+    sku = generate_sku()
+    services.add_batch(make_batch(sku, 100), uow)
+    uow.conflicts = services.MAX_ATTEMPTS
+    uow.commits = 0
+
+    with pytest.raises(ConcurrencyError):
+        services.allocate(make_order_line(sku, 10), uow)
+
+    assert uow.commits == 0
+
+
+def test_deallocate_returns_batch_reference(uow: "FakeUOF") -> None:
+    sku = generate_sku()
+    line = make_order_line(sku, 10)
+    batch = make_batch(sku, 100)
+    services.add_batch(batch, uow)
+    services.allocate(line, uow)
+
+    actual = services.deallocate(models.Deallocation(orderid=line.orderid, sku=sku), uow)
+
+    assert actual == [batch.reference]
+    product = uow.products.get(sku)
+    assert product is not None
+    assert product.batches[0].available_quantity == 100
+
+
+def test_deallocate_returns_nothing_if_not_allocated(uow: "FakeUOF") -> None:
+    sku = generate_sku()
+    services.add_batch(make_batch(sku, 100), uow)
+    uow.commits = 0
+
+    actual = services.deallocate(models.Deallocation(orderid="unknown", sku=sku), uow)
+
+    assert actual == []
+    assert uow.commits == 0
+
+
+def test_deallocate_raises_error_for_invalid_sku(uow: "FakeUOF") -> None:
+    with pytest.raises(services.InvalidSkuError, match="Invalid sku NONEXISTENTSKU"):
+        services.deallocate(models.Deallocation(orderid="order1", sku="NONEXISTENTSKU"), uow)
+
+
+def test_get_availability() -> None:
+    view = FakeAvailabilityView({"sku1": [{"reference": "batch1", "eta": None, "available_quantity": 5}]})
+
+    assert services.get_availability("sku1", view) == [
+        models.BatchAvailability(reference="batch1", eta=None, available_quantity=5)
+    ]
+    with pytest.raises(services.InvalidSkuError, match="Invalid sku unknown"):
+        services.get_availability("unknown", view)
+
+
+def test_allocate_many_commits_per_sku(uow: "FakeUOF") -> None:
+    sku1, sku2 = generate_sku(), generate_sku()
+    batch1 = make_batch(sku1, 100)
+    batch2 = make_batch(sku2, 100)
+    services.add_batch(batch1, uow)
+    services.add_batch(batch2, uow)
+    uow.commits = 0
+
+    lines = [make_order_line(sku1, 10), make_order_line(sku2, 10), make_order_line(sku1, 10)]
+    results = services.allocate_many(lines, uow)
+
+    assert [result.batchref for result in results] == [batch1.reference, batch2.reference, batch1.reference]
+    assert [result.orderid for result in results] == [line.orderid for line in lines]
+    assert uow.commits == 2
+
+
+def test_allocate_many_reports_invalid_sku_per_line(uow: "FakeUOF") -> None:
+    sku = generate_sku()
+    batch = make_batch(sku, 100)
+    services.add_batch(batch, uow)
+    uow.commits = 0
+
+    results = services.allocate_many([make_order_line(sku, 10), make_order_line("NONEXISTENTSKU", 10)], uow)
+
+    assert results[0].batchref == batch.reference
+    assert results[0].error is None
+    assert results[1].batchref is None
+    assert results[1].error == "Invalid sku NONEXISTENTSKU"
+    assert uow.commits == 1
+
+
+def test_atomic_allocate_many_commits_once(uow: "FakeUOF") -> None:
+    sku1, sku2 = generate_sku(), generate_sku()
+    services.add_batch(make_batch(sku1, 100), uow)
+    services.add_batch(make_batch(sku2, 100), uow)
+    uow.commits = 0
+
+    results = services.allocate_many([make_order_line(sku1, 10), make_order_line(sku2, 10)], uow, atomic=True)
+
+    assert all(result.batchref for result in results)
+    assert uow.commits == 1
+
+
+def test_atomic_allocate_many_loads_products_in_one_call_in_sku_order() -> None:
+    repository = _RecordingRepository([])
+    uow = FakeUOF(repository)
+    services.add_batch(make_batch("sku-b", 100), uow)
+    services.add_batch(make_batch("sku-a", 100), uow)
+    lines = [make_order_line("sku-b", 10), make_order_line("sku-a", 10), make_order_line("sku-b", 5)]
+
+    results = services.allocate_many(lines, uow, atomic=True)
+
+    assert [(result.orderid, result.sku) for result in results] == [(line.orderid, line.sku) for line in lines]
+    assert all(result.batchref for result in results)
+    assert repository.loaded == [["sku-a", "sku-b"]]
+
+
+def test_atomic_allocate_many_does_not_commit_on_error(uow: "FakeUOF") -> None:
+    sku = generate_sku()
+    services.add_batch(make_batch(sku, 100), uow)
+    uow.commits = 0
+
+    results = services.allocate_many(
+        [make_order_line(sku, 10), make_order_line("NONEXISTENTSKU", 10)], uow, atomic=True
+    )
+
+    assert [result.batchref for result in results] == [None, None]
+    assert results[1].error == "Invalid sku NONEXISTENTSKU"
+    assert uow.commits == 0
+
+
+def test_allocate_many_reports_out_of_stock_per_line(uow: "FakeUOF") -> None:
+    sku = generate_sku()
+    services.add_batch(make_batch(sku, 15), uow)
+
+    results = services.allocate_many([make_order_line(sku, 10), make_order_line(sku, 10)], uow)
+
+    assert results[0].error is None
+    assert results[1].batchref is None
+    assert results[1].error == "Out of stock"
+
+
+def test_atomic_allocate_many_does_not_commit_when_out_of_stock(uow: "FakeUOF") -> None:
+    sku1, sku2 = generate_sku(), generate_sku()
+    services.add_batch(make_batch(sku1, 100), uow)
+    services.add_batch(make_batch(sku2, 5), uow)
+    uow.commits = 0
+
+    results = services.allocate_many([make_order_line(sku1, 10), make_order_line(sku2, 10)], uow, atomic=True)
+
+    assert [result.batchref for result in results] == [None, None]
+    assert results[1].error == "Out of stock"
+    assert uow.commits == 0
+
+
+def test_allocate_many_retries_conflicting_sku(uow: "FakeUOF") -> None:
+    sku = generate_sku()
+    services.add_batch(make_batch(sku, 100), uow)
+    uow.commits = 0
+    uow.conflicts = 1
+
+    services.allocate_many([make_order_line(sku, 10)], uow)
+
+    assert uow.commits == 1
+    assert metrics.concurrency_retries.value >= 1
+
+
+def test_allocate_many_reports_conflict_per_sku(uow: "FakeUOF") -> None:
+    sku1, sku2 = generate_sku(), generate_sku()
+    services.add_batch(make_batch(sku1, 100), uow)
+    services.add_batch(make_batch(sku2, 100), uow)
+    uow.conflicts = services.MAX_ATTEMPTS
+
+    results = services.allocate_many([make_order_line(sku1, 10), make_order_line(sku2, 10)], uow)
+
+    assert results[0].error == f"Conflicting update of {sku1}"
+    assert results[1].error is None
+
+
+def test_allocate_order_commits_once(uow: "FakeUOF") -> None:
+    sku1, sku2 = generate_sku(), generate_sku()
+    batch1, batch2 = make_batch(sku1, 100), make_batch(sku2, 100)
+    for batch in (batch1, batch2):
+        services.add_batch(batch, uow)
+    uow.commits = 0
+
+    order = models.Order(
+        orderid="order1", lines=[models.OrderItem(sku=sku2, qty=10), models.OrderItem(sku=sku1, qty=5)]
+    )
+    batchrefs = services.allocate_order(order, uow)
+
+    assert batchrefs == {sku2: batch2.reference, sku1: batch1.reference}
+    assert uow.commits == 1
+
+
+def test_allocate_order_is_all_or_nothing(uow: "FakeUOF") -> None:
+    sku1, sku2 = generate_sku(), generate_sku()
+    services.add_batch(make_batch(sku1, 100), uow)
+    services.add_batch(make_batch(sku2, 5), uow)
+    uow.commits = 0
+
+    order = models.Order(
+        orderid="order1", lines=[models.OrderItem(sku=sku1, qty=10), models.OrderItem(sku=sku2, qty=10)]
+    )
+    with pytest.raises(services.OutOfStockError, match=f"Out of stock for sku {sku2}"):
+        services.allocate_order(order, uow)
+
+    assert uow.commits == 0
+
+
+def test_allocate_order_rejects_unknown_skus(uow: "FakeUOF") -> None:
+    sku = generate_sku()
+    services.add_batch(make_batch(sku, 100), uow)
+    uow.commits = 0
+
+    order = models.Order(
+        orderid="order1", lines=[models.OrderItem(sku=sku, qty=1), models.OrderItem(sku="UNKNOWN", qty=1)]
+    )
+    with pytest.raises(services.InvalidSkuError, match="Invalid sku UNKNOWN"):
+        services.allocate_order(order, uow)
+
+    assert uow.commits == 0
+
+
+def test_order_rejects_duplicate_skus() -> None:
+    with pytest.raises(ValueError, match="distinct skus"):
+        models.Order(orderid="order1", lines=[models.OrderItem(sku="sku", qty=1), models.OrderItem(sku="sku", qty=2)])
+
+
+def test_import_batches_loads_in_chunks() -> None:
+    loader = FakeBatchLoader()
+    rows = [{"reference": str(i), "sku": "sku1", "qty": 10} for i in range(5)]
+
+    result = services.import_batches(rows, loader, chunk_size=2)
+
+    assert [len(chunk) for chunk in loader.chunks] == [2, 2, 1]
+    assert result == models.ImportResult(imported=5)
+
+
+def test_import_batches_reports_invalid_rows_and_skipped_batches() -> None:
+    loader = FakeBatchLoader(existing={"batch1"})
+    rows = [
+        {"reference": "batch1", "sku": "sku1", "qty": 10},
+        {"reference": "batch2", "sku": "sku1", "qty": 0},
+        "not json",
+        {"reference": "batch3", "sku": "sku1", "qty": 10, "eta": "2021-01-01"},
+    ]
+
+    result = services.import_batches(rows, loader)
+
+    assert (result.imported, result.skipped, result.invalid) == (1, 1, 2)
+    assert result.errors[0].startswith("row 2: qty:")
+    assert result.errors[1].startswith("row 3: row:")
+
+
+def test_import_batches_caps_reported_errors(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(services, "MAX_REPORTED_IMPORT_ERRORS", 2)
+
+    result = services.import_batches(["invalid"] * 5, FakeBatchLoader())
+
+    assert result.invalid == 5
+    assert len(result.errors) == 2
+
+
+class FakeBatchLoader(AbstractBatchLoader):
+    def __init__(self, existing: set[str] | None = None) -> None:
+        self.chunks: list[list[models.Batch]] = []
+        self._existing = existing or set()
+
+    def load(self, batches: Sequence[models.Batch]) -> int:
+        self.chunks.append(list(batches))
+        return sum(batch.reference not in self._existing for batch in batches)
+
+
+class FakeAvailabilityView(AbstractAvailabilityView):
+    def __init__(self, batches: dict[str, list[dict[str, Any]]]) -> None:
+        self._batches = batches
+
+    def get(self, sku: str) -> list[dict[str, Any]] | None:
+        return self._batches.get(sku)
+
+
 class FakeRepository(AbstractRepository[domain_model.Product]):
     def __init__(self, products: list[domain_model.Product]) -> None:
         self._products = set(products)
@@ -72,6 +371,16 @@ class FakeRepository(AbstractRepository[domain_model.Product]):
         return list(self._products)
 
 
+class _RecordingRepository(FakeRepository):
+    def __init__(self, products: list[domain_model.Product]) -> None:
+        super().__init__(products)
+        self.loaded: list[list[str]] = []
+
+    def get_many(self, skus: Iterable[str]) -> Sequence[domain_model.Product]:
+        self.loaded.append(sorted(set(skus)))
+        return super().get_many(self.loaded[-1])
+
+
 class FakeUOF(AbstractUnitOfWork):
     def __init__(
         self,
@@ -79,9 +388,15 @@ class FakeUOF(AbstractUnitOfWork):
     ) -> None:
         self.products = products
         self.committed = False
+        self.commits = 0
+        self.conflicts = 0
 
     def commit(self) -> None:
+        if self.conflicts:
+            self.conflicts -= 1
+            raise ConcurrencyError
         self.committed = True
+        self.commits += 1
 
     def rollback(self) -> None:
         pass
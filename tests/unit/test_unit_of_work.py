@@ -1,9 +1,20 @@
 from unittest.mock import Mock
 
 import pytest
-
-from patterns_book.adapters.unit_of_work import SqlAlchemyUnitOfWork
-from patterns_book.domain.events import Event
+from sqlalchemy.orm.exc import StaleDataError
+
+from patterns_book.adapters import unit_of_work
+from patterns_book.adapters.repository import LockMode
+from patterns_book.adapters.unit_of_work import (
+    AsyncUnitOfWorkOptions,
+    ConcurrencyError,
+    SqlAlchemyUnitOfWork,
+    UnitOfWorkOptions,
+    configure_async_unit_of_work,
+    configure_unit_of_work,
+)
+from patterns_book.domain.events import Event, OutOfStock
+from patterns_book.service import metrics
 from patterns_book.service.message_bus import AbstractMessageBus
 
 
@@ -62,6 +73,60 @@ def test_sqlalchemy_uow_context_manager_rollback(
     session.commit.assert_not_called()
 
 
+def test_sqlalchemy_uow_commit_raises_concurrency_error_on_stale_data(
+    session: Mock,
+    products: Mock,
+    message_bus: "_FakeMessageBus",
+) -> None:
+    session.commit.side_effect = StaleDataError
+    uow = SqlAlchemyUnitOfWork(products, session, message_bus)
+
+    with pytest.raises(ConcurrencyError), uow:
+        uow.commit()
+
+    assert message_bus.handled_events == []
+    assert products.seen[0].events == []
+
+
+def test_sqlalchemy_uow_commit_writes_events_to_outbox(message_bus: "_FakeMessageBus") -> None:
+    session = Mock(spec=["commit", "rollback", "execute"])
+    products = Mock(seen=[Mock(events=[OutOfStock("sku1")])])
+    uow = SqlAlchemyUnitOfWork(products, session, message_bus, use_outbox=True)
+
+    uow.commit()
+
+    session.execute.assert_called_once()
+    assert session.execute.call_args.args[1] == [{"event_type": "OutOfStock", "payload": {"sku": "sku1"}}]
+    session.commit.assert_called_once()
+    assert message_bus.handled_events == []
+
+
+def test_sqlalchemy_uow_commit_publishes_identical_events_once(
+    session: Mock,
+    message_bus: "_FakeMessageBus",
+) -> None:
+    products = Mock(seen=[Mock(events=[OutOfStock("sku1"), OutOfStock("sku1"), OutOfStock("sku2")])])
+    uow = SqlAlchemyUnitOfWork(products, session, message_bus)
+    suppressed_before = metrics.suppressed_events.value("duplicate")
+
+    uow.commit()
+
+    assert message_bus.handled_events == [OutOfStock("sku1"), OutOfStock("sku2")]
+    assert metrics.suppressed_events.value("duplicate") - suppressed_before == 1
+
+
+def test_configuring_async_unit_of_work_keeps_sync_options(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(unit_of_work, "_options", UnitOfWorkOptions())
+    monkeypatch.setattr(unit_of_work, "_async_options", AsyncUnitOfWorkOptions())
+    sync_options = UnitOfWorkOptions(lock_mode=LockMode.FOR_UPDATE, lock_timeout_ms=100)
+
+    configure_unit_of_work(sync_options)
+    configure_async_unit_of_work(AsyncUnitOfWorkOptions(use_outbox=True))
+
+    assert unit_of_work._options is sync_options
+    assert unit_of_work._async_options.use_outbox
+
+
 class _FakeMessageBus(AbstractMessageBus):
     def __init__(self) -> None:
         self.handled_events: list[Event] = []